@@ -0,0 +1,318 @@
+import os
+import sys
+import json
+import time
+import stat
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+
+# ------------------------------------------------------------------------------
+# End-to-end download benchmark against a local fake YouTube (benchmarks/fake_youtube.py)
+# - The fake server runs in its own process, with the given latency, per-connection bandwidth and throttling
+# - Each scenario runs in a fresh process (so its peak memory is its own): "video" downloads a single video
+#   with playlist_dl.download_video (the non-interactive path of batch mode), "playlist" downloads the
+#   whole playlist with download_playlist
+# - The player and playlist responses are fetched from the fake server and stored in the metadata cache
+#   before the timed part, the way get_video_info and get_playlist_info store YouTube's (pytubefix can
+#   only talk to youtube.com). That time is reported as `metadata_s`
+# - The media is synthetic, so the merges use a stand-in for ffmpeg that copies both streams into the
+#   output (the disk I/O of ffmpeg's stream copy, without the container parsing)
+# - Reported: items/s, MB/s (media bytes downloaded per second of wall time), peak RSS of the downloader
+#   and the bytes written to disk (/proc/self/io, Linux only)
+# - Results are saved in benchmarks/results/ with the commit they were measured on, and compared with
+#   the last saved result of the same configuration
+#
+# Usage: python benchmarks/download.py [--videos 8] [--video-size 20M] [--audio-size 3M] [--workers 4]
+#                                      [--latency 0.02] [--bandwidth 50M] [--throttle 0.05] [--scratch-dir DIR]
+#                                      [--scenario video playlist]
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+results_dir = os.path.join(project_root, "benchmarks", "results")
+
+# Metrics compared between runs, and whether higher is better
+compared_metrics = {
+    "items_per_s": True,
+    "mb_per_s": True,
+    "peak_rss_mb": False,
+    "disk_written_mb": False,
+}
+
+# Stream copy stand-in for ffmpeg: concatenates the `-i` inputs into the output (the last argument)
+ffmpeg_stand_in = """
+import sys
+import shutil
+args = sys.argv[1:]
+inputs = [args[idx + 1] for (idx, arg) in enumerate(args) if arg == "-i"]
+with open(args[-1], "wb") as output:
+    for path in inputs:
+        with open(path, "rb") as file:
+            shutil.copyfileobj(file, output, 1024 * 1024)
+"""
+
+# ------------------------------------------------------------------------------
+# Peak resident memory of this process in bytes, None where it can't be measured
+# (not measured for the merge processes: a child's peak starts at the parent's when it's forked)
+def get_peak_rss() -> int | None:
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # Kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+# Bytes this process (and its finished children) caused to be written to storage
+def get_disk_written() -> int | None:
+    try:
+        with open("/proc/self/io", "r") as file:
+            fields = dict(line.split(": ") for line in file.read().splitlines())
+    except OSError:
+        return None
+    return int(fields["write_bytes"])
+
+def to_mb(n_bytes: int | None) -> float | None:
+    return None if n_bytes is None else round(n_bytes / 1024 / 1024, 2)
+
+# ------------------------------------------------------------------------------
+# Store the fake server's playlist and player responses in the metadata cache
+# Returns the playlist URL
+def seed_metadata(server_url: str) -> str:
+    from utils.transport import get_session
+    from utils.metadata_cache import get_cache, get_url_expiry, url_expiry_margin, playlist_ttl
+    from benchmarks.fake_youtube import playlist_id
+
+    session = get_session()
+    response = session.get(f"{server_url}/youtubei/v1/browse", params={"list": playlist_id})
+    response.raise_for_status()
+    playlist = response.json()
+    video_urls = [f"https://www.youtube.com/watch?v={video_id}" for video_id in playlist["videoIds"]]
+    get_cache().set(f"playlist:{playlist_id}", {"title": playlist["title"], "video_urls": video_urls}, playlist_ttl)
+
+    for video_id in playlist["videoIds"]:
+        response = session.post(f"{server_url}/youtubei/v1/player", json={"videoId": video_id})
+        response.raise_for_status()
+        player = response.json()
+        streams = [get_stream_data(f) for f in player["streamingData"]["adaptiveFormats"]]
+        ttl = min(get_url_expiry(s["url"]) for s in streams) - time.time() - url_expiry_margin
+        get_cache().set(f"video:{video_id}", {"video_id": video_id, "title": player["videoDetails"]["title"], "streams": streams}, ttl)
+    return f"https://www.youtube.com/playlist?list={playlist_id}"
+
+# An adaptive format of a player response, as CachedStream stores it (the attributes pytubefix's Stream derives from it)
+def get_stream_data(f: dict) -> dict:
+    (mime_type, _, codecs) = f["mimeType"].partition(";")
+    (kind, subtype) = mime_type.split("/")
+    codec = codecs.split("=")[1].strip('"') if "=" in codecs else None
+    is_video = kind == "video"
+    return {
+        "itag": f["itag"],
+        "url": f["url"],
+        "mime_type": mime_type,
+        "subtype": subtype,
+        "resolution": f.get("qualityLabel"),
+        "abr": None if is_video else f"{round(f['averageBitrate'] / 1000)}kbps",
+        "video_codec": codec if is_video else None,
+        "audio_codec": None if is_video else codec,
+        "includes_video_track": is_video,
+        "includes_audio_track": not is_video,
+        "is_dash": True,
+        "filesize": int(f["contentLength"]),
+    }
+
+# ------------------------------------------------------------------------------
+# Run one scenario in this process and write its result (JSON) to `result_path`
+# The downloader's own output goes to stdout/stderr as usual
+def run_scenario(scenario: str, server_url: str, args, result_path: str) -> int:
+    from pytubefix import innertube, YouTube
+    from utils import playlist_dl, staging
+
+    with tempfile.TemporaryDirectory(prefix="yt-dl-bench-") as work_dir:
+        innertube._cache_dir = os.path.join(work_dir, "cache")
+        ffmpeg_path = os.path.join(work_dir, "ffmpeg")
+        with open(ffmpeg_path, "w") as file:
+            file.write(f"#!{sys.executable}\n{ffmpeg_stand_in}")
+        os.chmod(ffmpeg_path, os.stat(ffmpeg_path).st_mode | stat.S_IEXEC)
+        os.environ["FFMPEG_PATH"] = ffmpeg_path
+        file_dir = os.path.join(work_dir, "videos")
+        staging.configure(args.scratch_dir)
+
+        started_at = time.perf_counter()
+        playlist_url = seed_metadata(server_url)
+        metadata_s = time.perf_counter() - started_at
+
+        disk_before = get_disk_written()
+        started_at = time.perf_counter()
+        if scenario == "video":
+            yt = YouTube(f"https://www.youtube.com/watch?v={args.first_video_id}", use_oauth=True, allow_oauth_cache=True)
+            result = playlist_dl.download_video(yt, file_dir, args.format, "1080p", "160kbps", None)
+            statuses = [playlist_dl.get_status(result)]
+        else:
+            items = playlist_dl.download_playlist(playlist_url, workers=args.workers, format=args.format, file_dir=file_dir,
+                                                  min_resolution="1080p", min_bitrate="160kbps")
+            statuses = [status for (_, status) in items]
+        duration = time.perf_counter() - started_at
+        disk_after = get_disk_written()
+
+        n_downloaded = statuses.count("Downloaded")
+        media_bytes = n_downloaded * (args.video_size + args.audio_size)
+        output_bytes = sum(os.path.getsize(os.path.join(root, name)) for (root, _, names) in os.walk(file_dir) for name in names)
+        result = {
+            "items": len(statuses),
+            "downloaded": n_downloaded,
+            "failed": statuses.count("Failed"),
+            "duration_s": round(duration, 3),
+            "metadata_s": round(metadata_s, 3),
+            "items_per_s": round(n_downloaded / duration, 3),
+            "mb_per_s": round(media_bytes / 1024 / 1024 / duration, 2),
+            "peak_rss_mb": to_mb(get_peak_rss()),
+            "disk_written_mb": to_mb(disk_after - disk_before) if disk_before is not None else None,
+            "output_mb": to_mb(output_bytes),
+        }
+    with open(result_path, "w") as file:
+        json.dump(result, file)
+    return 0 if result["failed"] == 0 and n_downloaded == len(statuses) else 1
+
+# ------------------------------------------------------------------------------
+# Start the fake server in its own process, return the process and its URL
+def start_server(args) -> tuple[subprocess.Popen, str]:
+    command = [
+        sys.executable, os.path.join(project_root, "benchmarks", "fake_youtube.py"),
+        "--videos", str(args.videos), "--video-size", str(args.video_size), "--audio-size", str(args.audio_size),
+        "--latency", str(args.latency), "--throttle", str(args.throttle),
+    ]
+    if args.bandwidth:
+        command += ["--bandwidth", args.bandwidth]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line.startswith("Serving on "):
+        server.kill()
+        raise RuntimeError("The fake server didn't start")
+    return (server, line[len("Serving on "):].strip())
+
+# ------------------------------------------------------------------------------
+def get_commit() -> str | None:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root, capture_output=True, text=True, check=True).stdout.strip()
+        changes = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=project_root, capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return f"{commit}-dirty" if changes.strip() else commit
+
+# The last saved result of the same configuration
+def load_previous(config: dict) -> dict | None:
+    if not os.path.isdir(results_dir):
+        return None
+    for file_name in sorted(os.listdir(results_dir), reverse=True):
+        if not file_name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(results_dir, file_name), "r") as file:
+                previous = json.load(file)
+        except (OSError, ValueError):
+            continue
+        if previous.get("config") == config:
+            return previous
+    return None
+
+def print_comparison(previous: dict, scenarios: dict):
+    print(f"Compared with {previous['commit']} ({previous['date']}):")
+    for (scenario, result) in scenarios.items():
+        before = previous["scenarios"].get(scenario)
+        if before is None:
+            continue
+        for (metric, higher_is_better) in compared_metrics.items():
+            if result.get(metric) is None or not before.get(metric):
+                continue
+            change = (result[metric] - before[metric]) / before[metric] * 100
+            better = (change > 0) == higher_is_better
+            print(f"  {scenario:8} {metric:18} {before[metric]:10} -> {result[metric]:10}  {change:+6.1f}%{'' if abs(change) < 5 else ' (better)' if better else ' (worse)'}")
+
+# ------------------------------------------------------------------------------
+def main() -> int:
+    parser = argparse.ArgumentParser(description="End-to-end download benchmark against a local fake YouTube")
+    parser.add_argument("--videos", type=int, default=8, help="Number of videos in the playlist")
+    parser.add_argument("--video-size", default="20M", help="Size of each video stream")
+    parser.add_argument("--audio-size", default="3M", help="Size of each audio stream")
+    parser.add_argument("--workers", type=int, default=4, help="Number of playlist videos downloaded at the same time")
+    parser.add_argument("--format", default="webm", choices=["webm", "mp4"])
+    parser.add_argument("--latency", type=float, default=0.02, help="Seconds before each response of the server")
+    parser.add_argument("--bandwidth", default=None, help="Bytes per second of each media connection, e.g. 10M (unlimited by default)")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Probability that a media request is throttled (429)")
+    parser.add_argument("--scratch-dir", default=None, help="Download and merge into this directory (see --scratch-dir of main.py)")
+    parser.add_argument("--scenario", nargs="+", default=["video", "playlist"], choices=["video", "playlist"])
+    parser.add_argument("--no-save", action="store_true", help="Don't save the results")
+    parser.add_argument("--verbose", action="store_true", help="Show the downloader's output")
+    # Internal: run a single scenario against a running server
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--server", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    from benchmarks.fake_youtube import parse_size, get_video_id
+    args.video_size = parse_size(args.video_size)
+    args.audio_size = parse_size(args.audio_size)
+    args.first_video_id = get_video_id(0)
+    if args.run:
+        return run_scenario(args.run, args.server, args, args.result)
+
+    config = {key: getattr(args, key) for key in ("videos", "video_size", "audio_size", "workers", "format", "latency", "bandwidth", "throttle", "scratch_dir")}
+    (server, server_url) = start_server(args)
+    scenarios = {}
+    failed = False
+    try:
+        for scenario in args.scenario:
+            with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as file:
+                result_path = file.name
+            command = [sys.executable, os.path.abspath(__file__), *sys.argv[1:], "--run", scenario, "--server", server_url, "--result", result_path]
+            output = None if args.verbose else subprocess.DEVNULL
+            process = subprocess.run(command, stdout=output, stderr=output)
+            try:
+                with open(result_path, "r") as file:
+                    scenarios[scenario] = json.load(file)
+            except ValueError:
+                print(f"FAIL: the {scenario} scenario crashed (exit code {process.returncode}), rerun with --verbose")
+                return 1
+            finally:
+                os.remove(result_path)
+            if process.returncode != 0:
+                failed = True
+    finally:
+        server.kill()
+
+    for (scenario, result) in scenarios.items():
+        print(f"{scenario}: {result['downloaded']}/{result['items']} videos in {result['duration_s']:.2f}s "
+              f"(+{result['metadata_s']:.2f}s metadata), {result['items_per_s']:.2f} items/s, {result['mb_per_s']:.1f}MB/s, "
+              f"peak RSS {result['peak_rss_mb']}MB, "
+              f"disk written {result['disk_written_mb']}MB for {result['output_mb']}MB of output")
+
+    previous = load_previous(config)
+    if previous is not None:
+        print_comparison(previous, scenarios)
+    if not args.no_save:
+        now = datetime.now(timezone.utc)
+        commit = get_commit()
+        saved = {
+            "commit": commit,
+            "date": now.isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": config,
+            "scenarios": scenarios,
+        }
+        os.makedirs(results_dir, exist_ok=True)
+        path = os.path.join(results_dir, f"{now:%Y%m%d-%H%M%S}-{commit or 'unknown'}.json")
+        with open(path, "w") as file:
+            json.dump(saved, file, indent=2)
+        print(f"Saved to {os.path.relpath(path, project_root)}")
+
+    if failed:
+        print("FAIL: some videos weren't downloaded, rerun with --verbose")
+    return 1 if failed else 0
+
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main())
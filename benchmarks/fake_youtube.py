@@ -0,0 +1,245 @@
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ------------------------------------------------------------------------------
+# Local stand-in for YouTube's metadata and media servers, for the download benchmark (benchmarks/download.py)
+# - /youtubei/v1/player?videoId=ID: a synthetic innertube player response (videoDetails and the DASH
+#   adaptiveFormats of streamingData, with their content lengths and signed-looking URLs)
+# - /youtubei/v1/browse?list=ID: the title and video ids of a playlist (a single page, unlike YouTube's)
+# - /videoplayback?id=ID&itag=ITAG: the media of a stream, with HEAD and Range support. The bytes are
+#   deterministic (a pseudo-random block per stream, repeated), so two runs transfer the same data
+# Every response waits `latency` seconds first, media is sent at most `bandwidth` bytes per second on each
+# connection, and a media request is answered with 429 (and Retry-After) with probability `throttle`
+#
+# Usage: python benchmarks/fake_youtube.py [--port 0] [--videos 8] [--video-size 20M] [--audio-size 3M]
+#                                          [--latency 0.02] [--bandwidth 50M] [--throttle 0.05]
+
+# The formats of every video: 1080p video and the best audio, in webm and mp4
+formats = [
+    {"itag": 248, "mimeType": 'video/webm; codecs="vp9"', "qualityLabel": "1080p", "width": 1920, "height": 1080, "averageBitrate": 2500000},
+    {"itag": 137, "mimeType": 'video/mp4; codecs="avc1.640028"', "qualityLabel": "1080p", "width": 1920, "height": 1080, "averageBitrate": 4000000},
+    {"itag": 251, "mimeType": 'audio/webm; codecs="opus"', "audioQuality": "AUDIO_QUALITY_MEDIUM", "averageBitrate": 160000},
+    {"itag": 140, "mimeType": 'audio/mp4; codecs="mp4a.40.2"', "audioQuality": "AUDIO_QUALITY_MEDIUM", "averageBitrate": 128000},
+]
+
+playlist_id = "PLbenchmark"
+block_size = 256 * 1024             # Size of the block repeated in each stream's media
+chunk_size = 64 * 1024              # Media is written (and rate limited) in chunks of this size
+url_ttl = 6 * 60 * 60               # The `expire` parameter of the media URLs, like YouTube's
+
+# ------------------------------------------------------------------------------
+# Parse a size like "512K", "20M" or "1G"
+def parse_size(value: str) -> int:
+    multipliers = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    value = value.strip().upper().rstrip("B")
+    if value and value[-1] in multipliers:
+        return int(float(value[:-1]) * multipliers[value[-1]])
+    return int(value)
+
+def get_video_id(idx: int) -> str:
+    return f"bench{idx:06d}"
+
+# ------------------------------------------------------------------------------
+class FakeYouTubeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], n_videos: int = 8, video_size: int = 20 * 1024 ** 2, audio_size: int = 3 * 1024 ** 2,
+                 latency: float = 0.0, bandwidth: int | None = None, throttle: float = 0.0, retry_after: float = 0.2):
+        super().__init__(address, FakeYouTubeHandler)
+        self.n_videos = n_videos
+        self.video_size = video_size
+        self.audio_size = audio_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.throttle = throttle
+        self.retry_after = retry_after
+        self.blocks: dict[tuple[str, int], bytes] = {}
+        self.blocks_lock = threading.Lock()
+        # Requests answered, by kind ("player", "browse", "media", "throttled")
+        self.counts: dict[str, int] = {}
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, kind: str):
+        with self.blocks_lock:
+            self.counts[kind] = self.counts.get(kind, 0) + 1
+
+    # --------------------------------------------------------------------------
+    def get_size(self, itag: int) -> int:
+        return self.video_size if any(f["itag"] == itag and "qualityLabel" in f for f in formats) else self.audio_size
+
+    def get_block(self, video_id: str, itag: int) -> bytes:
+        with self.blocks_lock:
+            key = (video_id, itag)
+            if key not in self.blocks:
+                self.blocks[key] = random.Random(f"{video_id}:{itag}").randbytes(block_size)
+            return self.blocks[key]
+
+    # --------------------------------------------------------------------------
+    def get_player_response(self, video_id: str) -> dict:
+        expire = int(time.time()) + url_ttl
+        adaptive_formats = []
+        for f in formats:
+            size = self.get_size(f["itag"])
+            adaptive_formats.append({
+                **f,
+                "url": f"{self.url}/videoplayback?id={video_id}&itag={f['itag']}&expire={expire}",
+                "contentLength": str(size),
+                "bitrate": f["averageBitrate"],
+                "approxDurationMs": str(int(size * 8 * 1000 / f["averageBitrate"])),
+            })
+        return {
+            "playabilityStatus": {"status": "OK"},
+            "videoDetails": {"videoId": video_id, "title": f"Benchmark video {video_id}", "author": "Benchmark", "lengthSeconds": "60"},
+            "streamingData": {"expiresInSeconds": str(url_ttl), "formats": [], "adaptiveFormats": adaptive_formats},
+        }
+
+    def get_browse_response(self) -> dict:
+        return {"title": "Benchmark playlist", "videoIds": [get_video_id(idx) for idx in range(self.n_videos)]}
+
+# ------------------------------------------------------------------------------
+class FakeYouTubeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The headers and the body are separate writes, with Nagle's algorithm each keep-alive
+    # response would wait for the client's delayed ACK (~40ms)
+    disable_nagle_algorithm = True
+    server: FakeYouTubeServer
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    # innertube requests are POSTs with the video id in the JSON body
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        try:
+            video_id = json.loads(body or b"{}").get("videoId")
+        except ValueError:
+            video_id = None
+        self.handle_request(send_body=True, video_id=video_id)
+
+    # --------------------------------------------------------------------------
+    def handle_request(self, send_body: bool, video_id: str | None = None):
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        query = {key: values[0] for (key, values) in parse_qs(url.query).items()}
+        if url.path == "/youtubei/v1/player" and (video_id or query.get("videoId")):
+            self.server.count("player")
+            self.send_json(self.server.get_player_response(video_id or query["videoId"]), send_body)
+        elif url.path == "/youtubei/v1/browse" and query.get("list") == playlist_id:
+            self.server.count("browse")
+            self.send_json(self.server.get_browse_response(), send_body)
+        elif url.path == "/videoplayback" and "id" in query and query.get("itag", "").isdigit():
+            self.send_media(query["id"], int(query["itag"]), send_body)
+        else:
+            self.send_error(404)
+
+    def send_json(self, body: dict, send_body: bool):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data)
+
+    # --------------------------------------------------------------------------
+    def send_media(self, video_id: str, itag: int, send_body: bool):
+        if send_body and random.random() < self.server.throttle:
+            self.server.count("throttled")
+            self.send_response(429)
+            self.send_header("Retry-After", str(self.server.retry_after))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.server.count("media")
+        size = self.server.get_size(itag)
+        (start, end) = (0, size - 1)
+        byte_range = self.headers.get("Range", "")
+        if byte_range.startswith("bytes="):
+            (first, _, last) = byte_range[len("bytes="):].partition("-")
+            start = int(first or 0)
+            end = min(int(last), size - 1) if last else size - 1
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        if not send_body:
+            return
+
+        block = self.server.get_block(video_id, itag)
+        bandwidth = self.server.bandwidth
+        started_at = time.monotonic()
+        sent = 0
+        offset = start
+        while offset <= end:
+            n_bytes = min(chunk_size, end - offset + 1)
+            block_offset = offset % block_size
+            chunk = block[block_offset:block_offset + n_bytes]
+            if len(chunk) < n_bytes:
+                chunk += block[:n_bytes - len(chunk)]
+            try:
+                self.wfile.write(chunk)
+            except ConnectionError:
+                # The client went away (e.g. a worker killed in a test)
+                return
+            offset += n_bytes
+            sent += n_bytes
+            if bandwidth:
+                ahead = sent / bandwidth - (time.monotonic() - started_at)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    def log_message(self, *args):
+        pass
+
+# ------------------------------------------------------------------------------
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Local fake YouTube server for the benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=0, help="Port to listen on (0 picks a free one)")
+    parser.add_argument("--videos", type=int, default=8, help="Number of videos in the playlist")
+    parser.add_argument("--video-size", default="20M", help="Size of each video stream")
+    parser.add_argument("--audio-size", default="3M", help="Size of each audio stream")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds before each response")
+    parser.add_argument("--bandwidth", default=None, help="Bytes per second of each media connection, e.g. 10M (unlimited by default)")
+    parser.add_argument("--throttle", type=float, default=0.0, help="Probability that a media request is answered with 429")
+    parser.add_argument("--retry-after", type=float, default=0.2, help="Retry-After of the 429 responses, in seconds")
+    args = parser.parse_args()
+
+    server = FakeYouTubeServer(
+        (args.host, args.port), args.videos, parse_size(args.video_size), parse_size(args.audio_size),
+        args.latency, parse_size(args.bandwidth) if args.bandwidth else None, args.throttle, args.retry_after,
+    )
+    # The first line tells the benchmark where the server is
+    print(f"Serving on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main())
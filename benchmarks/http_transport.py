@@ -0,0 +1,134 @@
+import os
+import ssl
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ------------------------------------------------------------------------------
+# Benchmark of the pooled HTTP transport against pytubefix's own requests
+# - A local HTTPS server (self-signed certificate, made with openssl) stands in for YouTube
+# - The same small GET requests are sent with a new urlopen connection each (pytubefix's original
+#   _execute_request) and through utils.transport (keep-alive connections from the shared pool)
+# - Both are run sequentially (like pytubefix's metadata requests) and from several threads
+#
+# Usage: python benchmarks/http_transport.py [--requests 200] [--threads 8] [--size 2048]
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from utils import transport
+
+# ------------------------------------------------------------------------------
+# Local HTTPS server returning `size` bytes for every request (HTTP/1.1, so connections are kept alive)
+def start_server(cert_dir: str, size: int) -> ThreadingHTTPServer:
+    body = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # The headers and the body are separate writes, with Nagle's algorithm each keep-alive
+        # response would wait for the client's delayed ACK (~40ms)
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    cert_path = os.path.join(cert_dir, "cert.pem")
+    key_path = os.path.join(cert_dir, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+         "-addext", "subjectAltName=DNS:localhost", "-keyout", key_path, "-out", cert_path],
+        capture_output=True, check=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_path, key_path)
+
+    server = ThreadingHTTPServer(("localhost", 0), Handler)
+    server.daemon_threads = True
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# ------------------------------------------------------------------------------
+# Send `n_requests` GETs with `fetch(url)` from `n_threads` threads, return the wall time
+def run(fetch, url: str, n_requests: int, n_threads: int) -> float:
+    errors = []
+    def worker(count):
+        try:
+            for _ in range(count):
+                fetch(url)
+        except Exception as e:
+            errors.append(e)
+
+    counts = [n_requests // n_threads + (1 if idx < n_requests % n_threads else 0) for idx in range(n_threads)]
+    threads = [threading.Thread(target=worker, args=(count,)) for count in counts]
+    started_at = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return time.perf_counter() - started_at
+
+# ------------------------------------------------------------------------------
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Pooled HTTP transport benchmark")
+    parser.add_argument("--requests", type=int, default=200, help="Number of requests per run")
+    parser.add_argument("--threads", type=int, default=8, help="Number of threads of the concurrent run")
+    parser.add_argument("--size", type=int, default=2048, help="Size of each response in bytes")
+    args = parser.parse_args()
+
+    if shutil.which("openssl") is None:
+        print("FAIL: openssl is needed to make the server's certificate")
+        return 1
+
+    with tempfile.TemporaryDirectory(prefix="yt-dl-bench-") as cert_dir:
+        server = start_server(cert_dir, args.size)
+        url = f"https://localhost:{server.server_address[1]}/videoplayback?id=bench"
+
+        # urlopen, as pytubefix calls it (a new connection and TLS handshake for every request)
+        context = ssl.create_default_context(cafile=os.path.join(cert_dir, "cert.pem"))
+        def fetch_urlopen(url):
+            request = urllib.request.Request(url, headers=transport.default_headers)
+            with urllib.request.urlopen(request, context=context, timeout=transport.default_timeout) as response:
+                response.read()
+
+        # The shared session (trusting the server's certificate, REQUESTS_CA_BUNDLE would override it)
+        session = transport.get_session()
+        session.trust_env = False
+        session.verify = os.path.join(cert_dir, "cert.pem")
+        def fetch_pooled(url):
+            transport.execute_request(url).read()
+
+        failed = False
+        for n_threads in (1, args.threads):
+            before = run(fetch_urlopen, url, args.requests, n_threads)
+            after = run(fetch_pooled, url, args.requests, n_threads)
+            print(f"{args.requests} requests, {n_threads} thread(s):")
+            print(f"  urlopen: {before * 1000:8.1f}ms  {args.requests / before:8.1f} req/s")
+            print(f"  pooled:  {after * 1000:8.1f}ms  {args.requests / after:8.1f} req/s  ({before / after:.1f}x)")
+            if after > before:
+                failed = True
+
+        server.shutdown()
+
+    if failed:
+        print("FAIL: the pooled transport is slower than urlopen")
+    return 1 if failed else 0
+
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main())
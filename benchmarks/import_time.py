@@ -0,0 +1,81 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+# ------------------------------------------------------------------------------
+# Import-time benchmark of the entry point
+# - Measures `import main` with `python -X importtime` (the cost paid by every run before it does anything)
+# - Fails if a heavy module is imported eagerly, or if the total goes over the budget
+#
+# Usage: python benchmarks/import_time.py [--budget-ms 150] [--runs 5]
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported on the code path that needs them
+lazy_modules = [
+    "pytubefix",
+    "inquirer",
+    "requests",
+    "geoip2",
+    "tqdm",
+    "aiohttp",
+]
+
+# ------------------------------------------------------------------------------
+# Run `code` in a fresh interpreter and return {module: cumulative import time in microseconds}
+def measure(code: str) -> dict[str, int]:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=project_root, capture_output=True, text=True, check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)", line)
+        if match:
+            times[match.group(4)] = int(match.group(2))
+    return times
+
+# ------------------------------------------------------------------------------
+# Wall time of `main.py --help` (start-up without any download)
+def measure_help() -> float:
+    started_at = time.perf_counter()
+    subprocess.run([sys.executable, "main.py", "--help"], cwd=project_root, capture_output=True, check=True)
+    return time.perf_counter() - started_at
+
+# ------------------------------------------------------------------------------
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import-time benchmark of main.py")
+    parser.add_argument("--budget-ms", type=float, default=50, help="Maximum cumulative import time of main")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs (the fastest one is used)")
+    args = parser.parse_args()
+
+    # The fastest run is the least affected by noise (disk cache, other processes)
+    runs = [measure("import main") for _ in range(args.runs)]
+    best = min(runs, key=lambda times: times["main"])
+    total_ms = best["main"] / 1000
+
+    # Leave out the modules the interpreter imports at start-up anyway
+    startup = measure("pass")
+    best = {module: us for (module, us) in best.items() if module not in startup}
+
+    print(f"import main: {total_ms:.1f}ms (budget {args.budget_ms:.0f}ms)")
+    for (module, us) in sorted(best.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {us / 1000:8.1f}ms  {module}")
+    print(f"main.py --help: {min(measure_help() for _ in range(args.runs)) * 1000:.1f}ms")
+
+    failed = False
+    eager = [module for module in lazy_modules if module in best]
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import time is over the budget")
+        failed = True
+    return 1 if failed else 0
+
+# ------------------------------------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main())
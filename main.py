@@ -1,25 +1,34 @@
 import sys
 import os
-from pytubefix import innertube
+import argparse
+import threading
 
-from utils.check_vpn import check_vpn
+# Heavy modules (pytubefix, inquirer, requests, geoip2) are imported on the code path that needs them
+# Run `python benchmarks/import_time.py` to check the startup cost after changing imports
 from utils.console import clear_console, print_error, print_info, print_separator, print_success
-from utils.ask import check_url, get_url
-from utils.video_dl import download_video
-from utils.playlist_dl import download_playlist
-from utils.file import get_main_script_location
+import utils.console as console
+from utils.options import resolutions, bitrates
+from utils.file import get_cache_dir
+from utils.bandwidth import parse_rate, priorities, scheduler
+from utils.metrics import recorder
+import utils.staging as staging
 
 # ------------------------------------------------------------------------------
 # Application code here
 def main():
+    # --------------------------------------------------------------------------
+    # Import the downloaders in the background while the user is typing
+    preload = threading.Thread(target=preload_downloaders, daemon=True)
+    preload.start()
+    from utils.check_vpn import start_vpn_check, finish_vpn_check
+    from utils.ask import check_url, get_url
     # --------------------------------------------------------------------------
     # Clear console
     clear_console()
     print_separator()
     # --------------------------------------------------------------------------
-    # Check VPN
-    check_vpn()
-    print_separator()
+    # Check VPN in the background (its result is shown once the user has answered)
+    vpn_check = start_vpn_check()
     # --------------------------------------------------------------------------
     # Get URL from user
     url = get_url()
@@ -29,26 +38,174 @@ def main():
     type = check_url(url)
     print_separator()
     # --------------------------------------------------------------------------
+    # Wait for the VPN check (exits if it failed)
+    finish_vpn_check(vpn_check)
+    print_separator()
+    # --------------------------------------------------------------------------
+    preload.join()
+    init_pytube()
+    from utils.video_dl import download_video
+    from utils.playlist_dl import download_playlist, download_channel
     if type == "Video":
-        download_video(url)
+        if download_video(url) == "Failed":
+            raise RuntimeError("The video could not be downloaded")
     elif type == "Playlist":
         download_playlist(url)
+    elif type == "Channel":
+        # Channels are synced: only the uploads since the last sync are listed and downloaded
+        download_channel(url)
     else:
         print_error("Choice")
         
     print_separator()
     # --------------------------------------------------------------------------
 
+# ------------------------------------------------------------------------------
+# Import the modules needed for downloading (the import lock makes this safe to run in a thread)
+def preload_downloaders():
+    import utils.video_dl
+    import utils.playlist_dl
+    import pytubefix
+
+# ------------------------------------------------------------------------------
+# Overwrite PyTube's default cache directory to keep user's OAuth info in package mode
+# Link: https://github.com/pytube/pytube/issues/1322
+def init_pytube():
+    from pytubefix import innertube
+    # app_path is the directory the cache folder will be created in
+    innertube._cache_dir = get_cache_dir() # ./__cache__
+    innertube._token_file = os.path.join(innertube._cache_dir, 'tokens.json')
+    # pytubefix's requests share the pooled connections with the downloads
+    from utils.transport import install_pytubefix_transport
+    install_pytubefix_transport()
+
+# ------------------------------------------------------------------------------
+# Command line arguments (without any of them, the app runs interactively)
+def parse_args():
+    parser = argparse.ArgumentParser(description="YouTube Downloader. Runs interactively unless a job is given.")
+    parser.add_argument("--url", help="URL of a video, playlist or channel to download")
+    parser.add_argument("--type", choices=["Video", "Playlist", "Channel"], default="Video", help="Type of the URL (channels are always synced)")
+    parser.add_argument("--format", choices=["webm", "mp4"], default="webm")
+    parser.add_argument("--min-resolution", choices=resolutions, default=resolutions[0])
+    parser.add_argument("--min-bitrate", choices=bitrates, default=bitrates[0])
+    parser.add_argument("--dir", help="Target directory")
+    parser.add_argument("--item-workers", type=int, default=1, help="Number of playlist videos downloaded at the same time")
+    parser.add_argument("--merge-workers", type=int, default=None, help="Number of playlist videos merged at the same time (default: half the cores, at most 4)")
+    parser.add_argument("--stream-mux", action="store_true", help="Mux the streams while they are downloaded (webm only)")
+    parser.add_argument("--sync", action="store_true", help="Skip the playlist videos downloaded by an earlier sync without requesting them")
+    parser.add_argument("--max-rate", type=parse_rate, default=None, metavar="RATE", help="Bandwidth cap shared by all downloads, e.g. 10M (bytes per second)")
+    parser.add_argument("--job-max-rate", type=parse_rate, default=None, metavar="RATE", help="Bandwidth cap of the --url job")
+    parser.add_argument("--priority", choices=list(priorities), default="bulk", help="Bandwidth priority of the --url job (interactive jobs get the bandwidth first)")
+    parser.add_argument("--store", nargs="?", const=True, default=None, metavar="DIR", help="Download each video once into a shared store (default: videos/.store) and link it into the target directory")
+    parser.add_argument("--metrics-dir", metavar="DIR", help="Write the time of each phase of each video to DIR/metrics.jsonl and the totals to DIR/yt_dl.prom (Prometheus textfile)")
+    parser.add_argument("--trace", metavar="FILE", help="Write a timeline of the phases to FILE (Chrome trace format, open it in ui.perfetto.dev)")
+    parser.add_argument("--scratch-dir", metavar="DIR", help="Download and merge into DIR (e.g. a local SSD or tmpfs), then move each finished video to its target directory")
+    parser.add_argument("--enqueue", metavar="QUEUE", help="List the --url playlist or channel into the work queue QUEUE (a SQLite file, e.g. on a shared mount) for --worker processes to download")
+    parser.add_argument("--worker", metavar="QUEUE", help="Download the videos of the work queue QUEUE (--item-workers at a time) along with the other workers of the queue, until none are left")
+    parser.add_argument("--lease", type=float, default=None, metavar="SECONDS", help="How long a --worker holds a video before another worker can reclaim it if it isn't renewed (default: 120)")
+    parser.add_argument("--job-file", help="JSON lines file of jobs (keys: url, type, format, min_resolution, min_bitrate, dir, workers, merge_workers, stream_mux, sync, store, priority, max_rate)")
+    parser.add_argument("--workers", type=int, default=1, help="Number of jobs run at the same time")
+    parser.add_argument("--output", default="-", help="File the JSON lines results are written to (default: stdout)")
+    parser.add_argument("--serve", action="store_true", help="Run as a daemon that takes jobs over a local HTTP API")
+    parser.add_argument("--host", default="127.0.0.1", help="Address the daemon listens on")
+    parser.add_argument("--port", type=int, default=8765, help="Port the daemon listens on")
+    return parser.parse_args()
+
+# ------------------------------------------------------------------------------
+# Batch mode: run the jobs from the arguments or job file without asking anything
+# Results are written as JSON lines, messages go to stderr
+def batch(args) -> int:
+    from utils.check_vpn import start_vpn_check, finish_vpn_check
+    console.log_file = sys.stderr
+    # --------------------------------------------------------------------------
+    # Check VPN once for all jobs, in the background while the downloaders are imported
+    vpn_check = start_vpn_check()
+    from utils.batch import load_jobs, run_jobs
+    init_pytube()
+    # --------------------------------------------------------------------------
+    # Collect jobs
+    jobs = load_jobs(args.job_file) if args.job_file else []
+    if args.url:
+        jobs.append({
+            "url": args.url,
+            "type": args.type,
+            "format": args.format,
+            "min_resolution": args.min_resolution,
+            "min_bitrate": args.min_bitrate,
+            "dir": args.dir,
+            "workers": args.item_workers,
+            "merge_workers": args.merge_workers,
+            "stream_mux": args.stream_mux,
+            "sync": args.sync,
+            "store": args.store,
+            "priority": args.priority,
+            "max_rate": args.job_max_rate,
+        })
+    # --------------------------------------------------------------------------
+    # Wait for the VPN check (exits if it failed)
+    finish_vpn_check(vpn_check)
+    # --------------------------------------------------------------------------
+    # Run jobs
+    if args.output == "-":
+        results = run_jobs(jobs, args.workers, sys.stdout)
+    else:
+        with open(args.output, "a", encoding="utf-8") as output:
+            results = run_jobs(jobs, args.workers, output)
+    # --------------------------------------------------------------------------
+    # Exit code is 1 if any job failed
+    return 1 if any(result["status"] == "Failed" for result in results) else 0
+
+# ------------------------------------------------------------------------------
+# Work queue mode: list a playlist or channel into a shared queue, or download the videos of a queue (see work_queue.py)
+# Messages go to stderr like in batch mode
+def run_queue(args) -> int:
+    from utils.check_vpn import start_vpn_check, finish_vpn_check
+    console.log_file = sys.stderr
+    vpn_check = start_vpn_check()
+    from utils.work_queue import enqueue, run_worker
+    init_pytube()
+    finish_vpn_check(vpn_check)
+    # --------------------------------------------------------------------------
+    if args.enqueue:
+        if not args.url or args.type == "Video":
+            print_error("--enqueue needs the --url of a playlist or channel (with --type Playlist or Channel)")
+            return 1
+        enqueue(args.enqueue, args.url, args.type, args.dir, args.format, args.min_resolution, args.min_bitrate, args.store)
+        return 0
+    # --------------------------------------------------------------------------
+    counts = run_worker(args.worker, args.item_workers, args.merge_workers, args.stream_mux, args.lease, args.priority, args.job_max_rate)
+    # Exit code is 1 if any of the worker's videos failed
+    return 1 if counts.get("Failed") else 0
+
 # ------------------------------------------------------------------------------
 if __name__ == "__main__":
+    args = parse_args()
+    # The bandwidth cap applies to every mode (interactive downloads take it before batch/daemon jobs)
+    scheduler.set_global_rate(args.max_rate)
+    # So do the metrics exports (each video is written once it's finished)
+    recorder.configure(args.metrics_dir, args.trace)
+    # And the scratch directory
+    staging.configure(args.scratch_dir)
+    # --------------------------------------------------------------------------
+    # Run as a daemon
+    if args.serve:
+        from utils.check_vpn import start_vpn_check
+        from utils.daemon import serve
+        console.log_file = sys.stderr
+        init_pytube()
+        # The daemon checks VPN once at start-up, the jobs only wait for it if it's still running
+        serve(args.host, args.port, args.workers, start_vpn_check())
+        sys.exit(0)
+    # --------------------------------------------------------------------------
+    # Fill or work on a shared work queue
+    if args.enqueue or args.worker:
+        sys.exit(run_queue(args))
+    # --------------------------------------------------------------------------
+    # Run in batch mode (non-interactive)
+    if args.url or args.job_file:
+        sys.exit(batch(args))
+    # --------------------------------------------------------------------------
     try:
-        # ----------------------------------------------------------------------
-        # Overwrite PyTube's default cache directory to keep user's OAuth info in package mode
-        # Link: https://github.com/pytube/pytube/issues/1322
-        
-        # app_path is the directory the cache folder will be created in
-        innertube._cache_dir = os.path.join(get_main_script_location(), "__cache__") # ./__cache__
-        innertube._token_file = os.path.join(innertube._cache_dir, 'tokens.json')
         # ----------------------------------------------------------------------
         # Run the app
         main()
@@ -0,0 +1,59 @@
+import os
+import sys
+import stat
+import threading
+
+import pytest
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, project_root)
+
+from benchmarks.fake_youtube import FakeYouTubeServer
+from benchmarks.download import ffmpeg_stand_in, seed_metadata
+
+# ------------------------------------------------------------------------------
+# Shared fixtures: a local fake YouTube (benchmarks/fake_youtube.py) and an isolated app directory
+# - `app_dir` stands in for the main script's directory (videos/, __cache__/ and PyTube's cache are in it)
+# - `playlist_url` seeds the metadata cache with the fake server's playlist and videos, like the benchmark
+
+# ------------------------------------------------------------------------------
+# Start a fake server with the given options (FakeYouTubeServer's arguments), stopped after the test
+@pytest.fixture
+def make_server():
+    servers = []
+    def make(**options) -> FakeYouTubeServer:
+        server = FakeYouTubeServer(("127.0.0.1", 0), **options)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+    yield make
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def server(make_server) -> FakeYouTubeServer:
+    return make_server(n_videos=3, video_size=3 * 1024 * 1024 + 17, audio_size=512 * 1024 + 3)
+
+# ------------------------------------------------------------------------------
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch) -> str:
+    from pytubefix import innertube
+    from utils import metadata_cache
+    app_dir = str(tmp_path / "app")
+    os.makedirs(app_dir)
+    # get_main_script_location() is the directory of sys.argv[0]
+    monkeypatch.setattr(sys, "argv", [os.path.join(app_dir, "main.py")])
+    monkeypatch.setattr(innertube, "_cache_dir", os.path.join(app_dir, "__cache__"))
+    monkeypatch.setattr(metadata_cache, "cache", None)
+    # The media is synthetic, so the merges are done by the benchmark's stream copy stand-in
+    ffmpeg_path = os.path.join(app_dir, "ffmpeg")
+    with open(ffmpeg_path, "w") as file:
+        file.write(f"#!{sys.executable}\n{ffmpeg_stand_in}")
+    os.chmod(ffmpeg_path, os.stat(ffmpeg_path).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("FFMPEG_PATH", ffmpeg_path)
+    return app_dir
+
+@pytest.fixture
+def playlist_url(server, app_dir) -> str:
+    return seed_metadata(server.url)
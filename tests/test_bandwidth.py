@@ -0,0 +1,78 @@
+import time
+
+import pytest
+
+from utils.bandwidth import BandwidthScheduler, TokenBucket, parse_rate, preempted_rate
+from utils.batch import validate_job
+
+# ------------------------------------------------------------------------------
+def test_parse_rate():
+    assert parse_rate(None) is None
+    assert parse_rate("") is None
+    assert parse_rate("500") == 500
+    assert parse_rate("500K") == 500 * 1024
+    assert parse_rate("1.5M/s") == int(1.5 * 1024 ** 2)
+    assert parse_rate("2gb") == 2 * 1024 ** 3
+    assert parse_rate(4096) == 4096
+
+# A rate that would never let a byte through (or isn't a rate) is rejected
+@pytest.mark.parametrize("value", [0, -1, 0.5, "0", "0K", "-5M", "fast", True, [1]])
+def test_parse_rate_rejects_invalid_rates(value):
+    with pytest.raises(ValueError, match="Invalid rate"):
+        parse_rate(value)
+
+def test_job_with_zero_rate_is_invalid():
+    assert validate_job({"url": "https://youtube.com/watch?v=bench000000", "max_rate": "2M"})["max_rate"] == 2 * 1024 ** 2
+    with pytest.raises(ValueError, match="Invalid rate"):
+        validate_job({"url": "https://youtube.com/watch?v=bench000000", "max_rate": 0})
+
+# ------------------------------------------------------------------------------
+# The interactive jobs share the global rate first, a preempted bulk job keeps a trickle
+def test_interactive_jobs_preempt_bulk_jobs():
+    scheduler = BandwidthScheduler(global_rate=10 * 1024 ** 2)
+    bulk = scheduler.add("playlist", "bulk")
+    assert bulk.allocated_rate == 10 * 1024 ** 2
+
+    first = scheduler.add("video 1", "interactive")
+    second = scheduler.add("video 2", "interactive")
+    assert (first.allocated_rate, second.allocated_rate) == (5 * 1024 ** 2, 5 * 1024 ** 2)
+    assert bulk.allocated_rate == preempted_rate
+
+    first.close()
+    second.close()
+    assert bulk.allocated_rate == 10 * 1024 ** 2
+
+# A job capped below its share leaves the rest to the others, of its own priority first
+def test_capped_jobs_leave_the_rest_to_the_others():
+    scheduler = BandwidthScheduler(global_rate=9 * 1024 ** 2)
+    capped = scheduler.add("video 1", "interactive", max_rate=1024 ** 2)
+    uncapped = scheduler.add("video 2", "interactive")
+    bulk = scheduler.add("playlist", "bulk", max_rate=1024 ** 2)
+    assert capped.allocated_rate == 1024 ** 2
+    assert uncapped.allocated_rate == 8 * 1024 ** 2
+    assert bulk.allocated_rate == preempted_rate
+
+    uncapped.close()
+    assert bulk.allocated_rate == 1024 ** 2
+
+# Without a global rate, the jobs only get their own caps
+def test_without_global_rate_jobs_get_their_caps():
+    scheduler = BandwidthScheduler()
+    assert scheduler.add("video", "interactive").allocated_rate is None
+    assert scheduler.add("playlist", "bulk", max_rate=2048).allocated_rate == 2048
+    with pytest.raises(ValueError, match="Invalid priority"):
+        scheduler.add("video", "urgent")
+
+# ------------------------------------------------------------------------------
+# A bucket lets its rate through, and nothing holds back an unlimited one
+def test_token_bucket_limits_the_rate():
+    bucket = TokenBucket(1024 ** 2)
+    started_at = time.monotonic()
+    for _ in range(10):
+        bucket.consume(32 * 1024)
+    assert time.monotonic() - started_at >= 0.25
+
+    bucket.set_rate(None)
+    started_at = time.monotonic()
+    bucket.consume(1024 ** 3)
+    assert time.monotonic() - started_at < 0.1
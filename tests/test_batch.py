@@ -0,0 +1,24 @@
+import os
+import sys
+
+from utils.batch import run_job
+from utils.file import slugify
+
+# ------------------------------------------------------------------------------
+# A playlist job without a dir goes to videos/<playlist-title>/ without asking (there is no terminal to ask on)
+def test_playlist_job_without_dir_uses_default_dir(playlist_url, app_dir, monkeypatch):
+    monkeypatch.setattr(sys, "stdin", open(os.devnull, "r"))
+    import utils.ask
+    def prompt(*args, **kwargs):
+        raise AssertionError("a batch job must not prompt")
+    monkeypatch.setattr(utils.ask.inquirer, "prompt", prompt)
+
+    result = run_job({"url": playlist_url, "type": "Playlist"})
+
+    assert result["error"] is None
+    assert result["status"] == "Downloaded"
+    assert [item["status"] for item in result["items"]] == ["Downloaded"] * 3
+    file_dir = os.path.join(app_dir, "videos", slugify("Benchmark playlist"))
+    assert sorted(name for name in os.listdir(file_dir) if not name.startswith(".")) == [
+        f"{idx + 1}-benchmark-video-bench{idx:06d}.webm" for idx in range(3)
+    ]
@@ -0,0 +1,42 @@
+import os
+
+import pytest
+
+from utils import check_vpn
+
+# ------------------------------------------------------------------------------
+# The public IP answered by the fake ipify (one per check) and the country lookups made
+@pytest.fixture
+def location(app_dir, monkeypatch):
+    state = {"ips": [], "lookups": []}
+    class Response:
+        def __init__(self, ip):
+            self.ip = ip
+        def raise_for_status(self):
+            pass
+        def json(self):
+            return {"ip": self.ip}
+    class Session:
+        def get(self, url, **kwargs):
+            return Response(state["ips"].pop(0))
+    def get_country_of_ip(ip):
+        state["lookups"].append(ip)
+        return {"1.1.1.1": "Germany", "2.2.2.2": "Iran"}[ip]
+    monkeypatch.setattr(check_vpn, "get_session", lambda: Session())
+    monkeypatch.setattr(check_vpn, "get_country_of_ip", get_country_of_ip)
+    return state
+
+# ------------------------------------------------------------------------------
+# Turning the VPN off is noticed on the next check
+def test_public_ip_is_fetched_on_every_check(location):
+    location["ips"] = ["1.1.1.1", "2.2.2.2", "1.1.1.1"]
+    assert check_vpn.get_location() == ("1.1.1.1", "Germany")
+    assert check_vpn.check_location() == (False, "You are in Iran! Please, connect to VPN.")
+    assert check_vpn.get_location() == ("1.1.1.1", "Germany")
+    assert location["ips"] == []
+
+# Nothing is written to the cache directory
+def test_location_is_not_cached_on_disk(location, app_dir):
+    location["ips"] = ["1.1.1.1"]
+    assert check_vpn.check_location() == (True, "You are in Germany")
+    assert not os.path.exists(os.path.join(app_dir, "__cache__", "geo.json"))
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from utils.daemon import JobScheduler, RequestHandler
+
+# ------------------------------------------------------------------------------
+# A daemon on a free port (`vpn_check` is the result of its start-up check), returns a function to call its API
+@pytest.fixture
+def daemon(app_dir):
+    servers = []
+    def start(vpn_check: tuple[bool, str | None] = (True, None)):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+        future = Future()
+        future.set_result(vpn_check)
+        server.scheduler = JobScheduler(workers=2, vpn_check=future)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        def call(method: str, path: str, body=None) -> tuple[int, object]:
+            data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8") if body is not None else None
+            request = urllib.request.Request(f"http://127.0.0.1:{server.server_port}{path}", data=data, method=method)
+            try:
+                with urllib.request.urlopen(request, timeout=10) as response:
+                    return (response.status, json.loads(response.read()))
+            except urllib.error.HTTPError as e:
+                return (e.code, json.loads(e.read()))
+        return call
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def wait_for_job(call, job_id: str) -> dict:
+    started_at = time.monotonic()
+    while True:
+        (status, record) = call("GET", f"/jobs/{job_id}")
+        assert status == 200
+        if record["state"] == "finished":
+            return record
+        assert time.monotonic() - started_at < 30, "the job must finish"
+        time.sleep(0.05)
+
+# ------------------------------------------------------------------------------
+# A queued job runs in the background, its status and progress are polled until it's finished
+def test_job_runs_to_completion(daemon, playlist_url, app_dir):
+    call = daemon()
+    file_dir = os.path.join(app_dir, "playlist")
+    (status, body) = call("POST", "/jobs", {"url": playlist_url, "type": "Playlist", "dir": file_dir})
+    assert status == 202
+
+    record = wait_for_job(call, body["id"])
+
+    assert record["result"]["status"] == "Downloaded"
+    assert [item["status"] for item in record["result"]["items"]] == ["Downloaded"] * 3
+    assert record["progress"] == {"done": 3, "total": 3}
+    assert record["started_at"] <= record["finished_at"]
+    assert [job["id"] for job in call("GET", "/jobs")[1]] == [body["id"]]
+    assert call("GET", "/health") == (200, {"ok": True})
+
+# An invalid job is refused, and nothing is queued
+@pytest.mark.parametrize("body", [
+    b"not json",
+    {"type": "Playlist"},
+    {"url": "https://youtube.com/watch?v=bench000000", "max_rate": 0},
+    {"url": "https://youtube.com/watch?v=bench000000", "priority": "urgent"},
+])
+def test_invalid_job_is_refused(daemon, body):
+    call = daemon()
+    (status, error) = call("POST", "/jobs", body)
+    assert status == 400 and error["error"]
+    assert call("GET", "/jobs") == (200, [])
+
+def test_unknown_paths(daemon):
+    call = daemon()
+    assert call("GET", "/jobs/unknown")[0] == 404
+    assert call("GET", "/unknown")[0] == 404
+    assert call("POST", "/unknown", {})[0] == 404
+
+# A failed start-up VPN check fails the jobs without downloading anything
+def test_failed_vpn_check_fails_the_jobs(daemon, playlist_url, server, app_dir):
+    call = daemon(vpn_check=(False, "You are in Iran! Please, connect to VPN."))
+    (_, body) = call("POST", "/jobs", {"url": playlist_url, "type": "Playlist", "dir": os.path.join(app_dir, "playlist")})
+
+    record = wait_for_job(call, body["id"])
+
+    assert record["result"]["status"] == "Failed"
+    assert record["result"]["error"] == "You are in Iran! Please, connect to VPN."
+    assert server.counts.get("media", 0) == 0
+    assert not os.path.exists(os.path.join(app_dir, "playlist"))
@@ -0,0 +1,64 @@
+import os
+import time
+import threading
+
+import pytest
+
+from utils import merge_queue
+from utils.merge_queue import MergeQueue, get_default_workers
+
+# ------------------------------------------------------------------------------
+# The jobs run in the background, their results and errors come back through their futures
+def test_jobs_run_in_the_background():
+    def merge(name: str) -> str:
+        if name == "broken":
+            raise RuntimeError("ffmpeg failed")
+        return f"{name}.webm"
+
+    with MergeQueue(workers=2, max_pending=4) as queue:
+        futures = [queue.submit(merge, name) for name in ("video 1", "broken", "video 2")]
+    assert futures[0].result() == "video 1.webm"
+    assert futures[2].result() == "video 2.webm"
+    with pytest.raises(RuntimeError, match="ffmpeg failed"):
+        futures[1].result()
+    assert queue.get_totals()[0] == 3
+
+# A download can go on while an earlier merge runs, but not more than `max_pending` merges ahead of the workers
+def test_submit_blocks_while_the_queue_is_full():
+    started = threading.Event()
+    release = threading.Event()
+    def merge():
+        started.set()
+        release.wait(5)
+
+    with MergeQueue(workers=1, max_pending=1) as queue:
+        running = queue.submit(merge)
+        assert started.wait(5)
+        pending = queue.submit(merge)
+        submitted = threading.Event()
+        thread = threading.Thread(target=lambda: (queue.submit(merge), submitted.set()))
+        thread.start()
+        assert not submitted.wait(0.2)
+        assert not running.done() and not pending.done()
+
+        release.set()
+        assert submitted.wait(5)
+        thread.join()
+    assert running.done() and pending.done()
+
+# The time a job waits for a worker is told apart from the time it runs
+def test_totals_of_waits_and_runs():
+    with MergeQueue(workers=1, max_pending=2) as queue:
+        for _ in range(2):
+            queue.submit(time.sleep, 0.1)
+    (n_merges, wait, run) = queue.get_totals()
+    assert n_merges == 2
+    assert run >= 0.2
+    assert wait >= 0.1
+
+# ------------------------------------------------------------------------------
+# Half of the available cores, between 1 and `max_workers`
+@pytest.mark.parametrize(("cores", "workers"), [(1, 1), (2, 1), (6, 3), (64, merge_queue.max_workers)])
+def test_default_workers(monkeypatch, cores, workers):
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(cores)), raising=False)
+    assert get_default_workers() == workers
@@ -0,0 +1,73 @@
+import os
+import json
+
+import pytest
+
+import utils.playlist_dl
+from utils.batch import run_job
+from utils.metrics import MetricsRecorder
+
+# ------------------------------------------------------------------------------
+# A recorder that exports to the test's directory, used by the playlist downloads
+@pytest.fixture
+def recorder(app_dir, monkeypatch) -> MetricsRecorder:
+    recorder = MetricsRecorder()
+    recorder.configure(os.path.join(app_dir, "metrics"), os.path.join(app_dir, "metrics", "trace.json"))
+    monkeypatch.setattr(utils.playlist_dl, "recorder", recorder)
+    return recorder
+
+def read_jsonl(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+# The trace is left without its closing bracket (and with a trailing comma), which Chrome's format allows
+def read_trace(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8") as file:
+        text = file.read()
+    assert text.startswith("[\n") and text.endswith(",\n")
+    return json.loads(text[:-2] + "]")
+
+# ------------------------------------------------------------------------------
+# Each finished video is a JSONL record with its phases and streams, and the Prometheus totals add them up
+def test_jsonl_and_prometheus_exports(playlist_url, app_dir, recorder):
+    run_job({"url": playlist_url, "type": "Playlist", "dir": os.path.join(app_dir, "playlist")})
+
+    records = read_jsonl(os.path.join(app_dir, "metrics", "metrics.jsonl"))
+    assert sorted(record["item"] for record in records) == [f"https://www.youtube.com/watch?v=bench{idx:06d}" for idx in range(3)]
+    for record in records:
+        assert record["status"] == "Downloaded"
+        assert {"metadata", "exists_check", "download", "merge"} <= set(record["phases"])
+        assert sorted(stream["kind"] for stream in record["streams"]) == ["audio", "video"]
+        for stream in record["streams"]:
+            assert stream["bytes"] == stream["size"] and stream["requests"] >= 1 and stream["ttfb"] is not None
+        assert record["bytes"] == sum(stream["bytes"] for stream in record["streams"])
+        assert record["merge_duration"] is not None
+
+    with open(os.path.join(app_dir, "metrics", "yt_dl.prom"), "r", encoding="utf-8") as file:
+        lines = file.read().splitlines()
+    assert 'yt_dl_items_total{status="Downloaded"} 3' in lines
+    assert 'yt_dl_phase_seconds_count{phase="merge"} 3' in lines
+    assert 'yt_dl_merge_seconds_count 3' in lines
+    total_bytes = sum(record["bytes"] for record in records)
+    assert sum(int(line.split()[-1]) for line in lines if line.startswith("yt_dl_stream_bytes_total{")) == total_bytes
+
+# ------------------------------------------------------------------------------
+# The trace has the phases as complete events on named threads, and each item and stream as a matched async span
+def test_trace_export(playlist_url, app_dir, recorder):
+    run_job({"url": playlist_url, "type": "Playlist", "dir": os.path.join(app_dir, "playlist")})
+
+    events = read_trace(os.path.join(app_dir, "metrics", "trace.json"))
+    thread_ids = {event["tid"] for event in events if event["ph"] == "M" and event["name"] == "thread_name"}
+    phases = [event for event in events if event["ph"] == "X"]
+    assert phases and all(event["tid"] in thread_ids and event["ts"] >= 0 and event["dur"] >= 0 for event in phases)
+    assert {"download", "merge"} <= {event["name"] for event in phases}
+
+    spans = [event for event in events if event["ph"] in ("b", "e")]
+    assert len({event["id"] for event in spans}) == 3
+    for item_id in {event["id"] for event in spans}:
+        # An item opens first, closes last, and its 2 streams are nested in it
+        item_events = [(event["ph"], event["name"]) for event in spans if event["id"] == item_id]
+        assert len(item_events) == 6
+        assert item_events[0][0] == "b" and item_events[-1] == ("e", item_events[0][1])
+        for name in {name for (_, name) in item_events[1:-1]}:
+            assert [ph for (ph, other) in item_events if other == name] == ["b", "e"]
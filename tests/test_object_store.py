@@ -0,0 +1,56 @@
+import os
+import threading
+
+from utils.object_store import ObjectStore
+from utils.batch import run_jobs
+
+# ------------------------------------------------------------------------------
+# Every writer of a key merges into its own partial file
+def test_partial_paths_are_unique(tmp_path):
+    store = ObjectStore(str(tmp_path / "store"))
+    key = ObjectStore.get_key("bench000000", 248, 251, "webm")
+    assert store.get_partial_path(key) != store.get_partial_path(key)
+
+# The first writer to publish a key wins, the others drop their copy and link the stored one
+def test_add_keeps_the_published_object(tmp_path):
+    store = ObjectStore(str(tmp_path / "store"))
+    key = ObjectStore.get_key("bench000000", 248, 251, "webm")
+    partial_paths = [store.get_partial_path(key) for _ in range(2)]
+    for (idx, partial_path) in enumerate(partial_paths):
+        os.makedirs(os.path.dirname(partial_path), exist_ok=True)
+        with open(partial_path, "wb") as file:
+            file.write(f"writer {idx}".encode())
+
+    barrier = threading.Barrier(len(partial_paths))
+    def add(partial_path):
+        barrier.wait()
+        store.add(key, partial_path)
+    threads = [threading.Thread(target=add, args=(partial_path,)) for partial_path in partial_paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert store.has(key)
+    assert not any(os.path.exists(partial_path) for partial_path in partial_paths)
+    file_path = str(tmp_path / "videos" / "video.webm")
+    store.link(key, file_path)
+    with open(file_path, "rb") as file:
+        assert file.read() in (b"writer 0", b"writer 1")
+
+# ------------------------------------------------------------------------------
+# Two jobs downloading the same playlist into the same store at the same time
+def test_concurrent_jobs_share_the_store(playlist_url, app_dir):
+    store_dir = os.path.join(app_dir, "store")
+    jobs = [{"url": playlist_url, "type": "Playlist", "dir": os.path.join(app_dir, name), "store": store_dir} for name in ("a", "b")]
+
+    results = run_jobs(jobs, workers=2, output=open(os.devnull, "w"))
+
+    for result in results:
+        assert result["error"] is None
+        assert [item["status"] for item in result["items"]] == ["Downloaded"] * 3
+    assert len(os.listdir(store_dir)) == 3
+    for name in ("a", "b"):
+        assert sorted(name for name in os.listdir(os.path.join(app_dir, name)) if not name.startswith(".")) == [
+            f"{idx + 1}-benchmark-video-bench{idx:06d}.webm" for idx in range(3)
+        ]
@@ -0,0 +1,101 @@
+import os
+
+import utils.playlist_dl
+from utils.batch import run_job, run_jobs
+
+# ------------------------------------------------------------------------------
+# A re-run skips the videos of the manifest without fetching their metadata (their titles are in the manifest)
+def test_rerun_skips_downloaded_videos_without_metadata(playlist_url, app_dir, monkeypatch, capsys):
+    job = {"url": playlist_url, "type": "Playlist", "dir": os.path.join(app_dir, "playlist")}
+    assert [item["status"] for item in run_job(job)["items"]] == ["Downloaded"] * 3
+
+    def get_video_info(*args, **kwargs):
+        raise AssertionError("a downloaded video must be skipped before its metadata is fetched")
+    monkeypatch.setattr(utils.playlist_dl, "get_video_info", get_video_info)
+    capsys.readouterr()
+    result = run_job(job)
+
+    assert result["error"] is None
+    assert [item["status"] for item in result["items"]] == ["Skipped"] * 3
+    output = capsys.readouterr().out
+    for idx in range(3):
+        assert f"{idx + 1}. [Skipped] Benchmark video bench{idx:06d}" in output
+
+# A synced video whose file was deleted is downloaded again, the others are skipped
+def test_sync_downloads_deleted_videos_again(playlist_url, app_dir):
+    file_dir = os.path.join(app_dir, "playlist")
+    job = {"url": playlist_url, "type": "Playlist", "dir": file_dir, "sync": True}
+    assert [item["status"] for item in run_job(job)["items"]] == ["Downloaded"] * 3
+    os.remove(os.path.join(file_dir, "2-benchmark-video-bench000001.webm"))
+
+    result = run_job(job)
+
+    assert [item["status"] for item in result["items"]] == ["Skipped", "Downloaded", "Skipped"]
+    assert os.path.exists(os.path.join(file_dir, "2-benchmark-video-bench000001.webm"))
+
+# ------------------------------------------------------------------------------
+# A channel whose uploads (newest first) are the given videos of the fake server, and the uploads it has listed
+def make_channel(monkeypatch, video_ids: list[str]) -> list[str]:
+    import pytubefix
+    listed_ids = []
+    class Channel:
+        channel_name = "Benchmark channel"
+        channel_id = "UCbenchmark"
+        def __init__(self, url, **kwargs):
+            pass
+        def url_generator(self):
+            for video_id in video_ids:
+                listed_ids.append(video_id)
+                yield f"https://www.youtube.com/watch?v={video_id}"
+    monkeypatch.setattr(pytubefix, "Channel", Channel)
+    return listed_ids
+
+# A channel sync stops listing at the first video of the last sync, and only downloads the new uploads
+def test_channel_sync_stops_at_the_first_known_video(playlist_url, app_dir, monkeypatch):
+    job = {"url": "https://www.youtube.com/@benchmark", "type": "Channel", "dir": os.path.join(app_dir, "channel")}
+    make_channel(monkeypatch, ["bench000001", "bench000000"])
+    assert [item["status"] for item in run_job(job)["items"]] == ["Downloaded"] * 2
+
+    listed_ids = make_channel(monkeypatch, ["bench000002", "bench000001", "bench000000"])
+    result = run_job(job)
+
+    assert listed_ids == ["bench000002", "bench000001"]
+    assert result["items"] == [{"url": "https://www.youtube.com/watch?v=bench000002", "status": "Downloaded"}]
+    assert sorted(os.listdir(job["dir"])) == [".yt-dl-manifest.jsonl"] + [f"benchmark-video-bench{idx:06d}.webm" for idx in range(3)]
+
+# ------------------------------------------------------------------------------
+# A video listed twice in a playlist is downloaded once
+def test_repeated_video_is_downloaded_once(playlist_url, app_dir):
+    from utils.metadata_cache import get_cache, playlist_ttl
+    playlist = get_cache().get("playlist:PLbenchmark")
+    playlist["video_urls"].append(playlist["video_urls"][0])
+    get_cache().set("playlist:PLbenchmark", playlist, playlist_ttl)
+    file_dir = os.path.join(app_dir, "playlist")
+
+    result = run_job({"url": playlist_url, "type": "Playlist", "dir": file_dir, "workers": 4})
+
+    assert [item["status"] for item in result["items"]] == ["Downloaded"] * 3 + ["Skipped"]
+    assert sorted(os.listdir(file_dir)) == [".yt-dl-manifest.jsonl"] + [f"{idx + 1}-benchmark-video-bench{idx:06d}.webm" for idx in range(3)]
+
+# Two jobs with the same directory at the same time download each video once
+def test_concurrent_jobs_with_the_same_dir(playlist_url, app_dir):
+    file_dir = os.path.join(app_dir, "playlist")
+    job = {"url": playlist_url, "type": "Playlist", "dir": file_dir, "workers": 3}
+
+    results = run_jobs([job, job], workers=2, output=open(os.devnull, "w"))
+
+    for idx in range(3):
+        assert sorted(result["items"][idx]["status"] for result in results) == ["Downloaded", "Skipped"]
+    assert sorted(os.listdir(file_dir)) == [".yt-dl-manifest.jsonl"] + [f"{idx + 1}-benchmark-video-bench{idx:06d}.webm" for idx in range(3)]
+
+# ------------------------------------------------------------------------------
+# A merge is reported under the final path of the video, not the partial file it was merged into
+def test_merge_reports_the_final_path(playlist_url, app_dir, capsys):
+    file_dir = os.path.join(app_dir, "playlist")
+
+    run_job({"url": playlist_url, "type": "Playlist", "dir": file_dir})
+
+    output = capsys.readouterr().out
+    for idx in range(3):
+        assert f"Merged file saved to: {os.path.join(file_dir, f'{idx + 1}-benchmark-video-bench{idx:06d}.webm')} (" in output
+    assert ".partial" not in output
@@ -0,0 +1,105 @@
+import io
+import time
+import threading
+
+import pytest
+
+from utils import console, progress
+from utils.console import print_info
+from utils.progress import ProgressHub, format_size
+
+# ------------------------------------------------------------------------------
+# A terminal (or a log file) that records what's written to it
+class Output(io.StringIO):
+    def __init__(self, tty: bool):
+        super().__init__()
+        self.tty = tty
+        self.n_writes = 0
+
+    def isatty(self) -> bool:
+        return self.tty
+
+    def write(self, text: str) -> int:
+        self.n_writes += 1
+        return super().write(text)
+
+@pytest.fixture
+def output(monkeypatch):
+    def make(tty: bool) -> Output:
+        output = Output(tty)
+        monkeypatch.setattr(console, "log_file", output)
+        return output
+    monkeypatch.setattr(progress, "refresh_interval", 0.01)
+    return make
+
+def wait_for_display(hub: ProgressHub):
+    started_at = time.monotonic()
+    while hub.thread is not None:
+        assert time.monotonic() - started_at < 5, "the display must stop once its tasks are closed"
+        time.sleep(0.01)
+
+# ------------------------------------------------------------------------------
+def test_format_size():
+    assert format_size(512) == "512B"
+    assert format_size(1536) == "1.5KB"
+    assert format_size(3 * 1024 ** 3) == "3.0GB"
+
+# The updates of concurrent transfers add up, and a finished transfer still counts in the aggregate bar
+def test_aggregate_of_concurrent_transfers(output):
+    output(tty=False)
+    hub = ProgressHub()
+    playlist = hub.add("Benchmark playlist", 3, kind="items")
+    tasks = [hub.add(f"video {idx}", 4000) for idx in range(4)]
+    threads = [threading.Thread(target=lambda task=task: [task.update(1) for _ in range(4000)]) for task in tasks]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    tasks[0].close()
+    merge = hub.add("video 0", kind="merge")
+
+    with hub.lock:
+        lines = hub._get_lines()
+    assert lines[0].startswith("Total [####################] 100% 15.6KB/15.6KB ")
+    assert lines[0].endswith(", 3 downloading, 1 merging")
+    assert lines[1] == "  Benchmark playlist [--------------------] 0/3 videos"
+    assert lines[2:5] == [f"  video {idx} [####################] 100% 3.9KB/3.9KB" for idx in range(1, 4)]
+    assert lines[5].startswith("  video 0 merging ")
+
+    for task in tasks[1:] + [merge, playlist]:
+        task.close()
+    wait_for_display(hub)
+
+# ------------------------------------------------------------------------------
+# Without a terminal, a plain progress line is logged now and then instead of a redrawn display
+def test_log_fallback_without_terminal(output, monkeypatch):
+    log = output(tty=False)
+    monkeypatch.setattr(progress, "log_interval", 0.05)
+    hub = ProgressHub()
+    with hub.add("video", 1000) as task:
+        task.update(500)
+        time.sleep(0.2)
+    wait_for_display(hub)
+
+    lines = log.getvalue().splitlines()
+    assert lines and all(line.startswith("Progress: Total [##########----------]  50% 500B/1000B ") for line in lines)
+    assert "\x1b[" not in log.getvalue()
+
+# On a terminal, the display is redrawn at its own pace however many updates there are, messages
+# are printed above it, and it's erased once nothing is running
+def test_terminal_display(output):
+    terminal = output(tty=True)
+    hub = ProgressHub()
+    task = hub.add("video", 10 ** 6)
+    for _ in range(10 ** 5):
+        task.update(10)
+    time.sleep(0.05)
+    print_info("Download complete")
+    task.close()
+    wait_for_display(hub)
+
+    assert terminal.n_writes < 100
+    assert "Download complete" in terminal.getvalue()
+    assert "  video [####################] 100% 976.6KB/976.6KB\n" in terminal.getvalue()
+    assert terminal.getvalue().endswith("\x1b[J")
+    assert console.print_hook is None
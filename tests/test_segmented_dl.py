@@ -0,0 +1,322 @@
+import os
+import re
+import json
+import time
+import errno
+import threading
+from types import SimpleNamespace
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from utils import segmented_dl
+from utils.segmented_dl import (ConnectionController, StreamUrl, fetch_segment, get_backoff, get_state_path, load_done_ranges, save_done_ranges,
+                                segmented_download, split_ranges)
+
+# ------------------------------------------------------------------------------
+# The segmented downloader against a local range server, with small segments (several per stream)
+segment_size = 64 * 1024
+media_size = 5 * segment_size + 3
+media = (bytes(range(251)) * (media_size // 251 + 1))[:media_size]
+
+# ------------------------------------------------------------------------------
+# Serves the byte ranges of `media` at any URL
+# `tamper(n_request, path)` can change a response: it returns None to answer normally, or a dict with
+# a "status" (and "headers") to answer instead, "ignore_range" to send the whole file, or "truncate"
+# to send fewer bytes than asked
+class MediaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), MediaHandler)
+        self.tamper = lambda n_request, path: None
+        self.n_requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/videoplayback?id=bench000000&itag=251"
+
+class MediaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server.lock:
+            self.server.n_requests += 1
+            n_request = self.server.n_requests
+        change = self.server.tamper(n_request, self.path) or {}
+        if "status" in change:
+            self.send_response(change["status"])
+            for (name, value) in change.get("headers", {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if match is None or change.get("ignore_range"):
+            (status, start, end) = (200, 0, media_size - 1)
+        else:
+            (status, start, end) = (206, int(match[1]), min(int(match[2]), media_size - 1))
+        body = media[start:end + 1][:change.get("truncate")]
+        self.send_response(status)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{media_size}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def media_server():
+    server = MediaServer()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(segmented_dl, "segment_size", segment_size)
+    # The process-wide controller must not carry the limits of another test
+    monkeypatch.setattr(segmented_dl, "controller", ConnectionController())
+
+# Record the waits between retries instead of waiting
+@pytest.fixture
+def sleeps(monkeypatch) -> list[float]:
+    sleeps = []
+    monkeypatch.setattr(segmented_dl, "time", SimpleNamespace(sleep=sleeps.append, monotonic=time.monotonic, perf_counter=time.perf_counter))
+    return sleeps
+
+def read(file_path: str) -> bytes:
+    with open(file_path, "rb") as file:
+        return file.read()
+
+# ------------------------------------------------------------------------------
+def test_split_ranges():
+    assert split_ranges(0, 10) == []
+    assert split_ranges(1, 10) == [(0, 0)]
+    assert split_ranges(9, 10) == [(0, 8)]
+    assert split_ranges(10, 10) == [(0, 9)]
+    assert split_ranges(11, 10) == [(0, 9), (10, 10)]
+    assert split_ranges(30, 10) == [(0, 9), (10, 19), (20, 29)]
+    assert split_ranges(media_size) == [(start, min(start + segment_size, media_size) - 1) for start in range(0, media_size, segment_size)]
+
+# ------------------------------------------------------------------------------
+def test_full_download(media_server, tmp_path):
+    file_path = str(tmp_path / "audio")
+    progress = []
+
+    segmented_download(media_server.url, media_size, file_path, on_progress=progress.append)
+
+    assert read(file_path) == media
+    assert sum(progress) == media_size
+    assert media_server.n_requests == len(split_ranges(media_size))
+    assert not os.path.exists(get_state_path(file_path))
+
+# An interrupted download only fetches its missing segments when it's resumed
+def test_resume_after_interrupt(media_server, tmp_path, monkeypatch):
+    file_path = str(tmp_path / "audio")
+    ranges = split_ranges(media_size)
+    failing_range = ranges[2]
+    download_segment = segmented_dl.download_segment
+    def interrupted_segment(session, url, start, end, *args):
+        if (start, end) == failing_range:
+            raise IOError("interrupted")
+        download_segment(session, url, start, end, *args)
+    monkeypatch.setattr(segmented_dl, "download_segment", interrupted_segment)
+    with pytest.raises(IOError, match="interrupted"):
+        segmented_download(media_server.url, media_size, file_path, max_connections=1, resume=True)
+    done_ranges = load_done_ranges(file_path, media_size)
+    assert failing_range not in done_ranges and done_ranges
+
+    monkeypatch.setattr(segmented_dl, "download_segment", download_segment)
+    n_requests = media_server.n_requests
+    progress = []
+    segmented_download(media_server.url, media_size, file_path, on_progress=progress.append, resume=True)
+
+    assert read(file_path) == media
+    assert media_server.n_requests - n_requests == len(ranges) - len(done_ranges)
+    assert sum(progress) == media_size
+    assert load_done_ranges(file_path, media_size) == set(ranges)
+
+# ------------------------------------------------------------------------------
+# A sidecar only applies to a partial file of the size it was written for
+def test_sidecar_rejected_on_size_mismatch(tmp_path):
+    file_path = str(tmp_path / "audio")
+    ranges = set(split_ranges(media_size))
+    with open(file_path, "wb") as file:
+        file.truncate(media_size)
+    save_done_ranges(file_path, media_size, ranges)
+    assert load_done_ranges(file_path, media_size) == ranges
+
+    # Another stream size (e.g. the stream changed since the partial file was written)
+    assert load_done_ranges(file_path, media_size + 1) == set()
+    # A partial file that isn't the size in its sidecar (e.g. truncated)
+    with open(file_path, "r+b") as file:
+        file.truncate(media_size - 1)
+    assert load_done_ranges(file_path, media_size) == set()
+    # Ranges of another segment size
+    with open(file_path, "r+b") as file:
+        file.truncate(media_size)
+    with open(get_state_path(file_path), "w") as file:
+        json.dump({"file_size": media_size, "segment_size": segment_size * 2, "done": [[0, segment_size * 2 - 1]]}, file)
+    assert load_done_ranges(file_path, media_size) == set()
+
+# A rejected sidecar restarts the download from scratch
+def test_resume_with_rejected_sidecar_downloads_everything(media_server, tmp_path):
+    file_path = str(tmp_path / "audio")
+    with open(file_path, "wb") as file:
+        file.write(b"x" * 100)
+    save_done_ranges(file_path, media_size, set(split_ranges(media_size)))
+
+    segmented_download(media_server.url, media_size, file_path, resume=True)
+
+    assert read(file_path) == media
+    assert media_server.n_requests == len(split_ranges(media_size))
+
+# ------------------------------------------------------------------------------
+# A connection that ends before the end of its range is retried (and its progress rolled back)
+def test_incomplete_segment_is_retried(media_server, tmp_path, sleeps):
+    media_server.tamper = lambda n_request, path: {"truncate": 1024} if n_request == 1 else None
+    file_path = str(tmp_path / "audio")
+    progress = []
+
+    segmented_download(media_server.url, media_size, file_path, on_progress=progress.append, max_connections=1)
+
+    assert read(file_path) == media
+    assert media_server.n_requests == len(split_ranges(media_size)) + 1
+    assert len(sleeps) == 1
+    assert -1024 in progress
+    assert sum(progress) == media_size
+
+# A server that ignores the Range header (200 with the whole file) fails the segment instead of writing the wrong bytes
+def test_non_206_response_fails(media_server, tmp_path, monkeypatch, sleeps):
+    media_server.tamper = lambda n_request, path: {"ignore_range": True}
+    monkeypatch.setattr(segmented_dl, "retries", 1)
+    file_path = str(tmp_path / "audio")
+
+    with pytest.raises(IOError, match="does not support range requests"):
+        segmented_download(media_server.url, media_size, file_path, max_connections=1)
+    assert read(file_path) == b"\0" * media_size
+
+# ------------------------------------------------------------------------------
+# A 429 waits for the server's Retry-After, then lowers the number of connections
+def test_throttled_with_retry_after(media_server, tmp_path, sleeps):
+    media_server.tamper = lambda n_request, path: {"status": 429, "headers": {"Retry-After": "7"}} if n_request == 1 else None
+    file_path = str(tmp_path / "audio")
+
+    segmented_download(media_server.url, media_size, file_path, max_connections=1)
+
+    assert sleeps == [7.0]
+    assert read(file_path) == media
+    assert segmented_dl.controller.limit < segmented_dl.controller.max_limit
+
+# Without Retry-After, the wait is a jittered exponential backoff
+def test_throttled_without_retry_after(media_server, tmp_path, monkeypatch, sleeps):
+    monkeypatch.setattr(segmented_dl, "backoff_base", 0.5)
+    media_server.tamper = lambda n_request, path: {"status": 429} if n_request <= 3 else None
+
+    segmented_download(media_server.url, media_size, str(tmp_path / "audio"), max_connections=1)
+
+    assert len(sleeps) == 3
+    for (attempt, wait) in enumerate(sleeps):
+        assert 0 <= wait <= 0.5 * 2 ** attempt
+
+def test_get_backoff(monkeypatch):
+    monkeypatch.setattr(segmented_dl, "backoff_base", 1)
+    monkeypatch.setattr(segmented_dl, "backoff_max", 60)
+    assert get_backoff(0, retry_after=3) == 3
+    assert get_backoff(0, retry_after=3600) == 60
+    for attempt in range(10):
+        assert 0 <= get_backoff(attempt) <= min(60, 2 ** attempt)
+
+# ------------------------------------------------------------------------------
+# A throttled request halves the limit, the requests that fail with it within the cooldown don't
+def test_controller_halves_once_per_cooldown():
+    controller = ConnectionController(max_limit=32, min_limit=2, cooldown=60)
+    controller.on_throttled()
+    assert controller.limit == 16
+    controller.on_throttled()
+    assert controller.limit == 16
+    for _ in range(5):
+        controller.decreased_at -= 61
+        controller.on_throttled()
+    assert controller.limit == 2
+
+# Each finished segment adds 1/limit, about one connection per `limit` segments, up to max_limit
+def test_controller_additive_recovery():
+    controller = ConnectionController(max_limit=8, cooldown=0)
+    for _ in range(2):
+        controller.on_throttled()
+    assert controller.limit == 2
+    # 2 segments at a limit of 2 (2.5, 2.9), then 3 at 3 (3.24, 3.55, 3.83), then 4 at 4...
+    for limit in (2, 2, 3, 3, 3, 4):
+        controller.on_success()
+        assert int(controller.limit) == limit
+    for _ in range(100):
+        controller.on_success()
+    assert controller.limit == 8
+
+# A connection waits while the limit is reached
+def test_controller_limits_active_connections():
+    controller = ConnectionController(max_limit=1)
+    controller.acquire()
+    acquired = threading.Event()
+    def acquire():
+        controller.acquire()
+        acquired.set()
+    thread = threading.Thread(target=acquire)
+    thread.start()
+    assert not acquired.wait(0.1)
+    controller.release()
+    assert acquired.wait(1)
+    thread.join()
+
+# ------------------------------------------------------------------------------
+# An expired URL is refreshed once per generation, however many connections notice it
+def test_stream_url_refreshes_once_per_generation():
+    urls = iter(["url-1", "url-2"])
+    stream_url = StreamUrl("url-0", lambda: next(urls))
+    assert stream_url.refresh(0) and stream_url.refresh(0)
+    assert stream_url.get() == ("url-1", 1)
+    assert stream_url.refresh(1)
+    assert stream_url.get() == ("url-2", 2)
+    assert not StreamUrl("url-0").refresh(0)
+
+def test_expired_url_is_refreshed_once(media_server, tmp_path, sleeps):
+    n_segments = len(split_ranges(media_size))
+    # All the connections get the 403 of the expired URL before any of them refreshes it
+    barrier = threading.Barrier(n_segments)
+    def tamper(n_request, path):
+        if "expire=0" in path:
+            barrier.wait(5)
+            return {"status": 403}
+    media_server.tamper = tamper
+    refreshes = []
+    def refresh_url():
+        refreshes.append(1)
+        return media_server.url
+    file_path = str(tmp_path / "audio")
+
+    segmented_download(media_server.url + "&expire=0", media_size, file_path, max_connections=n_segments, refresh_url=refresh_url)
+
+    assert len(refreshes) == 1
+    assert sleeps == []
+    assert read(file_path) == media
+
+# ------------------------------------------------------------------------------
+# An error of the local file (e.g. a full disk) is raised right away, not retried
+def test_write_error_is_not_retried(media_server):
+    def write(chunks):
+        for chunk in chunks:
+            raise OSError(errno.ENOSPC, "No space left on device")
+            yield len(chunk)
+    progress = []
+
+    with requests.Session() as session, pytest.raises(OSError) as error:
+        fetch_segment(session, media_server.url, 0, segment_size - 1, write, progress.append)
+
+    assert error.value.errno == errno.ENOSPC
+    assert media_server.n_requests == 1
+    assert segmented_dl.controller.active == 0
@@ -0,0 +1,145 @@
+import os
+import sys
+import errno
+import shutil
+import subprocess
+
+import pytest
+
+from utils import staging
+from utils.staging import FileLock, discard, get_partial_path, publish
+
+# ------------------------------------------------------------------------------
+def touch(path: str):
+    with open(path, "wb") as file:
+        file.write(b"partial")
+
+# The pid of a process that has exited
+def get_dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+# ------------------------------------------------------------------------------
+# A partial file is named after its writer, and each call gets its own
+def test_partial_path_is_named_after_its_writer(tmp_path):
+    file_path = str(tmp_path / "video.webm")
+    partial_paths = [get_partial_path(file_path) for _ in range(2)]
+    assert partial_paths[0] != partial_paths[1]
+    for partial_path in partial_paths:
+        name = os.path.basename(partial_path)
+        assert name.startswith(f".video.partial-{staging.host_name}-{os.getpid()}-") and name.endswith(".webm")
+        discard(partial_path)
+
+# The partial files left by crashed writers of the same file are removed, the ones still written are kept
+def test_stale_partials_are_removed(tmp_path):
+    file_path = str(tmp_path / "video.webm")
+    prefix = f".video.partial-{staging.host_name}"
+    stale = [f"{prefix}-{get_dead_pid()}-0.webm", f"{prefix}-{os.getpid()}-999999.webm"]
+    kept = [
+        f"{prefix}-{os.getppid()}-0.webm",              # A running writer of this host
+        ".video.partial-other-host-1-0.webm",           # A writer of another host
+        f".other.partial-{staging.host_name}-{get_dead_pid()}-0.webm",  # Another file
+    ]
+    for name in stale + kept:
+        touch(str(tmp_path / name))
+    active_path = get_partial_path(file_path)
+    touch(active_path)
+
+    other_path = get_partial_path(file_path)
+
+    assert sorted(os.listdir(tmp_path)) == sorted(kept + [os.path.basename(active_path)])
+    # Once published, the file of the first writer is no longer protected
+    publish(active_path, file_path)
+    discard(other_path)
+    assert os.path.exists(file_path)
+
+# ------------------------------------------------------------------------------
+# A scratch directory on another filesystem: the first rename of a partial file fails with EXDEV
+def make_cross_device(tmp_path, monkeypatch):
+    monkeypatch.setattr(staging, "scratch_dir", str(tmp_path / "scratch"))
+    file_dir = tmp_path / "videos"
+    os.makedirs(staging.get_work_dir(str(file_dir)))
+    replace = os.replace
+    def cross_device_replace(src, dst):
+        if os.path.dirname(src) != os.path.dirname(dst):
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        replace(src, dst)
+    monkeypatch.setattr(os, "replace", cross_device_replace)
+    return str(file_dir / "video.webm")
+
+# Across filesystems, the file is copied next to its target and renamed, and no partial file is left
+def test_publish_across_filesystems(tmp_path, monkeypatch):
+    file_path = make_cross_device(tmp_path, monkeypatch)
+    partial_path = get_partial_path(file_path)
+    with open(partial_path, "wb") as file:
+        file.write(b"video" * 1000)
+
+    publish(partial_path, file_path)
+
+    with open(file_path, "rb") as file:
+        assert file.read() == b"video" * 1000
+    assert os.listdir(os.path.dirname(file_path)) == ["video.webm"]
+    assert os.listdir(os.path.dirname(partial_path)) == []
+    assert not staging.active_partials & {partial_path}
+
+# A failed copy leaves neither the target nor its half-copied file, the partial file is kept for a retry
+def test_failed_publish_across_filesystems(tmp_path, monkeypatch):
+    file_path = make_cross_device(tmp_path, monkeypatch)
+    partial_path = get_partial_path(file_path)
+    touch(partial_path)
+    def copyfile(src, dst):
+        touch(dst)
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+    monkeypatch.setattr(shutil, "copyfile", copyfile)
+
+    with pytest.raises(OSError) as error:
+        publish(partial_path, file_path)
+    assert error.value.errno == errno.ENOSPC
+
+    assert os.listdir(os.path.dirname(file_path)) == []
+    assert os.path.exists(partial_path)
+    discard(partial_path)
+
+# ------------------------------------------------------------------------------
+# A process that holds the lock of `path` until a line is written to its stdin
+holder_code = """
+import sys
+sys.path.insert(0, {project_root!r})
+from utils.staging import FileLock
+lock = FileLock({path!r})
+lock.acquire()
+print("locked", flush=True)
+sys.stdin.readline()
+lock.release()
+"""
+
+def start_holder(path: str) -> subprocess.Popen:
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen([sys.executable, "-c", holder_code.format(project_root=project_root, path=path)], stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    assert process.stdout.readline() == "locked\n"
+    return process
+
+# A file lock holds between processes, and is free again once its holder releases it
+def test_file_lock_between_processes(tmp_path):
+    path = str(tmp_path / "temp_vid_bench000000_248")
+    process = start_holder(path)
+    lock = FileLock(path)
+    assert not lock.acquire(blocking=False)
+
+    process.communicate("\n")
+
+    assert lock.acquire(blocking=False)
+    lock.release()
+    assert os.listdir(tmp_path) == []
+
+# A crashed holder releases its lock
+def test_file_lock_of_a_killed_process(tmp_path):
+    path = str(tmp_path / "temp_vid_bench000000_248")
+    process = start_holder(path)
+    process.kill()
+    process.wait()
+
+    lock = FileLock(path)
+    assert lock.acquire(blocking=False)
+    lock.release()
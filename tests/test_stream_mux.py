@@ -0,0 +1,65 @@
+import os
+import sys
+import stat
+
+import pytest
+
+from utils.ffmpeg import MergeError
+from utils.stream_mux import mux_streams
+from utils.segmented_dl import StreamUrl
+
+# ------------------------------------------------------------------------------
+# ffmpeg stand-ins that fail on their own: before opening their inputs, or after reading a bit of them
+failing_ffmpeg = {
+    "before_reading": """
+import sys
+sys.stderr.write("Unknown encoder 'copy'\\n")
+sys.exit(1)
+""",
+    "while_reading": """
+import sys
+args = sys.argv[1:]
+inputs = [open(args[idx + 1], "rb") for (idx, arg) in enumerate(args) if arg == "-i"]
+for file in inputs:
+    file.read(1024)
+sys.stderr.write("Invalid data found when processing input\\n")
+sys.exit(1)
+""",
+}
+
+@pytest.fixture(params=sorted(failing_ffmpeg))
+def ffmpeg_error(request, tmp_path, monkeypatch) -> str:
+    ffmpeg_path = str(tmp_path / "ffmpeg")
+    with open(ffmpeg_path, "w") as file:
+        file.write(f"#!{sys.executable}\n{failing_ffmpeg[request.param]}")
+    os.chmod(ffmpeg_path, os.stat(ffmpeg_path).st_mode | stat.S_IEXEC)
+    monkeypatch.setenv("FFMPEG_PATH", ffmpeg_path)
+    return "Unknown encoder" if request.param == "before_reading" else "Invalid data found"
+
+# ------------------------------------------------------------------------------
+# When ffmpeg fails, its error (with the end of its log) is raised, not the broken pipe of the streams
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="Stream muxing needs named pipes")
+def test_ffmpeg_failure_is_raised_with_its_log(make_server, tmp_path, ffmpeg_error):
+    server = make_server(n_videos=1, video_size=4 * 1024 * 1024, audio_size=1024 * 1024)
+    urls = [StreamUrl(f"{server.url}/videoplayback?id=bench000000&itag={itag}") for itag in (248, 251)]
+
+    with pytest.raises(MergeError) as error:
+        mux_streams(urls[0], server.video_size, urls[1], server.audio_size, str(tmp_path / "video.webm"))
+
+    assert error.value.return_code == 1
+    assert ffmpeg_error in error.value.stderr_tail
+
+# The streams are written to ffmpeg as they arrive (the stand-in of app_dir concatenates its inputs)
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="Stream muxing needs named pipes")
+def test_mux_streams(make_server, app_dir, tmp_path):
+    server = make_server(n_videos=1, video_size=4 * 1024 * 1024 + 5, audio_size=1024 * 1024 + 7)
+    urls = [StreamUrl(f"{server.url}/videoplayback?id=bench000000&itag={itag}") for itag in (248, 251)]
+    output_path = str(tmp_path / "video.webm")
+
+    mux_streams(urls[0], server.video_size, urls[1], server.audio_size, output_path)
+
+    with open(output_path, "rb") as file:
+        data = file.read()
+    streams = [(server.get_block("bench000000", itag) * (size // len(server.get_block("bench000000", itag)) + 1))[:size]
+               for (itag, size) in ((248, server.video_size), (251, server.audio_size))]
+    assert data == streams[0] + streams[1]
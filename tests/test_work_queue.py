@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import subprocess
+from collections import Counter
+
+from pytubefix import innertube
+
+from benchmarks.download import seed_metadata
+from utils import manifest, work_queue
+from utils.work_queue import WorkQueue, enqueue, run_worker
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ------------------------------------------------------------------------------
+# Workers on one queue in their own processes, like on several hosts (the worker id is the host and pid)
+worker_code = """
+import sys, json
+sys.path.insert(0, {project_root!r})
+from pytubefix import innertube
+innertube._cache_dir = {cache_dir!r}
+from utils import work_queue
+work_queue.renew_interval = 0.5
+work_queue.poll_interval = 0.2
+print("RESULT " + json.dumps(work_queue.run_worker({db_path!r}, workers=2)))
+"""
+
+def read_manifest(file_dir: str) -> list[dict]:
+    with open(os.path.join(file_dir, manifest.manifest_file_name), "r") as file:
+        return [json.loads(line) for line in file]
+
+def get_items(db_path: str) -> list[dict]:
+    queue = WorkQueue(db_path)
+    try:
+        with queue.lock:
+            return [dict(row) for row in queue.connection.execute("SELECT * FROM items ORDER BY idx")]
+    finally:
+        queue.close()
+
+# ------------------------------------------------------------------------------
+# Two workers share the videos of a queue, and each video is downloaded by one of them only
+def test_two_workers_download_each_video_once(make_server, app_dir):
+    n_videos = 6
+    server = make_server(n_videos=n_videos, video_size=2 * 1024 * 1024, audio_size=256 * 1024, bandwidth=2 * 1024 * 1024)
+    url = seed_metadata(server.url)
+    db_path = os.path.join(app_dir, "queue.db")
+    file_dir = os.path.join(app_dir, "videos")
+    assert enqueue(db_path, url, "Playlist", file_dir, "webm", "1080p", "160kbps") == n_videos
+
+    code = worker_code.format(project_root=project_root, cache_dir=innertube._cache_dir, db_path=db_path)
+    processes = [subprocess.Popen([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True) for _ in range(2)]
+    results = []
+    for process in processes:
+        (output, _) = process.communicate(timeout=120)
+        assert process.returncode == 0, output
+        results.append(json.loads(next(line for line in output.splitlines() if line.startswith("RESULT "))[len("RESULT "):]))
+
+    assert all(result.get("Downloaded", 0) > 0 for result in results)
+    assert sum(result.get("Downloaded", 0) for result in results) == n_videos
+    items = get_items(db_path)
+    assert [(item["state"], item["status"], item["attempts"]) for item in items] == [("done", "Downloaded", 1)] * n_videos
+    # Each download records its streams in the manifest once before it starts
+    entries = read_manifest(file_dir)
+    assert Counter(entry["video_id"] for entry in entries if entry.get("state") == "downloading") == {f"bench{idx:06d}": 1 for idx in range(n_videos)}
+    assert sorted(name for name in os.listdir(file_dir) if not name.startswith(".")) == [
+        f"{idx + 1}-benchmark-video-bench{idx:06d}.webm" for idx in range(n_videos)
+    ]
+
+# ------------------------------------------------------------------------------
+# The video of a worker that stopped renewing its lease is claimed by another worker once the lease expires
+def test_expired_lease_is_reclaimed(playlist_url, app_dir, monkeypatch):
+    # run_worker turns the manifest compaction off for the whole process
+    monkeypatch.setattr(manifest, "compact_on_load", manifest.compact_on_load)
+    monkeypatch.setattr(work_queue, "poll_interval", 0.1)
+    db_path = os.path.join(app_dir, "queue.db")
+    file_dir = os.path.join(app_dir, "videos")
+    enqueue(db_path, playlist_url, "Playlist", file_dir, "webm", "1080p", "160kbps")
+
+    queue = WorkQueue(db_path)
+    dead_item = queue.claim("dead-worker", lease=0.5)
+    assert dead_item.idx == 0
+    # While the lease holds, the video isn't given to anyone else
+    other_item = queue.claim("other-worker")
+    assert other_item.idx == 1
+    assert queue.finish(other_item, "other-worker", "Downloaded")
+    time.sleep(0.6)
+
+    counts = run_worker(db_path)
+
+    assert counts == {"Downloaded": 2}
+    items = get_items(db_path)
+    assert (items[0]["state"], items[0]["status"], items[0]["attempts"]) == ("done", "Downloaded", 2)
+    # The dead worker has lost its lease, it can't record a status anymore
+    assert not queue.finish(dead_item, "dead-worker", "Failed")
+    assert get_items(db_path)[0]["status"] == "Downloaded"
+    queue.close()
+
+# ------------------------------------------------------------------------------
+# Enqueueing doesn't rewrite the manifest of the directory, workers could be appending to it
+def test_enqueue_leaves_the_manifest_alone(playlist_url, app_dir):
+    file_dir = os.path.join(app_dir, "videos")
+    os.makedirs(file_dir)
+    manifest_path = os.path.join(file_dir, manifest.manifest_file_name)
+    with open(manifest_path, "w") as file:
+        for state in ("downloading", "downloading", "downloading", "complete"):
+            file.write(json.dumps({"video_id": "bench000000", "file_name": "1-video.webm", "state": state}) + "\n")
+    with open(manifest_path, "r") as file:
+        lines = file.read()
+
+    enqueue(os.path.join(app_dir, "queue.db"), playlist_url, "Playlist", file_dir, "webm", "1080p", "160kbps")
+
+    with open(manifest_path, "r") as file:
+        assert file.read() == lines
@@ -1,12 +1,20 @@
+from __future__ import annotations
 import re
 import os
 import inquirer
 from simple_chalk import chalk
-from pytubefix import Stream, YouTube
+from typing import TYPE_CHECKING
 
 from .file import get_main_script_location, slugify
 
 from .console import print_error
+from .manifest import get_manifest
+from .metadata_cache import CachedStream, get_video_info, prefetch_filesizes
+from .metrics import ItemMetrics, measure
+from .options import resolutions, bitrates, workers
+
+if TYPE_CHECKING:
+    from pytubefix import YouTube
 
 # ------------------------------------------------------------------------------
 # Get YouTube URL from user
@@ -37,12 +45,12 @@ def ask_yes_no(question):
     return True if answers['yes_no'] == 'Yes' else False
 
 # ------------------------------------------------------------------------------
-# Check if url is video or playlist
+# Check if url is video, playlist or channel
 def check_url(url):
     questions = [
     inquirer.List('type',
-                    message=chalk.blue.bold("Is this a video or playlist?"),
-                    choices=['Video', 'Playlist'],
+                    message=chalk.blue.bold("Is this a video, playlist or channel?"),
+                    choices=['Video', 'Playlist', 'Channel'],
                 ),
     ]
     answers = inquirer.prompt(questions)
@@ -65,7 +73,7 @@ def choose_format():
 
 # ------------------------------------------------------------------------------
 # Choose stream from list
-def choose_stream(streams: list[Stream], is_video: bool):
+def choose_stream(streams: list[CachedStream], is_video: bool, metrics: ItemMetrics | None = None):
     # Check if there are any streams
     if (len(streams) == 0):
         print_error(f"No streams available.")
@@ -79,11 +87,14 @@ def choose_stream(streams: list[Stream], is_video: bool):
         msg = f"Please select an audio stream"
     
     # Function to convert stream to string
-    def stream_to_string(stream: Stream):
+    def stream_to_string(stream: CachedStream):
         codec = stream.video_codec if is_video else stream.audio_codec
         return f"{stream.itag}: {stream.resolution if is_video else stream.abr} - {stream.filesize_mb}MB - ({stream.mime_type}) - ({codec})"
     
     # Compile a list of string options from the streams
+    # The sizes that aren't known yet are requested all at once (and kept for the download's progress bar)
+    with measure(metrics, "filesizes"):
+        prefetch_filesizes(streams)
     options = [
         stream_to_string(stream) for stream in streams
     ]
@@ -115,7 +126,7 @@ def choose_stream(streams: list[Stream], is_video: bool):
 
 # ------------------------------------------------------------------------------
 # Ask user for filename
-def get_filename(yt: YouTube, selected_video_stream: Stream):
+def get_filename(yt: YouTube, selected_video_stream: CachedStream, metrics: ItemMetrics | None = None):
     # This is a recursive function. if the file exists and user doesn't want to remove it, it asks for a new filename or directory.
     
     # Ask user for filename and directory
@@ -123,7 +134,7 @@ def get_filename(yt: YouTube, selected_video_stream: Stream):
         inquirer.Path('file_name', 
                         message=chalk.blue.bold("Please enter a file name"), 
                         path_type=inquirer.Path.FILE,
-                        default=slugify(yt.title),
+                        default=slugify(get_video_info(yt).title),
                     ),
         inquirer.Path('file_dir',
                         message=chalk.blue.bold("Please enter a directory"),
@@ -140,14 +151,16 @@ def get_filename(yt: YouTube, selected_video_stream: Stream):
     file_path = os.path.join(file_dir, file_name)
     
     # If file exists, ask user whether to remove it
-    if os.path.exists(file_path):
+    with measure(metrics, "exists_check"):
+        file_exists = os.path.exists(file_path)
+    if file_exists:
         # Ask user whether to remove it
         remove_file = ask_yes_no(f"File {file_path} already exists. Do you want to remove it?")
         if remove_file:
             os.remove(file_path)
         else:
             # Recursively ask for filename
-            return get_filename(yt, selected_video_stream)
+            return get_filename(yt, selected_video_stream, metrics)
 
     return (file_dir, file_name)
     
@@ -172,10 +185,10 @@ def get_dirname(default_dir: str):
     
     # If dir exists, ask user whether to update it
     if os.path.exists(dir):
-        # Ask user whether to update it
-        update_it = ask_yes_no(f"Directory {dir} already exists. Do you want to update it?")
+        # Ask user whether to update it (the number of downloaded videos comes from the directory's manifest)
+        update_it = ask_yes_no(f"Directory {dir} already exists with {len(get_manifest(dir))} downloaded videos. Do you want to update it?")
         if update_it:
-            # We just need to run the download playlist again it would automatically skip the existing videos
+            # We just need to run the download playlist again it would automatically skip the videos in the manifest
             return dir
         else:
             # Recursively ask for directory name
@@ -185,18 +198,6 @@ def get_dirname(default_dir: str):
 
 # ------------------------------------------------------------------------------
 # Ask user for preferred maximum resolution
-resolutions = [
-    '4320p', # 8K
-    '2160p', # 4K
-    '1440p', # 2K
-    '1080p', # Full HD
-    '720p',
-    '480p',
-    '360p',
-    '240p',
-    '144p',
-]
-    
 def get_min_resolution(): 
     questions = [
         inquirer.List('min_resolution', 
@@ -209,14 +210,7 @@ def get_min_resolution():
 
     return answers['min_resolution']
 # ------------------------------------------------------------------------------
-
-bitrates = [
-    '160kbps', 
-    '128kbps', 
-    '70kbps', 
-    '50kbps', 
-    '48kbps'
-]
+# Ask user for preferred maximum bitrate
 def get_min_bitrate():
     questions = [
         inquirer.List('min_bitrate', 
@@ -229,4 +223,18 @@ def get_min_bitrate():
 
     return answers['min_bitrate']
 
-# ------------------------------------------------------------------------------
\ No newline at end of file
+# ------------------------------------------------------------------------------
+# Ask user how many playlist videos should be downloaded at the same time
+def get_workers():
+    questions = [
+        inquirer.List('workers',
+                        message=chalk.blue.bold("How many videos should be downloaded at the same time?"),
+                        choices=workers,
+                        default=workers[0]
+                    ),
+    ]
+    answers = inquirer.prompt(questions)
+
+    return int(answers['workers'])
+
+# ------------------------------------------------------------------------------
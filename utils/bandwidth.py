@@ -0,0 +1,193 @@
+import re
+import time
+import threading
+
+# ------------------------------------------------------------------------------
+# Bandwidth scheduler: token buckets applied to each chunk read from a connection
+# - Each job (a video, playlist, channel, ...) gets its own bucket, all of its connections share it
+# - The global cap is split between the running jobs by priority: the highest priority jobs share
+#   it first (up to their own caps), the lower priorities get what's left
+# - A job that gets nothing left (preempted, e.g. a playlist sync while an interactive video downloads)
+#   still gets `preempted_rate`, so its connections aren't dropped by the server for being idle
+# - Without a global cap, jobs are only limited by their own caps
+# Rates are in bytes per second, None means unlimited
+priorities = {"bulk": 0, "interactive": 1}
+
+preempted_rate = 64 * 1024          # 64KB/s
+burst_seconds = 0.5                 # A bucket holds up to half a second of its rate
+max_sleep = 0.25                    # Waiting connections check for a new allocation this often
+
+# ------------------------------------------------------------------------------
+# Parse a rate like "500K", "10M" or "1.5G" (bytes per second); empty means unlimited
+# A rate must be at least 1 byte per second (a zero or negative rate would never let a byte through)
+def parse_rate(value: str | float | None) -> int | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError(f"Invalid rate: {value!r}")
+    if isinstance(value, (int, float)):
+        rate = int(value)
+    else:
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMG]?)B?(?:/s)?\s*", value, re.IGNORECASE)
+        if match is None:
+            raise ValueError(f"Invalid rate: {value}")
+        multiplier = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[match[2].upper()]
+        rate = int(float(match[1]) * multiplier)
+    if rate <= 0:
+        raise ValueError(f"Invalid rate: {value} (must be at least 1 byte per second)")
+    return rate
+
+# ------------------------------------------------------------------------------
+class TokenBucket:
+    def __init__(self, rate: float | None = None):
+        self.rate = rate
+        self.tokens = 0.0
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate: float | None):
+        with self.lock:
+            self._refill()
+            self.rate = rate
+
+    # --------------------------------------------------------------------------
+    # Take n bytes from the bucket, waiting until the bucket has refilled if it ran out
+    # The bucket can go into debt, so a chunk larger than the bucket only waits for its own size
+    def consume(self, n_bytes: int):
+        with self.lock:
+            self._refill()
+            if self.rate is None:
+                return
+            self.tokens -= n_bytes
+        while True:
+            with self.lock:
+                self._refill()
+                if self.rate is None or self.tokens >= 0:
+                    return
+                wait = -self.tokens / self.rate
+            time.sleep(min(wait, max_sleep))
+
+    def _refill(self):
+        now = time.monotonic()
+        if self.rate is not None:
+            self.tokens = min(self.tokens + (now - self.updated_at) * self.rate, self.rate * burst_seconds)
+        self.updated_at = now
+
+# ------------------------------------------------------------------------------
+# A job's share of the bandwidth (close it when the job is done, or use it as a context manager)
+class BandwidthJob:
+    def __init__(self, scheduler: "BandwidthScheduler", name: str, priority: str, max_rate: int | None):
+        self.scheduler = scheduler
+        self.name = name
+        self.priority = priority
+        self.max_rate = max_rate
+        self.allocated_rate: float | None = None
+        self.bucket = TokenBucket()
+        # Bytes transferred and an exponential moving average of the rate (for the snapshot)
+        self.bytes = 0
+        self.rate = 0.0
+        self.measured_at = time.monotonic()
+        self.measured_bytes = 0
+
+    # --------------------------------------------------------------------------
+    # Called for each chunk read by the job's connections
+    def consume(self, n_bytes: int):
+        self.bucket.consume(n_bytes)
+        with self.scheduler.lock:
+            self.bytes += n_bytes
+            self._measure()
+
+    def _measure(self):
+        now = time.monotonic()
+        elapsed = now - self.measured_at
+        if elapsed >= 1:
+            self.rate = 0.5 * self.rate + 0.5 * (self.bytes - self.measured_bytes) / elapsed
+            self.measured_at = now
+            self.measured_bytes = self.bytes
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.scheduler.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# ------------------------------------------------------------------------------
+class BandwidthScheduler:
+    def __init__(self, global_rate: int | None = None):
+        self.global_rate = global_rate
+        self.jobs: list[BandwidthJob] = []
+        self.lock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    # Add a job (priority is "bulk" or "interactive")
+    def add(self, name: str, priority: str = "bulk", max_rate: int | None = None) -> BandwidthJob:
+        if priority not in priorities:
+            raise ValueError(f"Invalid priority: {priority}")
+        job = BandwidthJob(self, name, priority, max_rate)
+        with self.lock:
+            self.jobs.append(job)
+            self._allocate()
+        return job
+
+    def remove(self, job: BandwidthJob):
+        with self.lock:
+            if job in self.jobs:
+                self.jobs.remove(job)
+                self._allocate()
+
+    def set_global_rate(self, global_rate: int | None):
+        with self.lock:
+            self.global_rate = global_rate
+            self._allocate()
+
+    # --------------------------------------------------------------------------
+    # Current allocation of the bandwidth, e.g. for the daemon's /bandwidth endpoint
+    def snapshot(self) -> dict:
+        with self.lock:
+            jobs = []
+            for job in self.jobs:
+                job._measure()
+                jobs.append({
+                    "name": job.name,
+                    "priority": job.priority,
+                    "max_rate": job.max_rate,
+                    "allocated_rate": job.allocated_rate,
+                    "rate": round(job.rate),
+                    "bytes": job.bytes,
+                })
+            return {"global_rate": self.global_rate, "jobs": jobs}
+
+    # --------------------------------------------------------------------------
+    # Split the global rate between the jobs (called with the lock held)
+    def _allocate(self):
+        remaining = self.global_rate
+        for priority in sorted(set(job.priority for job in self.jobs), key=priorities.get, reverse=True):
+            jobs = [job for job in self.jobs if job.priority == priority]
+            if remaining is None:
+                for job in jobs:
+                    job.allocated_rate = job.max_rate
+                continue
+            # Equal shares, except that a job capped below its share leaves the rest to the others
+            # (the jobs with the lowest caps are served first)
+            jobs.sort(key=lambda job: job.max_rate if job.max_rate is not None else float("inf"))
+            left = remaining
+            for (idx, job) in enumerate(jobs):
+                share = left / (len(jobs) - idx)
+                job.allocated_rate = share if job.max_rate is None else min(share, job.max_rate)
+                left -= job.allocated_rate
+            remaining = left
+        for job in self.jobs:
+            if job.allocated_rate is not None:
+                floor = preempted_rate if job.max_rate is None else min(preempted_rate, job.max_rate)
+                job.allocated_rate = max(job.allocated_rate, floor)
+            job.bucket.set_rate(job.allocated_rate)
+
+# ------------------------------------------------------------------------------
+# Shared by all the downloads in the process (the global cap is set from the command line)
+scheduler = BandwidthScheduler()
+
+# ------------------------------------------------------------------------------
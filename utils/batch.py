@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .options import resolutions, bitrates
+from .file import get_main_script_location
+from .console import print_error, print_info
+from .object_store import open_store
+from .bandwidth import parse_rate, priorities, scheduler
+from .metrics import recorder
+from .playlist_dl import download_channel, download_playlist, download_video, get_status
+
+# ------------------------------------------------------------------------------
+# Batch mode runs download jobs without asking the user anything
+# A job is a dict like:
+#   {"url": "...", "type": "Playlist", "format": "webm", "min_resolution": "1080p", "min_bitrate": "128kbps", "dir": "..."}
+# Only "url" is required, the other keys default to the values below
+job_defaults = {
+    "type": "Video",
+    "format": "webm",
+    "min_resolution": resolutions[0],
+    "min_bitrate": bitrates[0],
+    "dir": None,            # videos/ for a video, videos/<playlist-title>/ or videos/<channel-name>/ otherwise
+    "workers": 1,           # Number of playlist videos downloaded at the same time
+    "merge_workers": None,  # Number of playlist videos merged at the same time (None: depends on the cores)
+    "stream_mux": False,
+    "sync": False,          # Playlists only, channels are always synced
+    "store": None,          # Shared object store: true for videos/.store, or its directory (see object_store.py)
+    "priority": "bulk",     # "interactive" jobs get the bandwidth before "bulk" jobs (see bandwidth.py)
+    "max_rate": None,       # Bandwidth cap of the job, e.g. "5M" (bytes per second)
+}
+
+# ------------------------------------------------------------------------------
+# Read jobs from a JSON lines file (one job per line, empty lines are ignored)
+def load_jobs(job_file: str) -> list[dict]:
+    jobs = []
+    with open(job_file, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                jobs.append(json.loads(line))
+    return jobs
+
+# ------------------------------------------------------------------------------
+# Check a job and fill in its defaults
+def validate_job(job: dict) -> dict:
+    job = {**job_defaults, **job}
+    if not job.get("url"):
+        raise ValueError("Job has no url")
+    if job["type"] not in ("Video", "Playlist", "Channel"):
+        raise ValueError(f"Invalid type: {job['type']}")
+    if job["format"] not in ("webm", "mp4"):
+        raise ValueError(f"Invalid format: {job['format']}")
+    if job["min_resolution"] not in resolutions:
+        raise ValueError(f"Invalid min_resolution: {job['min_resolution']}")
+    if job["min_bitrate"] not in bitrates:
+        raise ValueError(f"Invalid min_bitrate: {job['min_bitrate']}")
+    if not isinstance(job["store"], (bool, str, type(None))):
+        raise ValueError(f"Invalid store: {job['store']}")
+    if job["priority"] not in priorities:
+        raise ValueError(f"Invalid priority: {job['priority']}")
+    job["max_rate"] = parse_rate(job["max_rate"])
+    return job
+
+# ------------------------------------------------------------------------------
+# Run a single job and return its result
+# A result is a dict like: {"url": "...", "type": "Playlist", "status": "Downloaded", "items": [...], "error": None, "duration": 12.3}
+# `on_progress(done, total)` reports the number of finished videos
+def run_job(job: dict, on_progress=None) -> dict:
+    started_at = time.time()
+    result = {"url": job.get("url"), "type": job.get("type", job_defaults["type"]), "status": "Failed", "items": [], "error": None}
+    try:
+        job = validate_job(job)
+        store = open_store(job["store"])
+        if job["type"] == "Video":
+            # Same stream selection as the playlist videos, but without an index in the file name
+            file_dir = job["dir"] or os.path.join(get_main_script_location(), "videos")
+            from pytubefix import YouTube
+            metrics = recorder.start_item(job["url"], job["url"])
+            status = "Failed"
+            try:
+                with metrics.phase("metadata"):
+                    yt = YouTube(job["url"], use_oauth=True, allow_oauth_cache=True)
+                if on_progress is not None:
+                    on_progress(0, 1)
+                with scheduler.add(job["url"], job["priority"], job["max_rate"]) as bandwidth:
+                    status = get_status(download_video(yt, file_dir, job["format"], job["min_resolution"], job["min_bitrate"], None, stream_mux=job["stream_mux"], store=store, bandwidth=bandwidth,
+                                                       metrics=metrics))
+            finally:
+                metrics.finish(status)
+            result["items"] = [{"url": job["url"], "status": status}]
+            if on_progress is not None:
+                on_progress(1, 1)
+        else:
+            options = dict(
+                workers=job["workers"],
+                merge_workers=job["merge_workers"],
+                stream_mux=job["stream_mux"],
+                format=job["format"],
+                file_dir=job["dir"],
+                min_resolution=job["min_resolution"],
+                min_bitrate=job["min_bitrate"],
+                on_progress=on_progress,
+                store=store,
+                priority=job["priority"],
+                max_rate=job["max_rate"],
+                # A job without a dir goes to the default directory, there is no one to ask
+                ask=False,
+            )
+            if job["type"] == "Channel":
+                items = download_channel(job["url"], **options)
+            else:
+                items = download_playlist(job["url"], sync=job["sync"], **options)
+            result["items"] = [{"url": url, "status": status} for (url, status) in items]
+        # A job fails if any of its videos failed, and is skipped if all of its videos were skipped
+        statuses = [item["status"] for item in result["items"]]
+        if "Failed" in statuses:
+            result["status"] = "Failed"
+        elif statuses and all(status == "Skipped" for status in statuses):
+            result["status"] = "Skipped"
+        else:
+            result["status"] = "Downloaded"
+    except Exception as e:
+        result["error"] = str(e)
+    result["duration"] = round(time.time() - started_at, 3)
+    return result
+
+# ------------------------------------------------------------------------------
+# Run jobs (`workers` of them at the same time) and write each result as a JSON line as soon as it's done
+# Returns the results in the order of the jobs
+def run_jobs(jobs: list[dict], workers: int = 1, output=sys.stdout) -> list[dict]:
+    output_lock = threading.Lock()
+
+    def run(job):
+        print_info(f"Starting job: {job.get('url')}")
+        result = run_job(job)
+        if result["error"]:
+            print_error(f"Job failed: {job.get('url')}: {result['error']}")
+        with output_lock:
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, jobs))
+
+# ------------------------------------------------------------------------------
@@ -1,46 +1,84 @@
 import os
 import requests
 import sys
+import threading
 import geoip2.database
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from .console import print_error, print_success
 from .file import get_project_root
+from .transport import get_session
+
+# ------------------------------------------------------------------------------
+# The public IP is fetched on every check, since it changes as soon as the VPN is turned on/off
+# Its country isn't cached: a lookup in the memory mapped database is cheaper than reading any cache
+# A single GeoIP reader is kept for the lifetime of the process
+reader: geoip2.database.Reader | None = None
+reader_lock = threading.Lock()
+
+# ------------------------------------------------------------------------------
+def get_reader() -> geoip2.database.Reader:
+    global reader
+    with reader_lock:
+        if reader is None:
+            db_path = os.path.join(get_project_root(), "data", "GeoLite2-Country.mmdb")
+            reader = geoip2.database.Reader(db_path, mode=geoip2.database.MODE_MMAP)
+        return reader
 
 # ------------------------------------------------------------------------------
 # Get the country name from ip address
 def get_country_of_ip(ip: str) -> str:
-    db_path = os.path.join(get_project_root(), "data", "GeoLite2-Country.mmdb")
-    with geoip2.database.Reader(db_path) as reader:
-        response = reader.country(ip)
-        return response.country.name
-        
+    response = get_reader().country(ip)
+    return response.country.name
 
 # ------------------------------------------------------------------------------
-def check_vpn():
+# Get the public IP and its country
+def get_location() -> tuple[str | None, str | None]:
+    response = get_session().get("https://api.ipify.org?format=json", timeout=10)
+    response.raise_for_status()
+    ip = response.json().get("ip")
+    if not ip:
+        return (None, None)
+    return (ip, get_country_of_ip(ip))
+
+# ------------------------------------------------------------------------------
+# Check the location without printing anything or exiting
+# Returns (ok, message)
+def check_location() -> tuple[bool, str]:
     try:
-        response = requests.get("https://api.ipify.org?format=json")
-        response.raise_for_status()
-        ip = response.json().get("ip")
-        # ----------------------------------------------------------------------
-        # Check if the current IP is from Iran
-        if ip:
-            # Get country name
-            country = get_country_of_ip(ip)
-            if country == "Iran":
-                print_error("You are in Iran! Please, connect to VPN.")
-                sys.exit(1)
-            elif country == None:
-                print_error("Could not determine IP location.")
-                sys.exit(1)
-            else:
-                print_success(f"You are in {country}")
-        else:
-            print_error("Could not determine IP location.")
-            sys.exit(1)
-    except requests.RequestException as e:
-        print_error("Error fetching public IP")
-        sys.exit(1)
+        (ip, country) = get_location()
+    except requests.RequestException:
+        return (False, "Error fetching public IP")
+    except Exception as e:
+        # e.g. missing GeoIP database or an IP that isn't in it
+        return (False, f"Could not determine IP location: {e}")
+    # --------------------------------------------------------------------------
+    # Check if the current IP is from Iran
+    if country == "Iran":
+        return (False, "You are in Iran! Please, connect to VPN.")
+    elif country == None:
+        return (False, "Could not determine IP location.")
+    return (True, f"You are in {country}")
 
 # ------------------------------------------------------------------------------
+# Start the check in the background (e.g. while the user is typing the URL)
+def start_vpn_check() -> Future:
+    executor = ThreadPoolExecutor(max_workers=1)
+    future = executor.submit(check_location)
+    executor.shutdown(wait=False)
+    return future
 
+# ------------------------------------------------------------------------------
+# Print the result of a check and exit if it failed
+def finish_vpn_check(future: Future):
+    (ok, message) = future.result()
+    if not ok:
+        print_error(message)
+        sys.exit(1)
+    print_success(message)
 
+# ------------------------------------------------------------------------------
+def check_vpn():
+    finish_vpn_check(start_vpn_check())
+
+# ------------------------------------------------------------------------------
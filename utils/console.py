@@ -1,22 +1,35 @@
 import os
+import shutil
 from simple_chalk import chalk
 
-terminal_width = os.get_terminal_size().columns
+# Where messages are printed (None is stdout, batch mode uses stderr to keep stdout for its results)
+log_file = None
+# Prints the messages instead of print() while the progress display is shown below them (see progress.py)
+print_hook = None
 # ------------------------------------------------------------------------------
 def clear_console():
     os.system("cls" if os.name == "nt" else "clear")
     
 # ------------------------------------------------------------------------------
 def print_separator():
-    print('-' * terminal_width)
+    # Measured on each call (the terminal can be resized), falls back to 80 columns when stdout is not a terminal
+    terminal_width = shutil.get_terminal_size().columns
+    print_message('-' * terminal_width)
 
 # ------------------------------------------------------------------------------
 # Print with chalk
 def print_success(message):
-    print(chalk.green.bold(message))
+    print_message(chalk.green.bold(message))
 
 def print_error(message):
-    print(chalk.red.bold(message))
+    print_message(chalk.red.bold(message))
 
 def print_info(message):
-    print(chalk.blue.bold(message))
\ No newline at end of file
+    print_message(chalk.blue.bold(message))
+
+# ------------------------------------------------------------------------------
+def print_message(message: str):
+    if print_hook is not None:
+        print_hook(message)
+    else:
+        print(message, file=log_file)
@@ -0,0 +1,146 @@
+import json
+import time
+import threading
+from uuid import uuid4 as UUID
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .console import print_info
+from .batch import run_job, validate_job
+from .bandwidth import scheduler as bandwidth_scheduler
+
+# ------------------------------------------------------------------------------
+# Download daemon: a resident process that takes jobs over a local HTTP API
+# - Jobs are the same dicts as in batch mode (see batch.py)
+# - At most `workers` jobs run at the same time, the rest wait in the queue
+# - Imports, the VPN check and the metadata cache stay warm between jobs
+#   (the VPN check runs once at start-up, a failed check fails the jobs)
+#
+# API:
+#   POST /jobs         Queue a job (JSON body), returns {"id": "..."}
+#   GET  /jobs         List all jobs
+#   GET  /jobs/<id>    Status, progress and result of a job
+#   GET  /bandwidth    Current bandwidth allocation of the running jobs (see bandwidth.py)
+#   GET  /health       {"ok": true}
+
+# ------------------------------------------------------------------------------
+class JobScheduler:
+    def __init__(self, workers: int = 1, vpn_check: Future | None = None):
+        # Result of the start-up VPN check (see check_vpn.start_vpn_check)
+        self.vpn_check = vpn_check
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.lock = threading.Lock()
+        self.jobs: dict[str, dict] = {}
+
+    # --------------------------------------------------------------------------
+    # Queue a job and return its record
+    def submit(self, job: dict) -> dict:
+        job = validate_job(job)
+        record = {
+            "id": str(UUID()),
+            "job": job,
+            "state": "queued",      # queued -> running -> finished
+            "progress": {"done": 0, "total": None},
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+        }
+        with self.lock:
+            self.jobs[record["id"]] = record
+        self.executor.submit(self._run, record)
+        return record
+
+    # --------------------------------------------------------------------------
+    def get(self, job_id: str) -> dict | None:
+        with self.lock:
+            record = self.jobs.get(job_id)
+            return json.loads(json.dumps(record)) if record else None
+
+    def list(self) -> list[dict]:
+        with self.lock:
+            return json.loads(json.dumps(list(self.jobs.values())))
+
+    # --------------------------------------------------------------------------
+    def _run(self, record: dict):
+        def on_progress(done, total):
+            with self.lock:
+                record["progress"] = {"done": done, "total": total}
+
+        with self.lock:
+            record["state"] = "running"
+            record["started_at"] = time.time()
+        print_info(f"Starting job {record['id']}: {record['job']['url']}")
+        # The VPN check runs once per daemon, so this only waits for the first jobs
+        (vpn_ok, vpn_message) = self.vpn_check.result() if self.vpn_check else (True, None)
+        if vpn_ok:
+            result = run_job(record["job"], on_progress)
+        else:
+            result = {"url": record["job"]["url"], "type": record["job"]["type"], "status": "Failed", "items": [], "error": vpn_message, "duration": 0}
+        with self.lock:
+            record["state"] = "finished"
+            record["finished_at"] = time.time()
+            record["result"] = result
+        print_info(f"Finished job {record['id']}: {result['status']}")
+
+# ------------------------------------------------------------------------------
+# Handles the HTTP API (the scheduler is set on the server)
+class RequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        scheduler: JobScheduler = self.server.scheduler
+        if self.path == "/health":
+            self.send_json(200, {"ok": True})
+        elif self.path == "/jobs":
+            self.send_json(200, scheduler.list())
+        elif self.path == "/bandwidth":
+            self.send_json(200, bandwidth_scheduler.snapshot())
+        elif self.path.startswith("/jobs/"):
+            record = scheduler.get(self.path[len("/jobs/"):])
+            if record is None:
+                self.send_json(404, {"error": "Job not found"})
+            else:
+                self.send_json(200, record)
+        else:
+            self.send_json(404, {"error": "Not found"})
+
+    def do_POST(self):
+        scheduler: JobScheduler = self.server.scheduler
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length))
+            record = scheduler.submit(job)
+        except (ValueError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        self.send_json(202, {"id": record["id"]})
+
+    # --------------------------------------------------------------------------
+    def send_json(self, status: int, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Keep the console for the download messages
+    def log_message(self, format, *args):
+        pass
+
+# ------------------------------------------------------------------------------
+# Run the daemon until it's interrupted
+def serve(host: str = "127.0.0.1", port: int = 8765, workers: int = 1, vpn_check: Future | None = None):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.scheduler = JobScheduler(workers, vpn_check)
+    print_info(f"Listening on http://{host}:{server.server_port} ({workers} jobs at a time)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,62 @@
+import os
+import time
+import subprocess
+
+from .file import get_ffmpeg_path
+from .console import print_success
+from .progress import progress
+
+# ------------------------------------------------------------------------------
+# Running ffmpeg to mux a video and an audio stream into one file
+# - Only errors are logged by ffmpeg, and the end of its log is kept in the exception when a merge fails
+# - Each merge reports its wall time and output size, to compare the merge time with the download time
+stderr_tail_lines = 20
+
+# ------------------------------------------------------------------------------
+class MergeError(Exception):
+    def __init__(self, return_code: int, stderr: str):
+        self.return_code = return_code
+        # The last lines of ffmpeg's log (the first lines are usually the input details)
+        self.stderr_tail = "\n".join(stderr.strip().splitlines()[-stderr_tail_lines:])
+        super().__init__(f"ffmpeg exited with code {return_code}" + (f":\n{self.stderr_tail}" if self.stderr_tail else ""))
+
+# ------------------------------------------------------------------------------
+# Command that muxes the inputs into the output (streams are copied to retain quality)
+def get_merge_command(video_input: str, audio_input: str, output_path: str) -> list[str]:
+    return [
+        get_ffmpeg_path(),
+        '-hide_banner',
+        '-loglevel', 'error',
+        '-nostdin',
+        '-y',
+        '-i', video_input,
+        '-i', audio_input,
+        '-c:v', 'copy',    # Copy video codec to retain quality
+        '-c:a', 'copy',    # Copy audio codec to retain quality
+        output_path
+    ]
+
+# ------------------------------------------------------------------------------
+# Merge a downloaded video and audio file
+# Returns the wall time (seconds) and output size (bytes) of the merge
+# The output is a partial file, so the caller reports the merge once the file is published (see print_merged)
+def run_merge(video_path: str, audio_path: str, output_path: str) -> tuple[float, int]:
+    started_at = time.perf_counter()
+    with progress.add(os.path.basename(output_path), kind="merge"):
+        process = subprocess.run(get_merge_command(video_path, audio_path, output_path), stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise MergeError(process.returncode, process.stderr.decode("utf-8", "replace"))
+    duration = time.perf_counter() - started_at
+    size = os.path.getsize(output_path)
+    return (duration, size)
+
+# Report a merged file under its final path, with the wall time and size of its merge (if it was merged from files)
+def print_merged(file_path: str, merge_stats: tuple[float, int] | None = None):
+    print_success(f"Merged file saved to: {file_path}" + (f" ({format_merge_stats(*merge_stats)})" if merge_stats is not None else ""))
+
+# ------------------------------------------------------------------------------
+def format_merge_stats(duration: float, size: int) -> str:
+    size_mb = size / 1024 / 1024
+    return f"{size_mb:.1f}MB in {duration:.2f}s, {size_mb / max(duration, 0.001):.1f}MB/s"
+
+# ------------------------------------------------------------------------------
@@ -1,5 +1,6 @@
 import os
 import sys
+import shutil
 import unicodedata
 import re
 
@@ -53,4 +54,29 @@ def get_main_script_location() -> str:
     else:
         # Running in development mode
         # __file__ can be any imported module, but sys.argv[0] is the main script
-        return os.path.dirname(os.path.abspath(sys.argv[0]))
\ No newline at end of file
+        return os.path.dirname(os.path.abspath(sys.argv[0]))
+
+# ------------------------------------------------------------------------------
+def get_ffmpeg_path() -> str:
+    """
+    Returns the path of the ffmpeg executable.
+    
+    - The FFMPEG_PATH environment variable, if it's set.
+    - The executable bundled in the data directory (ffmpeg.exe on Windows, ffmpeg elsewhere).
+    - The ffmpeg found on the PATH (e.g. installed by the package manager on Linux).
+    Falls back to the bundled path, so a missing ffmpeg fails with that path in the error.
+    """
+    if os.environ.get("FFMPEG_PATH"):
+        return os.environ["FFMPEG_PATH"]
+    bundled_path = os.path.join(get_project_root(), "data", "ffmpeg.exe" if os.name == "nt" else "ffmpeg")
+    if os.path.isfile(bundled_path):
+        return bundled_path
+    return shutil.which("ffmpeg") or bundled_path
+
+
+# ------------------------------------------------------------------------------
+def get_cache_dir() -> str:
+    """
+    Returns the cache directory (OAuth tokens and metadata) next to the main script/executable.
+    """
+    return os.path.join(get_main_script_location(), "__cache__")
@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import threading
+
+# ------------------------------------------------------------------------------
+# Each download directory has a manifest of its videos, keyed by YouTube video id
+# - It's an append-only JSON lines file: each line updates one entry, later lines win
+# - Skip checks are dict lookups instead of a glob over the whole directory
+manifest_file_name = ".yt-dl-manifest.jsonl"
+
+# Rewrite a manifest when it's loaded and most of its lines are outdated
+# (turned off when several processes append to the same manifests, see work_queue.py)
+compact_on_load = True
+
+# Manifests loaded in this process (one per directory, shared between threads)
+manifests: dict[str, "Manifest"] = {}
+manifests_lock = threading.Lock()
+
+# ------------------------------------------------------------------------------
+# Get the manifest of a directory (loaded once per process)
+def get_manifest(file_dir: str) -> "Manifest":
+    key = os.path.abspath(file_dir)
+    with manifests_lock:
+        if key not in manifests:
+            manifests[key] = Manifest(file_dir)
+        return manifests[key]
+
+# ------------------------------------------------------------------------------
+class Manifest:
+    def __init__(self, file_dir: str):
+        self.file_dir = file_dir
+        self.path = os.path.join(file_dir, manifest_file_name)
+        self.lock = threading.Lock()
+        self.entries: dict[str, dict] = {}
+        n_lines = self._load()
+        # Rewrite the file if most of its lines are outdated updates
+        if compact_on_load and n_lines > 2 * len(self.entries):
+            self._compact()
+        # Slugs of the files downloaded before the directory had a manifest (listed once)
+        self.legacy_slugs = self._list_legacy_slugs()
+
+    # --------------------------------------------------------------------------
+    # Number of downloaded videos (including the files from before the manifest existed)
+    def __len__(self):
+        return sum(1 for entry in self.entries.values() if entry.get("state") == "complete") + len(self.legacy_slugs)
+
+    # --------------------------------------------------------------------------
+    def get(self, video_id: str) -> dict | None:
+        return self.entries.get(video_id)
+
+    # --------------------------------------------------------------------------
+    # Check if a video has been downloaded completely (and its file is still there)
+    def is_complete(self, video_id: str) -> bool:
+        entry = self.entries.get(video_id)
+        if entry is None or entry.get("state") != "complete":
+            return False
+        return os.path.exists(os.path.join(self.file_dir, entry["file_name"]))
+
+    # --------------------------------------------------------------------------
+    # Read the lines other processes appended since the manifest was loaded (e.g. the other workers of a work queue)
+    def reload(self):
+        with self.lock:
+            self._load()
+
+    # --------------------------------------------------------------------------
+    # Check if a file with this slug was downloaded before the manifest existed
+    def has_legacy_file(self, slug: str) -> bool:
+        return slug in self.legacy_slugs
+
+    # --------------------------------------------------------------------------
+    # Update the entry of a video and append the change to the manifest file
+    def update(self, video_id: str, **fields):
+        with self.lock:
+            entry = self.entries.setdefault(video_id, {"video_id": video_id})
+            entry.update(fields)
+            os.makedirs(self.file_dir, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry) + "\n")
+
+    # --------------------------------------------------------------------------
+    def _load(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        n_lines = 0
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                n_lines += 1
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash can leave a half-written last line
+                    continue
+                self.entries[entry["video_id"]] = entry
+        return n_lines
+
+    # --------------------------------------------------------------------------
+    def _compact(self):
+        with open(f"{self.path}.tmp", "w", encoding="utf-8") as file:
+            for entry in self.entries.values():
+                file.write(json.dumps(entry) + "\n")
+        os.replace(f"{self.path}.tmp", self.path)
+
+    # --------------------------------------------------------------------------
+    # File names look like "<playlist_idx>-<slug>.<ext>", the index and extension might have changed since
+    def _list_legacy_slugs(self) -> set[str]:
+        if not os.path.isdir(self.file_dir):
+            return set()
+        known_files = {entry.get("file_name") for entry in self.entries.values()}
+        slugs = set()
+        for file_name in os.listdir(self.file_dir):
+            if file_name in known_files or file_name.startswith((".", "temp_")):
+                continue
+            slug = os.path.splitext(file_name)[0]
+            slugs.add(re.sub(r'^\d+-', '', slug))
+        return slugs
+
+# ------------------------------------------------------------------------------
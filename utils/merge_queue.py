@@ -0,0 +1,89 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+# ------------------------------------------------------------------------------
+# A bounded queue of merge jobs consumed by a fixed number of worker threads
+# - Downloads submit their finished files and continue with the next video while the merge runs
+# - When the queue is full, submit() blocks until a worker is free (backpressure),
+#   so downloaded temp files can't pile up on disk faster than they are merged
+# - The time each job waited in the queue and ran is recorded: long waits mean the merges,
+#   not the downloads, are the bottleneck
+
+# A merge copies the streams (no re-encoding), so it uses about one core and is mostly limited by the disk:
+# more than a few merges at the same time only compete for the same disk
+max_workers = 4
+
+# ------------------------------------------------------------------------------
+# Number of merge workers for this machine: half of the cores available to the process, at most `max_workers`
+def get_default_workers() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        cores = len(os.sched_getaffinity(0))
+    else:
+        cores = os.cpu_count() or 1
+    return max(1, min(cores // 2, max_workers))
+
+# ------------------------------------------------------------------------------
+class MergeQueue:
+    def __init__(self, workers: int | None = None, max_pending: int = 1):
+        if workers is None:
+            workers = get_default_workers()
+        self.workers = workers
+        self.jobs: queue.Queue = queue.Queue(maxsize=max_pending)
+        # (seconds waited in the queue, seconds run) of each finished job
+        self.timings: list[tuple[float, float]] = []
+        self.threads = [
+            threading.Thread(target=self._work, name=f"merge-{idx}", daemon=True) for idx in range(workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    # --------------------------------------------------------------------------
+    # Queue a job and return a Future of its result (blocks while the queue is full)
+    def submit(self, fn, *args) -> Future:
+        future = Future()
+        self.jobs.put((future, fn, args, time.perf_counter()))
+        return future
+
+    # --------------------------------------------------------------------------
+    # Wait for the queued jobs to finish and stop the workers
+    def close(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # --------------------------------------------------------------------------
+    # Total time the jobs waited in the queue and ran
+    def get_totals(self) -> tuple[int, float, float]:
+        timings = list(self.timings)
+        return (len(timings), sum(wait for (wait, _) in timings), sum(run for (_, run) in timings))
+
+    # --------------------------------------------------------------------------
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            (future, fn, args, submitted_at) = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            started_at = time.perf_counter()
+            try:
+                result = fn(*args)
+            except BaseException as e:
+                self.timings.append((started_at - submitted_at, time.perf_counter() - started_at))
+                future.set_exception(e)
+            else:
+                self.timings.append((started_at - submitted_at, time.perf_counter() - started_at))
+                future.set_result(result)
+
+# ------------------------------------------------------------------------------
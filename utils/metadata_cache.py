@@ -0,0 +1,255 @@
+from __future__ import annotations
+import os
+import json
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse, parse_qs
+from typing import TYPE_CHECKING, Iterator
+
+# pytubefix is only imported when a request is needed (it's slow to import)
+if TYPE_CHECKING:
+    from pytubefix import Playlist, YouTube, Stream
+
+# ------------------------------------------------------------------------------
+# On-disk cache of YouTube metadata (playlist contents, video titles and stream manifests)
+# - Lives next to the OAuth tokens in PyTube's cache directory (`__cache__` in main.py)
+# - Each entry is a JSON file with an expiry time; the least recently used entries are
+#   evicted once the cache grows over `max_bytes`
+# - Video entries expire with their signed stream URLs, so a cached URL is never stale
+playlist_ttl = 60 * 60             # 1 hour: new videos in a playlist show up after this
+url_expiry_margin = 10 * 60        # Drop video entries 10 minutes before their stream URLs expire
+max_bytes = 50 * 1024 * 1024       # 50MB
+
+# ------------------------------------------------------------------------------
+class MetadataCache:
+    def __init__(self, cache_dir: str, max_bytes: int = max_bytes):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        # Size of each entry file, listed on first use
+        self.sizes: dict[str, int] | None = None
+
+    # --------------------------------------------------------------------------
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] <= time.time():
+            self.invalidate(key)
+            return None
+        # Update the modification time, it's used to find the least recently used entries
+        os.utime(path)
+        return entry["value"]
+
+    # --------------------------------------------------------------------------
+    def set(self, key: str, value, ttl: float):
+        if ttl <= 0:
+            return
+        data = json.dumps({"key": key, "expires_at": time.time() + ttl, "value": value})
+        path = self._path(key)
+        with self.lock:
+            sizes = self._list_sizes()
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                file.write(data)
+            os.replace(f"{path}.tmp", path)
+            sizes[path] = len(data)
+            self._evict(sizes)
+
+    # --------------------------------------------------------------------------
+    def invalidate(self, key: str):
+        path = self._path(key)
+        with self.lock:
+            self._list_sizes().pop(path, None)
+            if os.path.exists(path):
+                os.remove(path)
+
+    # --------------------------------------------------------------------------
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _list_sizes(self) -> dict[str, int]:
+        if self.sizes is None:
+            self.sizes = {}
+            if os.path.isdir(self.cache_dir):
+                for file_name in os.listdir(self.cache_dir):
+                    if file_name.endswith(".json"):
+                        path = os.path.join(self.cache_dir, file_name)
+                        self.sizes[path] = os.path.getsize(path)
+        return self.sizes
+
+    # Remove the least recently used entries until the cache fits in max_bytes
+    def _evict(self, sizes: dict[str, int]):
+        total = sum(sizes.values())
+        if total <= self.max_bytes:
+            return
+        for path in sorted(sizes, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0):
+            total -= sizes.pop(path)
+            if os.path.exists(path):
+                os.remove(path)
+            if total <= self.max_bytes:
+                break
+
+# ------------------------------------------------------------------------------
+# The cache is created on first use, after main.py has set PyTube's cache directory
+cache: MetadataCache | None = None
+cache_lock = threading.Lock()
+
+def get_cache() -> MetadataCache:
+    global cache
+    from pytubefix import innertube
+    with cache_lock:
+        if cache is None:
+            cache = MetadataCache(os.path.join(innertube._cache_dir, "metadata"))
+        return cache
+
+# ------------------------------------------------------------------------------
+# Sizes of the streams that needed a request, by (video id, itag)
+filesizes: dict[tuple[str, int], int] = {}
+
+# ------------------------------------------------------------------------------
+# A stream of a video as stored in the cache
+# It has the attributes of pytubefix's Stream that the downloaders use
+class CachedStream:
+    def __init__(self, data: dict, video_id: str):
+        self.video_id = video_id
+        self.itag: int = data["itag"]
+        self.url: str = data["url"]
+        self.mime_type: str = data["mime_type"]
+        self.subtype: str = data["subtype"]
+        self.resolution: str | None = data["resolution"]
+        self.abr: str | None = data["abr"]
+        self.video_codec: str | None = data["video_codec"]
+        self.audio_codec: str | None = data["audio_codec"]
+        self.includes_video_track: bool = data["includes_video_track"]
+        self.includes_audio_track: bool = data["includes_audio_track"]
+        self.is_dash: bool = data["is_dash"]
+        self._filesize: int = data["filesize"]
+
+    @staticmethod
+    def from_stream(stream: Stream) -> dict:
+        return {
+            "itag": stream.itag,
+            "url": stream.url,
+            "mime_type": stream.mime_type,
+            "subtype": stream.subtype,
+            "resolution": stream.resolution,
+            "abr": stream.abr,
+            "video_codec": stream.video_codec,
+            "audio_codec": stream.audio_codec,
+            "includes_video_track": stream.includes_video_track,
+            "includes_audio_track": stream.includes_audio_track,
+            "is_dash": stream.is_dash,
+            # Known from the stream manifest for most streams (0 means it needs a request)
+            "filesize": getattr(stream, "_filesize", 0) or 0,
+        }
+
+    @property
+    def filesize(self) -> int:
+        if self._filesize == 0:
+            key = (self.video_id, self.itag)
+            if key not in filesizes:
+                from pytubefix import request
+                filesizes[key] = request.filesize(self.url)
+            self._filesize = filesizes[key]
+        return self._filesize
+
+    @property
+    def filesize_mb(self) -> float:
+        return round(self.filesize / 1024 / 1024, 3)
+
+    # Replace the URL with a fresh one (e.g. after the server rejected it as expired)
+    def refresh_url(self) -> str:
+        for stream in refresh_video_info(self.video_id).streams:
+            if stream.itag == self.itag:
+                self.url = stream.url
+                return self.url
+        raise IOError(f"Stream {self.itag} of video {self.video_id} is no longer available")
+
+    def __repr__(self) -> str:
+        return f"<CachedStream itag={self.itag} mime_type={self.mime_type}>"
+
+# ------------------------------------------------------------------------------
+# Resolve the sizes of multiple streams at the same time (instead of one request after another)
+def prefetch_filesizes(streams: list[CachedStream], max_workers: int = 16):
+    missing = [stream for stream in streams if stream._filesize == 0 and (stream.video_id, stream.itag) not in filesizes]
+    if not missing:
+        return
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(missing))) as executor:
+        list(executor.map(lambda stream: stream.filesize, missing))
+
+# ------------------------------------------------------------------------------
+# The title and streams of a video
+class VideoInfo:
+    def __init__(self, data: dict):
+        self.video_id: str = data["video_id"]
+        self.title: str = data["title"]
+        self.streams: list[CachedStream] = [CachedStream(stream, self.video_id) for stream in data["streams"]]
+
+# ------------------------------------------------------------------------------
+# Get the time a signed stream URL expires at (from its `expire` parameter)
+def get_url_expiry(url: str) -> float | None:
+    expire = parse_qs(urlparse(url).query).get("expire")
+    return float(expire[0]) if expire else None
+
+# ------------------------------------------------------------------------------
+# Get the title and streams of a video (the YouTube object is only used on a cache miss)
+def get_video_info(yt: YouTube) -> VideoInfo:
+    key = f"video:{yt.video_id}"
+    data = get_cache().get(key)
+    if data is None:
+        data = {
+            "video_id": yt.video_id,
+            "title": yt.title,
+            "streams": [CachedStream.from_stream(stream) for stream in yt.streams],
+        }
+        # Keep the entry until the first of its stream URLs expires
+        expiries = [e for e in (get_url_expiry(s["url"]) for s in data["streams"]) if e is not None]
+        ttl = (min(expiries) - time.time() - url_expiry_margin) if expiries else 0
+        get_cache().set(key, data, ttl)
+    return VideoInfo(data)
+
+# ------------------------------------------------------------------------------
+# Drop the cached streams of a video (e.g. when its stream URLs were rejected)
+def invalidate_video_info(video_id: str):
+    get_cache().invalidate(f"video:{video_id}")
+
+# ------------------------------------------------------------------------------
+# Get the title and streams of a video from YouTube again, with fresh stream URLs
+def refresh_video_info(video_id: str) -> VideoInfo:
+    from pytubefix import YouTube
+    invalidate_video_info(video_id)
+    return get_video_info(YouTube(f"https://youtube.com/watch?v={video_id}", use_oauth=True, allow_oauth_cache=True))
+
+# ------------------------------------------------------------------------------
+# Get the title, estimated length and video URLs of a playlist
+# The URLs are a generator: on a cache miss they are yielded as each page of the playlist arrives,
+# so the first videos can be downloaded while the rest of the playlist is still being listed
+# The full list is cached once the generator is exhausted
+# The length is the count shown on the playlist page (None if it's missing), private and
+# deleted videos are not listed, so the actual number of URLs can be lower
+def get_playlist_info(playlist: Playlist) -> tuple[str, int | None, Iterator[str]]:
+    key = f"playlist:{playlist.playlist_id}"
+    data = get_cache().get(key)
+    if data is not None:
+        return (data["title"], len(data["video_urls"]), iter(data["video_urls"]))
+    try:
+        length = playlist.length
+    except (KeyError, IndexError, ValueError):
+        length = None
+
+    def iter_video_urls():
+        video_urls = []
+        for video_url in playlist.url_generator():
+            video_urls.append(video_url)
+            yield video_url
+        get_cache().set(key, {"title": playlist.title, "video_urls": video_urls}, playlist_ttl)
+
+    return (playlist.title, length, iter_video_urls())
+
+# ------------------------------------------------------------------------------
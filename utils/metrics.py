@@ -0,0 +1,309 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+
+# ------------------------------------------------------------------------------
+# Per-item performance metrics (nothing is written unless an export is configured)
+# - Each item (a video) records the time it spends in each phase: "metadata", "stream_selection"
+#   (which includes the user's time at the prompts in interactive mode), "filesizes", "exists_check",
+#   "download", "merge" and "mux" (download and merge at the same time)
+# - Each stream records its time to first byte, bytes, retries and throughput, and the average
+#   time to first byte of its range requests
+# - When an item is finished, it's appended to metrics.jsonl and the totals are rewritten to
+#   yt_dl.prom (a Prometheus textfile, e.g. for node_exporter's textfile collector)
+# - The optional trace is in Chrome's trace event format (chrome://tracing or ui.perfetto.dev): its events
+#   are appended as the items finish and the closing bracket is left out, which the format allows,
+#   so an interrupted run still has a valid trace
+jsonl_file_name = "metrics.jsonl"
+prom_file_name = "yt_dl.prom"
+
+# ------------------------------------------------------------------------------
+class StreamMetrics:
+    def __init__(self, kind: str, itag: int, size: int):
+        self.kind = kind
+        self.itag = itag
+        self.size = size
+        self.started_at = time.perf_counter()
+        self.finished_at: float | None = None
+        self.ttfb: float | None = None
+        self.bytes = 0
+        self.requests = 0
+        self.request_ttfb = 0.0
+        self.retries = 0
+        # The connections of a stream report from their own threads
+        self.lock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    # Called when the first chunk of a range request arrives (`ttfb` is the time since the request was sent)
+    def on_first_byte(self, ttfb: float):
+        with self.lock:
+            if self.ttfb is None:
+                self.ttfb = time.perf_counter() - self.started_at
+            self.requests += 1
+            self.request_ttfb += ttfb
+
+    def on_bytes(self, n_bytes: int):
+        with self.lock:
+            self.bytes += n_bytes
+
+    def on_retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def finish(self):
+        if self.finished_at is None:
+            self.finished_at = time.perf_counter()
+
+    # --------------------------------------------------------------------------
+    def get_duration(self) -> float:
+        return (self.finished_at or time.perf_counter()) - self.started_at
+
+    def to_dict(self) -> dict:
+        duration = self.get_duration()
+        return {
+            "kind": self.kind,
+            "itag": self.itag,
+            "size": self.size,
+            "bytes": self.bytes,
+            "duration": round(duration, 3),
+            "throughput": round(self.bytes / duration) if duration > 0 else None,
+            "ttfb": round(self.ttfb, 4) if self.ttfb is not None else None,
+            "request_ttfb": round(self.request_ttfb / self.requests, 4) if self.requests else None,
+            "requests": self.requests,
+            "retries": self.retries,
+        }
+
+# ------------------------------------------------------------------------------
+# The metrics of an item (finish it once its final status is known, e.g. after a background merge)
+class ItemMetrics:
+    def __init__(self, recorder: "MetricsRecorder", name: str, job: str | None):
+        self.recorder = recorder
+        self.name = name
+        self.job = job
+        self.started_at = time.time()
+        self.started_at_perf = time.perf_counter()
+        self.finished_at_perf: float | None = None
+        # (phase, start, end, thread id, thread name)
+        self.spans: list[tuple[str, float, float, int, str]] = []
+        self.streams: list[StreamMetrics] = []
+        self.merge_duration: float | None = None
+        self.status: str | None = None
+        self.lock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    # Record the time spent in a phase (a phase can be entered several times, e.g. for each existence check)
+    @contextmanager
+    def phase(self, name: str):
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            thread = threading.current_thread()
+            with self.lock:
+                self.spans.append((name, started_at, time.perf_counter(), thread.ident, thread.name))
+
+    # Start the metrics of one of the item's streams ("video" or "audio")
+    def stream(self, kind: str, itag: int, size: int) -> StreamMetrics:
+        stream_metrics = StreamMetrics(kind, itag, size)
+        with self.lock:
+            self.streams.append(stream_metrics)
+        return stream_metrics
+
+    # --------------------------------------------------------------------------
+    # Record the final status ("Downloaded", "Skipped" or "Failed") and export the item (only the first call counts)
+    def finish(self, status: str):
+        with self.lock:
+            if self.status is not None:
+                return
+            self.status = status
+            self.finished_at_perf = time.perf_counter()
+        self.recorder.export(self)
+
+    # Total time of each phase
+    def get_phases(self) -> dict[str, float]:
+        phases: dict[str, float] = {}
+        for (name, started_at, finished_at, _, _) in self.spans:
+            phases[name] = phases.get(name, 0) + finished_at - started_at
+        return {name: round(duration, 3) for (name, duration) in phases.items()}
+
+    def to_dict(self) -> dict:
+        streams = [stream.to_dict() for stream in self.streams]
+        return {
+            "item": self.name,
+            "job": self.job,
+            "status": self.status,
+            "started_at": round(self.started_at, 3),
+            "duration": round(self.finished_at_perf - self.started_at_perf, 3),
+            "phases": self.get_phases(),
+            "streams": streams,
+            "bytes": sum(stream["bytes"] for stream in streams),
+            "retries": sum(stream["retries"] for stream in streams),
+            "merge_duration": round(self.merge_duration, 3) if self.merge_duration is not None else None,
+        }
+
+# ------------------------------------------------------------------------------
+# Record a phase of an item that might not have metrics (e.g. a function called without them)
+def measure(metrics: ItemMetrics | None, name: str):
+    return metrics.phase(name) if metrics is not None else nullcontext()
+
+# ------------------------------------------------------------------------------
+class MetricsRecorder:
+    def __init__(self):
+        self.metrics_dir: str | None = None
+        self.trace_path: str | None = None
+        self.lock = threading.Lock()
+        # Trace timestamps are relative to the start of the process
+        self.started_at_perf = time.perf_counter()
+        self.trace_threads: dict[int, int] = {}
+        self.trace_ids = 0
+        # Totals of the exported items (for the Prometheus textfile)
+        self.items: dict[str, int] = {}
+        # phase -> {"seconds": ..., "count": ...}
+        self.phases: dict[str, dict[str, float]] = {}
+        # stream kind -> totals of its streams
+        self.streams: dict[str, dict[str, float]] = {}
+        self.merges = {"seconds": 0.0, "count": 0}
+
+    # --------------------------------------------------------------------------
+    # Set where the metrics are written (None for no export), e.g. from the command line
+    def configure(self, metrics_dir: str | None = None, trace_path: str | None = None):
+        with self.lock:
+            self.metrics_dir = metrics_dir
+            self.trace_path = trace_path
+            if metrics_dir is not None:
+                os.makedirs(metrics_dir, exist_ok=True)
+            if trace_path is not None:
+                os.makedirs(os.path.dirname(os.path.abspath(trace_path)), exist_ok=True)
+                with open(trace_path, "w", encoding="utf-8") as file:
+                    file.write("[\n")
+                self.trace_threads = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.metrics_dir is not None or self.trace_path is not None
+
+    # --------------------------------------------------------------------------
+    # Start the metrics of an item (`job` is the playlist, channel or job it belongs to)
+    def start_item(self, name: str, job: str | None = None) -> ItemMetrics:
+        return ItemMetrics(self, name, job)
+
+    # --------------------------------------------------------------------------
+    # Write a finished item to the exports
+    def export(self, item: ItemMetrics):
+        if not self.enabled:
+            return
+        record = item.to_dict()
+        with self.lock:
+            if self.metrics_dir is not None:
+                with open(os.path.join(self.metrics_dir, jsonl_file_name), "a", encoding="utf-8") as file:
+                    file.write(json.dumps(record) + "\n")
+                self.add_totals(item, record)
+                self.write_prom()
+            if self.trace_path is not None:
+                self.write_trace_events(item)
+
+    # --------------------------------------------------------------------------
+    def add_totals(self, item: ItemMetrics, record: dict):
+        self.items[item.status] = self.items.get(item.status, 0) + 1
+        for (name, started_at, finished_at, _, _) in item.spans:
+            totals = self.phases.setdefault(name, {"seconds": 0.0, "count": 0})
+            totals["seconds"] += finished_at - started_at
+            totals["count"] += 1
+        for stream in record["streams"]:
+            totals = self.streams.setdefault(stream["kind"], dict.fromkeys(
+                ["bytes", "retries", "seconds", "count", "ttfb_seconds", "ttfb_count", "request_ttfb_seconds", "requests"], 0
+            ))
+            totals["bytes"] += stream["bytes"]
+            totals["retries"] += stream["retries"]
+            totals["seconds"] += stream["duration"]
+            totals["count"] += 1
+            if stream["ttfb"] is not None:
+                totals["ttfb_seconds"] += stream["ttfb"]
+                totals["ttfb_count"] += 1
+            if stream["request_ttfb"] is not None:
+                totals["request_ttfb_seconds"] += stream["request_ttfb"] * stream["requests"]
+                totals["requests"] += stream["requests"]
+        if item.merge_duration is not None:
+            self.merges["seconds"] += item.merge_duration
+            self.merges["count"] += 1
+
+    # --------------------------------------------------------------------------
+    # Rewrite the Prometheus textfile (written to a temp file first, so a scrape never reads half of it)
+    def write_prom(self):
+        lines = []
+        def header(name: str, type: str, help: str):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+        def sample(name: str, labels: str, value: float):
+            lines.append(f"{name}{labels} {value if isinstance(value, int) else round(value, 6)}")
+
+        header("yt_dl_items_total", "counter", "Finished items by status.")
+        for (status, count) in sorted(self.items.items()):
+            sample("yt_dl_items_total", f'{{status="{status}"}}', count)
+        header("yt_dl_phase_seconds", "summary", "Time spent in each phase of the items.")
+        for (name, totals) in sorted(self.phases.items()):
+            sample("yt_dl_phase_seconds_sum", f'{{phase="{name}"}}', totals["seconds"])
+            sample("yt_dl_phase_seconds_count", f'{{phase="{name}"}}', totals["count"])
+        # Stream totals by kind ("video" or "audio")
+        for (name, type, help, keys) in (
+            ("yt_dl_stream_bytes_total", "counter", "Bytes downloaded.", ["bytes"]),
+            ("yt_dl_stream_retries_total", "counter", "Retried range requests.", ["retries"]),
+            ("yt_dl_stream_seconds", "summary", "Download time of the streams.", ["seconds", "count"]),
+            ("yt_dl_stream_ttfb_seconds", "summary", "Time from the start of a stream to its first byte.", ["ttfb_seconds", "ttfb_count"]),
+            ("yt_dl_request_ttfb_seconds", "summary", "Time from a range request to its first byte.", ["request_ttfb_seconds", "requests"]),
+        ):
+            header(name, type, help)
+            for (kind, totals) in sorted(self.streams.items()):
+                if type == "counter":
+                    sample(name, f'{{kind="{kind}"}}', totals[keys[0]])
+                else:
+                    sample(f"{name}_sum", f'{{kind="{kind}"}}', totals[keys[0]])
+                    sample(f"{name}_count", f'{{kind="{kind}"}}', totals[keys[1]])
+        header("yt_dl_merge_seconds", "summary", "Duration of the ffmpeg merges.")
+        sample("yt_dl_merge_seconds_sum", "", self.merges["seconds"])
+        sample("yt_dl_merge_seconds_count", "", self.merges["count"])
+        header("yt_dl_last_item_timestamp_seconds", "gauge", "Time the last item finished.")
+        sample("yt_dl_last_item_timestamp_seconds", "", time.time())
+
+        path = os.path.join(self.metrics_dir, prom_file_name)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+    # --------------------------------------------------------------------------
+    # Append the events of an item to the trace: its phases on the threads that ran them,
+    # and the item and its streams as async spans (they overlap other work on the same threads)
+    def write_trace_events(self, item: ItemMetrics):
+        pid = os.getpid()
+        def ts(perf_time: float) -> float:
+            return round((perf_time - self.started_at_perf) * 1e6, 1)
+
+        events = []
+        for (name, started_at, finished_at, thread_ident, thread_name) in item.spans:
+            if thread_ident not in self.trace_threads:
+                self.trace_threads[thread_ident] = len(self.trace_threads) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": self.trace_threads[thread_ident], "args": {"name": thread_name}})
+            events.append({
+                "name": name, "cat": "phase", "ph": "X", "pid": pid, "tid": self.trace_threads[thread_ident],
+                "ts": ts(started_at), "dur": round((finished_at - started_at) * 1e6, 1), "args": {"item": item.name},
+            })
+        self.trace_ids += 1
+        item_id = self.trace_ids
+        events.append({"name": item.name, "cat": "item", "ph": "b", "id": item_id, "pid": pid, "tid": 0, "ts": ts(item.started_at_perf), "args": {"job": item.job}})
+        for stream in item.streams:
+            events.append({"name": f"{stream.kind} {stream.itag}", "cat": "item", "ph": "b", "id": item_id, "pid": pid, "tid": 0, "ts": ts(stream.started_at)})
+            events.append({"name": f"{stream.kind} {stream.itag}", "cat": "item", "ph": "e", "id": item_id, "pid": pid, "tid": 0,
+                           "ts": ts(stream.finished_at or item.finished_at_perf), "args": stream.to_dict()})
+        events.append({"name": item.name, "cat": "item", "ph": "e", "id": item_id, "pid": pid, "tid": 0, "ts": ts(item.finished_at_perf), "args": {"status": item.status}})
+
+        with open(self.trace_path, "a", encoding="utf-8") as file:
+            for event in events:
+                file.write(json.dumps(event) + ",\n")
+
+# ------------------------------------------------------------------------------
+# Shared by all the downloads in the process (the exports are set from the command line)
+recorder = MetricsRecorder()
+
+# ------------------------------------------------------------------------------
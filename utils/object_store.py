@@ -0,0 +1,90 @@
+import os
+import shutil
+
+from .file import get_main_script_location
+from .staging import get_partial_path, publish, discard
+
+# ------------------------------------------------------------------------------
+# Shared store of merged videos, keyed by video id and the itags of the selected streams
+# - A video that is in several playlists is downloaded and merged once, into the store,
+#   and each playlist directory gets a link to the stored file
+# - Links are hardlinks if possible, then reflinks (copy-on-write clones), then plain copies
+# - The default store is videos/.store (on the same filesystem as the default download
+#   directories, so hardlinks work; the dot keeps it out of the manifest's legacy files)
+default_store_dir_name = ".store"
+
+# Linux ioctl that clones a file's extents (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# ------------------------------------------------------------------------------
+# Open the store given by a job or the command line: None/False for no store, True for the default store,
+# or the directory of the store
+def open_store(store: bool | str | None) -> "ObjectStore | None":
+    if not store:
+        return None
+    if store is True:
+        return ObjectStore(os.path.join(get_main_script_location(), "videos", default_store_dir_name))
+    return ObjectStore(store)
+
+# ------------------------------------------------------------------------------
+class ObjectStore:
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+
+    # --------------------------------------------------------------------------
+    # The key of a merged video, which is also its file name in the store
+    @staticmethod
+    def get_key(video_id: str, video_itag: int, audio_itag: int, subtype: str) -> str:
+        return f"{video_id}-{video_itag}-{audio_itag}.{subtype}"
+
+    def get_path(self, key: str) -> str:
+        return os.path.join(self.store_dir, key)
+
+    # The file a video is merged into before it's added to the store (in the scratch directory if there is one)
+    # Unique to each writer, two jobs can merge the same video at the same time
+    def get_partial_path(self, key: str) -> str:
+        return get_partial_path(self.get_path(key))
+
+    def has(self, key: str) -> bool:
+        return os.path.exists(self.get_path(key))
+
+    # --------------------------------------------------------------------------
+    # Add a merged video to the store (an interrupted merge never leaves a half-written object)
+    # If another writer published the same key in the meantime, its object is kept (the content is the same)
+    def add(self, key: str, partial_path: str):
+        if self.has(key):
+            discard(partial_path)
+            return
+        publish(partial_path, self.get_path(key))
+
+    # --------------------------------------------------------------------------
+    # Link a stored video into a download directory
+    # Returns how it was linked: "hardlink", "reflink" or "copy"
+    def link(self, key: str, file_path: str) -> str:
+        source = self.get_path(key)
+        os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        try:
+            os.link(source, file_path)
+            return "hardlink"
+        except OSError:
+            # Another filesystem, or one without hardlinks
+            pass
+        try:
+            reflink(source, file_path)
+            return "reflink"
+        except (OSError, ImportError):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        shutil.copyfile(source, file_path)
+        return "copy"
+
+# ------------------------------------------------------------------------------
+# Clone a file without copying its data (only on Linux filesystems that support it)
+def reflink(source: str, file_path: str):
+    import fcntl
+    with open(source, "rb") as source_file, open(file_path, "wb") as file:
+        fcntl.ioctl(file.fileno(), FICLONE, source_file.fileno())
+
+# ------------------------------------------------------------------------------
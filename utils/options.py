@@ -0,0 +1,38 @@
+# ------------------------------------------------------------------------------
+# Choices shared by the prompts (ask.py) and the command line / job files (batch.py)
+# Kept in their own module so the non-interactive modes don't need to import inquirer
+
+# ------------------------------------------------------------------------------
+# Video resolutions, highest first
+resolutions = [
+    '4320p', # 8K
+    '2160p', # 4K
+    '1440p', # 2K
+    '1080p', # Full HD
+    '720p',
+    '480p',
+    '360p',
+    '240p',
+    '144p',
+]
+
+# ------------------------------------------------------------------------------
+# Audio bitrates, highest first
+bitrates = [
+    '160kbps', 
+    '128kbps', 
+    '70kbps', 
+    '50kbps', 
+    '48kbps'
+]
+
+# ------------------------------------------------------------------------------
+# Number of playlist videos downloaded at the same time
+workers = [
+    '1',
+    '2',
+    '4',
+    '8',
+]
+
+# ------------------------------------------------------------------------------
@@ -1,144 +1,551 @@
+from __future__ import annotations
 import os
-import glob
-from uuid import uuid4 as UUID
-from pytubefix import Playlist, YouTube, Stream
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Iterator
 
-from .ask import choose_format, get_dirname, resolutions, get_min_resolution, bitrates, get_min_bitrate
-from .file import get_main_script_location, get_project_root, slugify
+from .options import resolutions, bitrates
+from .file import get_main_script_location, slugify
 from .console import print_separator, print_error, print_success, print_info
-from .video_dl import download, merge_audio_video
+from .ffmpeg import print_merged
+from .video_dl import download_audio_video, get_temp_file_names, merge_audio_video, mux_audio_video, get_video_streams, get_audio_streams
+from .stream_mux import can_stream_mux
+from .segmented_dl import remove_partial_files
+from .merge_queue import MergeQueue
+from .manifest import Manifest, get_manifest
+from .metadata_cache import get_playlist_info, get_video_info
+from .sync_state import SyncSource, open_sync_source
+from .object_store import ObjectStore
+from .staging import FileLock, get_work_dir, get_partial_path, publish, discard
+from .bandwidth import BandwidthJob, scheduler
+from .metrics import ItemMetrics, measure, recorder
+from .progress import progress
 
-def download_playlist(url):
+if TYPE_CHECKING:
+    from pytubefix import YouTube
+
+# Download a playlist
+# The options that aren't given are asked from the user, or take their defaults without `ask` (batch and daemon jobs)
+# Returns the status of each video by its URL
+# `on_progress(done, total)` is called at the start and whenever a video is finished (e.g. for the daemon's job status)
+# With `sync`, the videos downloaded by an earlier sync into the same directory are skipped without any request
+# (the whole playlist is still listed, because new videos can be added anywhere in a playlist)
+# With an object store, each video is downloaded once for all the playlists that share the store (see object_store.py)
+def download_playlist(url, workers: int | None = None, resume: bool = True, merge_workers: int | None = None, stream_mux: bool = False,
+                      format: str | None = None, file_dir: str | None = None, min_resolution: str | None = None, min_bitrate: str | None = None,
+                      on_progress=None, sync: bool = False, store: ObjectStore | None = None, priority: str = "bulk", max_rate: int | None = None, ask: bool = True) -> list[tuple[str, str]]:
+    # pytubefix is slow to import, so it's only imported once there is something to download
+    from pytubefix import Playlist
     # --------------------------------------------------------------------------
     # Initialize PyTube object with OAuth
     yt = Playlist(url, use_oauth=True, allow_oauth_cache=True)
+    
+    # Get the playlist's title, estimated length and videos (from the metadata cache if possible)
+    # The video URLs are listed lazily, page by page, while the first videos download
+    (playlist_title, estimated_total, video_urls) = get_playlist_info(yt)
+    # --------------------------------------------------------------------------
+    default_dir = os.path.join(get_main_script_location(), "videos",slugify(playlist_title)) # Use playlist title (slug) as default directory
+    (format, file_dir, min_resolution, min_bitrate, workers) = ask_options(default_dir, format, file_dir, min_resolution, min_bitrate, workers, ask)
+    # --------------------------------------------------------------------------
+    sync_source = open_sync_source(f"playlist:{yt.playlist_id}", file_dir, url, playlist_title) if sync else None
+    try:
+        items = download_items(url, video_urls, estimated_total, file_dir, format, min_resolution, min_bitrate, workers, resume, merge_workers, stream_mux,
+                               on_progress, sync_source, stop_at_known=False, indexed=True, store=store, priority=priority, max_rate=max_rate)
+    finally:
+        if sync_source is not None:
+            sync_source.close()
+    print_result(items, "Playlist")
+    return items
+
+
+# ------------------------------------------------------------------------------
+# Sync the uploads of a channel into a directory
+# Same options as download_playlist, but it always syncs: the uploads are listed newest first and the
+# listing stops at the first video downloaded by an earlier sync, so a re-sync only requests the new pages
+# The files have no index prefix, since the index of an upload changes with each new upload
+def download_channel(url, workers: int | None = None, resume: bool = True, merge_workers: int | None = None, stream_mux: bool = False,
+                     format: str | None = None, file_dir: str | None = None, min_resolution: str | None = None, min_bitrate: str | None = None,
+                     on_progress=None, store: ObjectStore | None = None, priority: str = "bulk", max_rate: int | None = None, ask: bool = True) -> list[tuple[str, str]]:
+    from pytubefix import Channel
+    # --------------------------------------------------------------------------
+    # Initialize PyTube object with OAuth
+    channel = Channel(url, use_oauth=True, allow_oauth_cache=True)
+    channel_title = channel.channel_name
+    # --------------------------------------------------------------------------
+    default_dir = os.path.join(get_main_script_location(), "videos", slugify(channel_title)) # Use channel name (slug) as default directory
+    (format, file_dir, min_resolution, min_bitrate, workers) = ask_options(default_dir, format, file_dir, min_resolution, min_bitrate, workers, ask)
+    # --------------------------------------------------------------------------
+    # The channel's uploads are not cached in the metadata cache, new uploads must show up right away
+    sync_source = open_sync_source(f"channel:{channel.channel_id}", file_dir, url, channel_title)
+    try:
+        items = download_items(url, channel.url_generator(), None, file_dir, format, min_resolution, min_bitrate, workers, resume, merge_workers, stream_mux,
+                               on_progress, sync_source, stop_at_known=True, indexed=False, store=store, priority=priority, max_rate=max_rate)
+    finally:
+        sync_source.close()
+    print_result(items, "Channel")
+    return items
+
+
+# ------------------------------------------------------------------------------
+# Ask the user for the download options that aren't given
+# Without `ask` (no one to ask, e.g. batch and daemon jobs), they take their defaults instead: the default directory,
+# webm, the highest resolution and bitrate and one video at a time
+def ask_options(default_dir: str, format: str | None, file_dir: str | None, min_resolution: str | None, min_bitrate: str | None, workers: int | None,
+                ask: bool = True) -> tuple[str, str, str, str, int]:
+    if not ask:
+        return (format or "webm", file_dir or default_dir, min_resolution or resolutions[0], min_bitrate or bitrates[0], workers or 1)
+    # The prompts are only needed for the options that aren't given
+    from .ask import choose_format, get_dirname, get_min_resolution, get_min_bitrate, get_workers
     # --------------------------------------------------------------------------
     # Let user choose format (used to filter both with video and audio)
-    format = choose_format() # "webm" or "mp4"
-    print_separator()
+    if format is None:
+        format = choose_format() # "webm" or "mp4"
+        print_separator()
     # --------------------------------------------------------------------------
     # Let user choose the directory name
-    default_dir = os.path.join(get_main_script_location(), "videos",slugify(yt.title)) # Use playlist title (slug) as default directory
-    file_dir = get_dirname(default_dir)
-    print_separator()
+    if file_dir is None:
+        file_dir = get_dirname(default_dir)
+        print_separator()
     # --------------------------------------------------------------------------
     # Let user choose preferred video resolutions (e.g. "1080p")
-    min_resolution = get_min_resolution()
-    print_separator()
+    if min_resolution is None:
+        min_resolution = get_min_resolution()
+        print_separator()
     print_info(f"We will only download {format} streams with minimum quality of {min_resolution} for video.")
     print_separator()
     # --------------------------------------------------------------------------
     # Let user choose preferred audio bitrate (e.g. "128kbps")
-    min_bitrate = get_min_bitrate()
-    print_separator()
+    if min_bitrate is None:
+        min_bitrate = get_min_bitrate()
+        print_separator()
     print_info(f"We will only download audio streams with minimum bitrate of {min_bitrate} for audio.")
     print_separator()
     # --------------------------------------------------------------------------
-    # Download each video
-    for idx, video in enumerate(yt.videos):
-        print_info(f"Downloading video {idx + 1}/{len(yt.videos)}: {video.title}")
-        download_video(video, file_dir, format, min_resolution, min_bitrate, idx + 1)
+    # Let user choose how many videos are downloaded at the same time
+    if workers is None:
+        workers = get_workers()
         print_separator()
+    return (format, file_dir, min_resolution, min_bitrate, workers)
+
+
+# ------------------------------------------------------------------------------
+# Download the videos of a playlist or channel (at `url`) as their URLs are listed
+# Returns the status of each listed video by its URL (and a failed item for the list itself if it couldn't be listed)
+# With a sync source, the videos it has downloaded before (whose files are still there) are skipped without any request, and
+# with `stop_at_known` the listing stops at the first of them (for lists that are newest first)
+# The videos that failed in an earlier sync are retried after the listing
+# With `indexed`, the file names are prefixed with the video's position in the list
+# All the videos share one bandwidth job with the given priority and cap (see bandwidth.py)
+def download_items(url: str, video_urls: Iterator[str], estimated_total: int | None, file_dir: str, format: str, min_resolution: str, min_bitrate: str,
+                   workers: int, resume: bool, merge_workers: int | None, stream_mux: bool,
+                   on_progress=None, sync_source: SyncSource | None = None, stop_at_known: bool = False, indexed: bool = True,
+                   store: ObjectStore | None = None, priority: str = "bulk", max_rate: int | None = None) -> list[tuple[str, str]]:
+    from pytubefix import YouTube
+    # --------------------------------------------------------------------------
+    # Download each video (each worker handles one playlist item at a time)
+    # Finished downloads are merged by the merge queue, so the workers can move on to the next video
+    # The queue holds at most one pending merge per download worker, which bounds the temp files on disk
+    # Without `merge_workers`, the number of merge workers depends on the cores (see merge_queue.py)
+    # Videos are submitted as their URLs are listed, at most 2 per worker ahead of the downloads,
+    # and their YouTube objects are only created when a worker picks them up
+    listed_urls: list[str] = []
+    listing_done = False
+    titles: dict[int, str] = {}
+
+    # The total is the count from the playlist page until all URLs are listed
+    def get_total() -> int | None:
+        return len(listed_urls) if listing_done else estimated_total
+
+    def format_total() -> str:
+        total = get_total()
+        return "?" if total is None else str(total) if listing_done else f"~{total}"
+
+    # Count the finished videos (a video is finished after its merge, which might run in the background)
+    # The progress display shows them on the line of the directory
+    done = 0
+    done_lock = threading.Lock()
+    items_task = progress.add(os.path.basename(os.path.normpath(file_dir)), estimated_total, "items")
+    # A repeated listing of a video isn't recorded in the sync state, the status of its first listing is
+    def item_done(video_url: str, status: str, metrics: ItemMetrics, repeated: bool = False):
+        nonlocal done
+        metrics.finish(status)
+        if sync_source is not None and not repeated:
+            sync_source.record(get_video_id(video_url), status)
+        items_task.update()
+        with done_lock:
+            done += 1
+            if on_progress is not None:
+                on_progress(done, get_total())
+    if on_progress is not None:
+        on_progress(0, get_total())
+
+    # Whether a video is complete in the manifest, and its title there (if it has been downloaded before)
+    manifest = get_manifest(file_dir)
+    def get_manifest_title(video_id: str) -> tuple[bool, str | None]:
+        entry = manifest.get(video_id)
+        return (manifest.is_complete(video_id), entry.get("title") if entry is not None else None)
+
+    # A video of an earlier sync is only known if its file is still there (the user might have deleted it)
+    # Both checks are lookups, neither needs a request
+    def is_synced(video_id: str) -> bool:
+        return sync_source is not None and sync_source.is_done(video_id) and manifest.is_complete(video_id)
+
+    def download_item(idx: int, video_url: str, merge_queue: MergeQueue, bandwidth: BandwidthJob) -> str | Future:
+        metrics = recorder.start_item(video_url, url)
+        try:
+            # A video of the manifest is skipped before any metadata is fetched (the id is in its URL),
+            # its title for the summary is the one recorded in the manifest
+            with metrics.phase("exists_check"):
+                (is_complete, title) = get_manifest_title(get_video_id(video_url))
+            if is_complete:
+                titles[idx] = title or video_url
+                print_info(f"Video {idx + 1}/{format_total()} \"{titles[idx]}\" already exists. Skipping...")
+                result = "Skipped"
+            else:
+                with metrics.phase("metadata"):
+                    video = YouTube(video_url, use_oauth=True, allow_oauth_cache=True)
+                    titles[idx] = get_video_info(video).title
+                print_info(f"Downloading video {idx + 1}/{format_total()}: {titles[idx]}")
+                result = download_video(video, file_dir, format, min_resolution, min_bitrate, idx + 1 if indexed else None, resume, merge_queue, stream_mux, store, bandwidth, metrics)
+        except Exception as e:
+            # A failing item must not stop the other workers
+            print_error(f"Error while downloading video {idx + 1}/{format_total()}: {e}")
+            result = "Failed"
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: item_done(video_url, "Failed" if future.exception() else future.result(), metrics))
+        else:
+            item_done(video_url, result, metrics)
+        return result
+
+    # Bounds the videos that are submitted but not downloaded yet
+    slots = threading.BoundedSemaphore(2 * workers)
+    def release_slot(*_):
+        slots.release()
+
+    # List the videos, up to the first known one if the listing can stop there
+    # The videos that failed in an earlier sync are retried after the listed ones
+    def list_videos() -> Iterator[str]:
+        listed_ids = set()
+        for video_url in video_urls:
+            if sync_source is not None:
+                video_id = get_video_id(video_url)
+                if stop_at_known and sync_source.was_complete and is_synced(video_id):
+                    # Not asking for the next page stops the pagination
+                    print_info(f"Reached the videos of the last sync after {len(listed_ids)} new videos")
+                    break
+                listed_ids.add(video_id)
+            yield video_url
+        if sync_source is not None:
+            for video_id in sync_source.failed_ids():
+                if video_id not in listed_ids:
+                    yield f"https://youtube.com/watch?v={video_id}"
+
+    with items_task, scheduler.add(url, priority, max_rate) as bandwidth, MergeQueue(workers=merge_workers, max_pending=workers) as merge_queue:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            items: list[str | Future] = []
+            listing_error = None
+            try:
+                submitted_ids = set()
+                for (idx, video_url) in enumerate(list_videos()):
+                    # A video listed twice is only downloaded once (both would write the same temp files)
+                    video_id = get_video_id(video_url)
+                    if video_id in submitted_ids:
+                        print_info(f"Video {idx + 1} is already in the list. Skipping...")
+                        listed_urls.append(video_url)
+                        items.append("Skipped")
+                        item_done(video_url, "Skipped", recorder.start_item(video_url, url), repeated=True)
+                        continue
+                    submitted_ids.add(video_id)
+                    if is_synced(video_id):
+                        (_, title) = get_manifest_title(video_id)
+                        if title is not None:
+                            titles[idx] = title
+                        listed_urls.append(video_url)
+                        items.append("Skipped")
+                        item_done(video_url, "Skipped", recorder.start_item(video_url, url))
+                        continue
+                    slots.acquire()
+                    listed_urls.append(video_url)
+                    future = executor.submit(download_item, idx, video_url, merge_queue, bandwidth)
+                    future.add_done_callback(release_slot)
+                    items.append(future)
+            except Exception as e:
+                # Download what has been listed so far, the list itself counts as a failed item
+                print_error(f"Error while listing the videos: {e}")
+                listing_error = e
+            listing_done = True
+            items_task.set_total(len(listed_urls))
+            if on_progress is not None:
+                with done_lock:
+                    on_progress(done, get_total())
+            results = [get_status(item.result()) if isinstance(item, Future) else item for item in items]
     # --------------------------------------------------------------------------
-    print_success("Playlist Downloaded")
+    # The next sync can only stop at known videos if this one has seen all of the new ones
+    if sync_source is not None and listing_error is None:
+        sync_source.finish(get_video_id(listed_urls[0]) if listed_urls else None)
+    if listing_error is not None:
+        listed_urls.append(url)
+        results.append("Failed")
     # --------------------------------------------------------------------------
+    # Print a per-item summary
+    print_separator()
+    print_summary(listed_urls, titles, results)
+    # Time spent merging vs waiting for a merge worker (long waits mean the merges are slower than the downloads)
+    (n_merges, merge_wait, merge_time) = merge_queue.get_totals()
+    if n_merges > 0:
+        print_info(f"Merges: {n_merges} on {merge_queue.workers} workers, {merge_time:.1f}s merging, {merge_wait:.1f}s waiting for a worker")
+    return list(zip(listed_urls, results))
 
 
 # ------------------------------------------------------------------------------
-def download_video(yt: YouTube, file_dir: str, format: str, min_resolution: str, min_bitrate: str, playlist_idx: int):
-    # --------------------------------------------------------------------------
-    # Choose video stream
-    all_video_stream: list[Stream] = [
-        stream for stream in yt.streams.filter(is_dash=True).order_by("resolution").desc() if stream.includes_video_track and not stream.includes_audio_track
-    ]
+# Print whether a playlist or channel was downloaded without errors
+def print_result(items: list[tuple[str, str]], kind: str):
+    if any(status == "Failed" for (_, status) in items):
+        print_error(f"{kind} Downloaded with errors")
+    else:
+        print_success(f"{kind} Downloaded")
 
-    # Filter streams that match the selected format
-    all_video_stream = [stream for stream in all_video_stream if format in stream.mime_type]
+# ------------------------------------------------------------------------------
+# Get the video id from a watch URL
+def get_video_id(video_url: str) -> str:
+    from pytubefix import extract
+    return extract.video_id(video_url)
 
-    # Start from the minimum selected resolution, and find the highest quality video stream
+
+# ------------------------------------------------------------------------------
+# Get the final status of an item (waits for its merge if it was queued)
+def get_status(result: str | Future) -> str:
+    if not isinstance(result, Future):
+        return result
+    try:
+        return result.result()
+    except Exception as e:
+        print_error(f"Error during merge: {e}")
+        return "Failed"
+
+# ------------------------------------------------------------------------------
+# Print the result of each playlist item and the totals
+def print_summary(video_urls: list[str], titles: dict[int, str], results: list[str]):
+    for idx, (video_url, result) in enumerate(zip(video_urls, results)):
+        # Failed videos might not have any metadata, so their URL is shown instead
+        title = titles.get(idx, video_url) if result != "Failed" else video_url
+        message = f"{idx + 1}. [{result}] {title}"
+        if result == "Failed":
+            print_error(message)
+        else:
+            print_info(message)
+    print_separator()
+    for status in ("Downloaded", "Skipped", "Failed"):
+        print_info(f"{status}: {results.count(status)}")
+
+
+# ------------------------------------------------------------------------------
+# Returns the status of the item: "Downloaded", "Skipped" or "Failed"
+# Without a playlist index (e.g. a single video in batch mode), the file name has no index prefix
+# If a merge queue is given, the merge runs in the background and a Future of the status is returned instead
+# With an object store, the video is merged into the store (once for all directories) and linked into file_dir
+# The time of each phase is recorded in `metrics` (the caller finishes them once the status is known)
+def download_video(yt: YouTube, file_dir: str, format: str, min_resolution: str, min_bitrate: str, playlist_idx: int | None, resume: bool = True, merge_queue: MergeQueue | None = None, stream_mux: bool = False, store: ObjectStore | None = None,
+                   bandwidth: BandwidthJob | None = None, metrics: ItemMetrics | None = None) -> str | Future:
+    if metrics is None:
+        metrics = recorder.start_item(yt.watch_url)
+    # --------------------------------------------------------------------------
+    # If video exists, skip
+    # The manifest is keyed by video id, so this doesn't need any request or directory scan
+    # Files downloaded before the directory had a manifest are matched by their slug instead,
+    # because their idx and extension might have changed
+    with metrics.phase("exists_check"):
+        manifest = get_manifest(file_dir)
+        is_complete = manifest.is_complete(yt.video_id)
+    if is_complete:
+        print_info(f"Video \"{yt.watch_url}\" already exists. Skipping...")
+        return "Skipped"
     
-    # A list of possible resolutions including and lower than what user selected
-    video_stream = None
-    lower_resolutions: list[str] = resolutions[resolutions.index(min_resolution):]
-    for res in lower_resolutions:
-        for stream in all_video_stream:
-            if stream.resolution == res:
-                video_stream = stream
+    # Get the title and streams of the video (from the metadata cache if possible)
+    with metrics.phase("metadata"):
+        info = get_video_info(yt)
+    with metrics.phase("exists_check"):
+        has_legacy_file = manifest.has_legacy_file(slugify(info.title))
+    if has_legacy_file:
+        print_info(f"Video \"{info.title}\" already exists. Skipping...")
+        return "Skipped"
+    # --------------------------------------------------------------------------
+    # Choose video stream (only streams that match the selected format)
+    with metrics.phase("stream_selection"):
+        all_video_stream = get_video_streams(info.streams, format)
+
+        # Start from the minimum selected resolution, and find the highest quality video stream
+
+        # A list of possible resolutions including and lower than what user selected
+        video_stream = None
+        lower_resolutions: list[str] = resolutions[resolutions.index(min_resolution):]
+        for res in lower_resolutions:
+            for stream in all_video_stream:
+                if stream.resolution == res:
+                    video_stream = stream
+                    break
+            # Break if video stream has been found
+            if video_stream is not None:
                 break
-        # Break if video stream has been found
-        if video_stream is not None:
-            break
     if video_stream is None:
         print_error(f"No video stream available with minimum resolution of {min_resolution} or lower and format of {format}.")
-        return
+        return "Failed"
     # --------------------------------------------------------------------------
-    # Get highest available audio stream
-    all_audio_stream: list[Stream] = [
-        stream for stream in yt.streams.filter(is_dash=True).order_by("abr").desc() if stream.includes_audio_track and not stream.includes_video_track
-    ]
-    
-    # Filter streams that match the selected format
-    all_audio_stream = [stream for stream in all_audio_stream if format in stream.mime_type]
-    
-    # Start from the minimum selected bitrate, and find the highest bitrate audio stream
-    
-    # A list of possible bitrates including and lower than what user selected
-    audio_stream = None
-    lower_bitrates: list[str] = bitrates[bitrates.index(min_bitrate):]
-    for br in lower_bitrates:
-        for stream in all_audio_stream:
-            if stream.abr == br:
-                audio_stream = stream
+    # Get highest available audio stream (only streams that match the selected format)
+    with metrics.phase("stream_selection"):
+        all_audio_stream = get_audio_streams(info.streams, format)
+
+        # Start from the minimum selected bitrate, and find the highest bitrate audio stream
+
+        # A list of possible bitrates including and lower than what user selected
+        audio_stream = None
+        lower_bitrates: list[str] = bitrates[bitrates.index(min_bitrate):]
+        for br in lower_bitrates:
+            for stream in all_audio_stream:
+                if stream.abr == br:
+                    audio_stream = stream
+                    break
+            # Break if audio stream has been found
+            if audio_stream is not None:
                 break
-        # Break if audio stream has been found
-        if audio_stream is not None:
-            break
     if audio_stream is None:
         print_error(f"No audio stream available with minimum bitrate of {min_bitrate} or lower and format of {format}.")
-        return
+        return "Failed"
     # --------------------------------------------------------------------------
     # Select file name that includes index in playlist
-    file_slug = slugify(yt.title) # Used to see if file exists
-    file_name = f"{playlist_idx}-{file_slug}.{video_stream.subtype}"
+    file_name = f"{slugify(info.title)}.{video_stream.subtype}"
+    if playlist_idx is not None:
+        file_name = f"{playlist_idx}-{file_name}"
     # --------------------------------------------------------------------------
     # Define file names
     file_path = os.path.join(file_dir, file_name)
     
     # Select temp file names for video and audio streams
-    random_id = str(UUID())[:8]
-    video_file_name = f"temp_vid_{random_id}"
+    (video_file_name, audio_file_name) = get_temp_file_names(yt, video_stream, audio_stream, resume)
 
-    audio_file_name = f"temp_aud_{random_id}"
-    # --------------------------------------------------------------------------
-    # If file exists, skip
-    # Check to see if file exists by using a wildcard (*) in place of its idx and extension because file order and/or type might have changed
-    found_files = glob.glob(os.path.join(file_dir, f"*{file_slug}*"))
-    if len(found_files) > 0:
-        print_info(f"Video \"{yt.title}\" already exists. Skipping...")
-        return
-    else:
-        print_info(f"Downloading video: {file_name}")
+    # Temp file paths are known upfront so they can be cleaned up even if a download fails
+    # They are in the scratch directory if there is one (see staging.py)
+    work_dir = get_work_dir(file_dir)
+    downloaded_video_path = os.path.join(work_dir, video_file_name)
+    downloaded_audio_path = os.path.join(work_dir, audio_file_name)
     # --------------------------------------------------------------------------
-    # Start download process and merge audio and video
+    # Only one download of these temp files at a time, in any process (see staging.FileLock)
+    # In resume mode, the temp file names only depend on the video id and itags (see get_temp_file_names), so the jobs
+    # that download the same video into the same directory (or a worker that took over the video of a slow worker)
+    # would write to the same files. The later one waits until the earlier one is done (merge included), then skips
+    # the video if it's complete
+    temp_lock = FileLock(downloaded_video_path)
+    if not temp_lock.acquire(blocking=False):
+        with metrics.phase("exists_check"):
+            temp_lock.acquire()
+            manifest.reload()
+            is_complete = manifest.is_complete(yt.video_id)
+        if is_complete:
+            temp_lock.release()
+            print_info(f"Video \"{info.title}\" has been downloaded by another job. Skipping...")
+            return "Skipped"
+    released = False
     try:
         # ----------------------------------------------------------------------
-        # Download video and audio streams
-        downloaded_video_path = download(yt, video_stream, file_dir, video_file_name)
-        downloaded_audio_path = download(yt, audio_stream, file_dir, audio_file_name)
+        # If the store already has this video with the same streams (e.g. from another playlist), link it
+        store_key = store.get_key(yt.video_id, video_stream.itag, audio_stream.itag, video_stream.subtype) if store is not None else None
+        with metrics.phase("exists_check"):
+            in_store = store is not None and store.has(store_key)
+        if in_store:
+            print_info(f"Video \"{info.title}\" is in the store ({store.link(store_key, file_path)}).")
+            complete_video(manifest, yt.video_id, file_path, title=info.title, video_itag=video_stream.itag, audio_itag=audio_stream.itag)
+            return "Downloaded"
+        # The merged file is written to a partial file first, then added to the store (if there is one) or renamed to file_path
+        output_path = store.get_partial_path(store_key) if store is not None else get_partial_path(file_path)
         # ----------------------------------------------------------------------
-        print_info("Download complete. Merging audio and video...")
+        # Record the selected streams in the manifest
+        print_info(f"Downloading video: {file_name}")
+        manifest.update(yt.video_id, title=info.title, file_name=file_name, video_itag=video_stream.itag, audio_itag=audio_stream.itag, state="downloading")
         # ----------------------------------------------------------------------
-        # Merge video and audio using ffmpeg-python
-        merge_audio_video(downloaded_video_path, downloaded_audio_path, file_path)
+        # Mux the streams while they are downloaded (if possible for the selected format)
+        if stream_mux and can_stream_mux(video_stream.subtype, audio_stream.subtype):
+            try:
+                with metrics.phase("mux"):
+                    mux_audio_video(yt, video_stream, audio_stream, output_path, bandwidth, metrics)
+                publish_video(output_path, file_path, store, store_key)
+                print_merged(file_path)
+            except Exception as e:
+                print_error(f"Error during download or merge: {e}")
+                discard(output_path)
+                return "Failed"
+            complete_video(manifest, yt.video_id, file_path)
+            print_success("Video Downloaded")
+            return "Downloaded"
         # ----------------------------------------------------------------------
-    except Exception as e:
-        print_error(f"Error during download or merge: {e}")
-        exit(1)
+        # Download video and audio streams at the same time
+        try:
+            with metrics.phase("download"):
+                (downloaded_video_path, downloaded_audio_path) = download_audio_video(yt, video_stream, audio_stream, work_dir, video_file_name, audio_file_name, resume, bandwidth, metrics)
+        except Exception as e:
+            print_error(f"Error during download: {e}")
+            # Clean up temporary files (in resume mode, they are kept so a rerun can continue them)
+            if not resume:
+                remove_partial_files(downloaded_video_path, downloaded_audio_path)
+            discard(output_path)
+            return "Failed"
+        print_info("Download complete. Merging audio and video...")
+        # ----------------------------------------------------------------------
+        # Merge video and audio (in the background if there is a merge queue, the temp files are unlocked after the merge)
+        if merge_queue is not None:
+            future = merge_queue.submit(merge_video, downloaded_video_path, downloaded_audio_path, output_path, file_path, resume, manifest, yt.video_id, store, store_key, metrics)
+            future.add_done_callback(lambda _: temp_lock.release())
+            released = True
+            return future
+        return merge_video(downloaded_video_path, downloaded_audio_path, output_path, file_path, resume, manifest, yt.video_id, store, store_key, metrics)
     finally:
-        # Clean up temporary files
-        if os.path.exists(downloaded_video_path):
-            os.remove(downloaded_video_path)
-        if os.path.exists(downloaded_audio_path):
-            os.remove(downloaded_audio_path)
+        if not released:
+            temp_lock.release()
+    # --------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# Merge the downloaded streams of a video and clean up its temp files
+# The video is merged into output_path (a partial file), then published to file_path (or with an object store, added to the store and linked to file_path)
+def merge_video(downloaded_video_path: str, downloaded_audio_path: str, output_path: str, file_path: str, resume: bool, manifest: Manifest, video_id: str,
+                store: ObjectStore | None = None, store_key: str | None = None, metrics: ItemMetrics | None = None) -> str:
+    succeeded = False
+    try:
+        # Merge video and audio using ffmpeg
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with measure(metrics, "merge"):
+            merge_stats = merge_audio_video(downloaded_video_path, downloaded_audio_path, output_path)
+        if metrics is not None:
+            metrics.merge_duration = merge_stats[0]
+        publish_video(output_path, file_path, store, store_key)
+        print_merged(file_path, merge_stats)
+        succeeded = True
+    except Exception as e:
+        print_error(f"Error during merge: {e}")
+        discard(output_path)
+        return "Failed"
+    else:
+        complete_video(manifest, video_id, file_path)
         print_success("Video Downloaded")
+        return "Downloaded"
+    finally:
+        # Clean up temporary files (in resume mode, they are kept after a failure so a rerun only needs to merge again)
+        if succeeded or not resume:
+            remove_partial_files(downloaded_video_path, downloaded_audio_path)
     # --------------------------------------------------------------------------
+
+
+# ------------------------------------------------------------------------------
+# Move a merged video to its file path, or add it to the store (if there is one) and link it to its file path
+def publish_video(output_path: str, file_path: str, store: ObjectStore | None, store_key: str | None):
+    if store is None:
+        publish(output_path, file_path)
+        return
+    store.add(store_key, output_path)
+    store.link(store_key, file_path)
+
+# ------------------------------------------------------------------------------
+# Mark a video as complete in the manifest of its directory
+def complete_video(manifest: Manifest, video_id: str, file_path: str, **fields):
+    manifest.update(video_id, file_name=os.path.basename(file_path), size=os.path.getsize(file_path), state="complete", **fields)
+
+# ------------------------------------------------------------------------------
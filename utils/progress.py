@@ -0,0 +1,198 @@
+import os
+import sys
+import time
+import shutil
+import threading
+
+from . import console
+
+# ------------------------------------------------------------------------------
+# Progress of all the transfers and merges of the process, drawn by a single thread
+# - A transfer only adds its bytes to a counter (no formatting or terminal output on the download threads)
+# - On a terminal, the display is redrawn every `refresh_interval`: a bar for all the transfers together,
+#   then a line for each playlist/channel, transfer and merge (up to `max_item_lines` of them)
+# - Messages printed while the display is shown go above it (see console.print_hook)
+# - When the output isn't a terminal (e.g. batch mode writing to a log file), a progress line is logged
+#   every `log_interval` instead
+# The display disappears once nothing is running
+refresh_interval = 0.2
+log_interval = 10
+max_item_lines = 8
+bar_width = 20
+
+# ------------------------------------------------------------------------------
+# Format a number of bytes: 1536 -> "1.5KB"
+def format_size(n_bytes: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n_bytes) < 1024 or unit == "GB":
+            return f"{n_bytes:.0f}{unit}" if unit == "B" else f"{n_bytes:.1f}{unit}"
+        n_bytes /= 1024
+
+def format_bar(done: float, total: float | None) -> str:
+    if not total:
+        return "[" + " " * bar_width + "]"
+    filled = min(bar_width, int(bar_width * done / total))
+    return "[" + "#" * filled + "-" * (bar_width - filled) + "]"
+
+# ------------------------------------------------------------------------------
+# A transfer ("download"), a merge ("merge") or the videos of a playlist or channel ("items")
+# Downloads count bytes, items count finished videos, merges only show how long they have been running
+class ProgressTask:
+    def __init__(self, hub: "ProgressHub", name: str, total: int | None, kind: str):
+        self.hub = hub
+        self.name = name
+        self.total = total
+        self.kind = kind
+        self.done = 0
+        self.started_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    # --------------------------------------------------------------------------
+    # Called from the transfer threads for each chunk (a negative count rolls back a failed attempt)
+    def update(self, n: int = 1):
+        with self.lock:
+            self.done += n
+
+    def set_total(self, total: int | None):
+        self.total = total
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.hub.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# ------------------------------------------------------------------------------
+class ProgressHub:
+    def __init__(self):
+        self.tasks: list[ProgressTask] = []
+        # Guards the tasks and the display (the messages printed above it included)
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        # Number of lines of the display on the terminal
+        self.shown_lines = 0
+        self.reset()
+
+    # Totals since the display appeared
+    def reset(self):
+        self.closed_done = 0
+        self.closed_total = 0
+        self.rate = 0.0
+        self.measured_at = time.monotonic()
+        self.measured_bytes = 0
+        self.logged_at = time.monotonic()
+
+    # --------------------------------------------------------------------------
+    # Start showing a task (close it, or use it as a context manager, when it's done)
+    def add(self, name: str, total: int | None = None, kind: str = "download") -> ProgressTask:
+        task = ProgressTask(self, name, total, kind)
+        with self.lock:
+            self.tasks.append(task)
+            if self.thread is None:
+                self.reset()
+                self.thread = threading.Thread(target=self._run, name="progress", daemon=True)
+                self.thread.start()
+        return task
+
+    def remove(self, task: ProgressTask):
+        with self.lock:
+            if task not in self.tasks:
+                return
+            self.tasks.remove(task)
+            # A finished transfer still counts in the aggregate bar
+            if task.kind == "download":
+                self.closed_done += task.done
+                self.closed_total += task.total or task.done
+
+    # --------------------------------------------------------------------------
+    # Draw the display until there is nothing left to show
+    def _run(self):
+        stream = console.log_file or sys.stdout
+        live = stream.isatty()
+        if live:
+            if os.name == "nt":
+                # Turns on the ANSI escape sequences of the Windows console
+                os.system("")
+            console.print_hook = self.print_above
+        while True:
+            time.sleep(refresh_interval)
+            with self.lock:
+                if not self.tasks:
+                    if live:
+                        self._erase(stream)
+                        console.print_hook = None
+                    self.thread = None
+                    return
+                if live:
+                    self._draw(stream)
+                elif time.monotonic() - self.logged_at >= log_interval:
+                    self.logged_at = time.monotonic()
+                    print(f"Progress: {self._get_lines()[0]}", file=stream, flush=True)
+
+    # --------------------------------------------------------------------------
+    # Print a message above the display (called by the console's print functions while it's shown)
+    def print_above(self, message: str):
+        stream = console.log_file or sys.stdout
+        with self.lock:
+            self._erase(stream)
+            print(message, file=stream)
+            self._draw(stream)
+
+    def _erase(self, stream):
+        if self.shown_lines > 0:
+            # Back to the first line of the display and clear everything below
+            stream.write(f"\x1b[{self.shown_lines}F\x1b[J")
+            stream.flush()
+            self.shown_lines = 0
+
+    def _draw(self, stream):
+        width = shutil.get_terminal_size().columns
+        # Lines longer than the terminal would wrap, and the display couldn't be erased anymore
+        lines = [line[:width - 1] for line in self._get_lines()]
+        self._erase(stream)
+        stream.write("".join(f"{line}\n" for line in lines))
+        stream.flush()
+        self.shown_lines = len(lines)
+
+    # --------------------------------------------------------------------------
+    # The aggregate line followed by a line per task (called with the lock held)
+    def _get_lines(self) -> list[str]:
+        now = time.monotonic()
+        downloads = [task for task in self.tasks if task.kind == "download"]
+        done = self.closed_done + sum(task.done for task in downloads)
+        total = self.closed_total + sum(task.total or task.done for task in downloads)
+        # Exponential moving average of the rate, so the aggregate speed doesn't jump on every redraw
+        elapsed = now - self.measured_at
+        if elapsed >= 0.5:
+            self.rate = 0.5 * self.rate + 0.5 * max(0, done - self.measured_bytes) / elapsed
+            self.measured_at = now
+            self.measured_bytes = done
+        n_merges = len(self.tasks) - len(downloads) - sum(1 for task in self.tasks if task.kind == "items")
+        percent = f"{100 * done / total:3.0f}%" if total else "  ?%"
+        lines = [
+            f"Total {format_bar(done, total)} {percent} {format_size(done)}/{format_size(total)} "
+            f"{format_size(self.rate)}/s, {len(downloads)} downloading, {n_merges} merging"
+        ]
+        # Playlists and channels first, then the oldest tasks
+        tasks = sorted(self.tasks, key=lambda task: task.kind != "items")
+        for task in tasks[:max_item_lines]:
+            if task.kind == "items":
+                lines.append(f"  {task.name} {format_bar(task.done, task.total)} {task.done}/{task.total if task.total is not None else '?'} videos")
+            elif task.kind == "merge":
+                lines.append(f"  {task.name} merging {now - task.started_at:.0f}s")
+            else:
+                task_percent = f"{100 * task.done / task.total:3.0f}%" if task.total else "  ?%"
+                lines.append(f"  {task.name} {format_bar(task.done, task.total)} {task_percent} {format_size(task.done)}/{format_size(task.total or 0)}")
+        if len(tasks) > max_item_lines:
+            lines.append(f"  ... and {len(tasks) - max_item_lines} more")
+        return lines
+
+# ------------------------------------------------------------------------------
+# Shared by all the downloads in the process
+progress = ProgressHub()
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,314 @@
+import os
+import json
+import time
+import random
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+
+from .bandwidth import BandwidthJob
+from .transport import get_session
+from .metrics import StreamMetrics
+from .staging import preallocate, write_buffer_size
+
+# ------------------------------------------------------------------------------
+# Default settings of the segmented downloader
+connections = 8                    # Number of parallel connections per stream
+segment_size = 9 * 1024 * 1024     # 9MB (same range size pytubefix uses, bigger ranges get throttled)
+chunk_size = 256 * 1024            # Size of each read from a connection
+retries = 5                        # Number of retries for each segment
+timeout = 30                       # Seconds to wait for the server before retrying
+backoff_base = 1                   # Seconds before the first retry (doubled for each retry, with jitter)
+backoff_max = 60                   # Longest wait between two retries
+
+headers = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+# Statuses YouTube uses when it throttles a client
+throttle_statuses = (429, 503)
+
+# ------------------------------------------------------------------------------
+# The server's response can't be used for the segment (retried like a network error)
+# Other OSErrors come from the local file (e.g. a full disk) and are not retried
+class SegmentError(IOError):
+    pass
+
+# The server rejected the stream URL (signed URLs expire after a few hours)
+class UrlExpiredError(SegmentError):
+    pass
+
+# The server is throttling the requests
+class ThrottledError(SegmentError):
+    def __init__(self, message: str, retry_after: float | None = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+# ------------------------------------------------------------------------------
+# Limits the number of active connections of all downloads in the process (AIMD, like TCP congestion control)
+# - Additive increase: each finished segment adds 1/limit, so the limit grows by 1 per limit segments
+# - Multiplicative decrease: a throttled request halves the limit (at most once per `cooldown`, since
+#   the requests that were already running when the throttling started fail together)
+class ConnectionController:
+    def __init__(self, max_limit: int = 32, min_limit: int = 1, cooldown: float = 2):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.cooldown = cooldown
+        self.limit = float(max_limit)
+        self.active = 0
+        self.decreased_at = 0.0
+        self.condition = threading.Condition()
+
+    # --------------------------------------------------------------------------
+    # Wait for a free connection
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    # --------------------------------------------------------------------------
+    def on_success(self):
+        with self.condition:
+            previous = int(self.limit)
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if int(self.limit) > previous:
+                self.condition.notify()
+
+    def on_throttled(self):
+        with self.condition:
+            now = time.monotonic()
+            if now - self.decreased_at < self.cooldown:
+                return
+            self.decreased_at = now
+            self.limit = max(self.min_limit, self.limit / 2)
+
+# Shared by all the downloads in the process (they all count against the same rate limit)
+controller = ConnectionController()
+
+# ------------------------------------------------------------------------------
+# A stream URL that can be replaced by a fresh one when it expires during a download
+# The refresh function is called once per expired URL, even if several connections notice it
+class StreamUrl:
+    def __init__(self, url: str, refresh=None):
+        self.url = url
+        self.refresh_fn = refresh
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self) -> tuple[str, int]:
+        with self.lock:
+            return (self.url, self.generation)
+
+    # Returns False if the URL can't be refreshed
+    def refresh(self, generation: int) -> bool:
+        if self.refresh_fn is None:
+            return False
+        with self.lock:
+            if self.generation == generation:
+                self.url = self.refresh_fn()
+                self.generation += 1
+        return True
+
+# ------------------------------------------------------------------------------
+# Seconds to wait before a retry: exponential backoff with full jitter (the connections that failed
+# together don't retry together), or the server's Retry-After if it gave one
+def get_backoff(attempt: int, retry_after: float | None = None) -> float:
+    if retry_after is not None:
+        return min(retry_after, backoff_max)
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+def get_retry_after(response: requests.Response) -> float | None:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+# ------------------------------------------------------------------------------
+# Split a file into inclusive byte ranges: [(0, 9), (10, 19), ...]
+# The size defaults to the current segment_size (the same one the sidecar files are checked against)
+def split_ranges(file_size: int, size: int | None = None) -> list[tuple[int, int]]:
+    if size is None:
+        size = segment_size
+    return [(start, min(start + size, file_size) - 1) for start in range(0, file_size, size)]
+
+# ------------------------------------------------------------------------------
+# Download a single byte range into its place in the (preallocated) file
+def download_segment(session: requests.Session, url: str | StreamUrl, start: int, end: int, file_path: str, on_progress, bandwidth: BandwidthJob | None = None,
+                     stream_metrics: StreamMetrics | None = None):
+    def write(chunks):
+        # Each segment uses its own file handle, so the segments can write at the same time
+        with open(file_path, "r+b", buffering=write_buffer_size) as file:
+            file.seek(start)
+            for chunk in chunks:
+                file.write(chunk)
+                yield len(chunk)
+    fetch_segment(session, url, start, end, write, on_progress, bandwidth, stream_metrics)
+
+# ------------------------------------------------------------------------------
+# Download a single byte range into memory
+def read_segment(session: requests.Session, url: str | StreamUrl, start: int, end: int, on_progress, bandwidth: BandwidthJob | None = None,
+                 stream_metrics: StreamMetrics | None = None) -> bytes:
+    data = bytearray()
+    def write(chunks):
+        data.clear()
+        for chunk in chunks:
+            data.extend(chunk)
+            yield len(chunk)
+    fetch_segment(session, url, start, end, write, on_progress, bandwidth, stream_metrics)
+    return bytes(data)
+
+# ------------------------------------------------------------------------------
+# Fetch a byte range (with retries) and pass its chunks to `write`, which yields the size of each written chunk
+# - Network errors and unusable responses are retried, errors of `write` (the local file) are raised right away
+# - Throttled requests lower the number of connections (see ConnectionController) and wait before retrying
+# - An expired URL is refreshed (if the StreamUrl can be) and the segment is retried right away
+# - Each chunk is taken from the job's bandwidth share (see bandwidth.py) before the next one is read
+# - The time to first byte, bytes and retries are recorded in the stream's metrics (see metrics.py)
+def fetch_segment(session: requests.Session, url: str | StreamUrl, start: int, end: int, write, on_progress, bandwidth: BandwidthJob | None = None,
+                  stream_metrics: StreamMetrics | None = None):
+    if isinstance(url, str):
+        url = StreamUrl(url)
+    for attempt in range(retries + 1):
+        written = 0
+        (current_url, generation) = url.get()
+        controller.acquire()
+        try:
+            range_headers = {**headers, "Range": f"bytes={start}-{end}"}
+            requested_at = time.perf_counter()
+            with session.get(current_url, headers=range_headers, stream=True, timeout=timeout) as response:
+                if response.status_code == 403:
+                    raise UrlExpiredError("Stream URL was rejected (status 403)")
+                if response.status_code in throttle_statuses:
+                    raise ThrottledError(f"Throttled (status {response.status_code})", get_retry_after(response))
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise SegmentError(f"Server does not support range requests (status {response.status_code})")
+                for n_bytes in write(response.iter_content(chunk_size)):
+                    if stream_metrics is not None:
+                        if written == 0:
+                            stream_metrics.on_first_byte(time.perf_counter() - requested_at)
+                        stream_metrics.on_bytes(n_bytes)
+                    written += n_bytes
+                    on_progress(n_bytes)
+                    if bandwidth is not None:
+                        bandwidth.consume(n_bytes)
+            if written != end - start + 1:
+                raise SegmentError(f"Incomplete segment {start}-{end}: got {written} bytes")
+            controller.on_success()
+            return
+        except (requests.RequestException, SegmentError) as e:
+            error = e
+        finally:
+            # The connection is free while this segment waits to retry
+            controller.release()
+        # Roll back the progress of the failed attempt
+        on_progress(-written)
+        if attempt == retries:
+            raise IOError(f"Segment {start}-{end} failed after {retries + 1} attempts: {error}") from error
+        if stream_metrics is not None:
+            stream_metrics.on_retry()
+        if isinstance(error, UrlExpiredError):
+            if not url.refresh(generation):
+                raise error
+            continue
+        if isinstance(error, ThrottledError):
+            controller.on_throttled()
+        time.sleep(get_backoff(attempt, getattr(error, "retry_after", None)))
+
+# ------------------------------------------------------------------------------
+# Path of the sidecar file that records the finished byte ranges of a partial file
+def get_state_path(file_path: str) -> str:
+    return f"{file_path}.state.json"
+
+# ------------------------------------------------------------------------------
+# Load the finished byte ranges of a partial file (empty if it can't be resumed)
+def load_done_ranges(file_path: str, file_size: int) -> set[tuple[int, int]]:
+    state_path = get_state_path(file_path)
+    if not (os.path.exists(file_path) and os.path.exists(state_path)):
+        return set()
+    try:
+        with open(state_path, "r") as file:
+            state = json.load(file)
+    except (OSError, ValueError):
+        return set()
+    # The ranges are only valid for the same file size and segment size
+    if state.get("file_size") != file_size or state.get("segment_size") != segment_size:
+        return set()
+    if os.path.getsize(file_path) != file_size:
+        return set()
+    return {tuple(r) for r in state.get("done", [])}
+
+# ------------------------------------------------------------------------------
+# Save the finished byte ranges of a partial file (written atomically, so a crash can't corrupt it)
+def save_done_ranges(file_path: str, file_size: int, done_ranges: set[tuple[int, int]]):
+    state_path = get_state_path(file_path)
+    state = {"file_size": file_size, "segment_size": segment_size, "done": sorted(done_ranges)}
+    with open(f"{state_path}.tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(f"{state_path}.tmp", state_path)
+
+# ------------------------------------------------------------------------------
+# Remove partial files along with their sidecar files
+def remove_partial_files(*file_paths: str):
+    for file_path in file_paths:
+        for path in (file_path, get_state_path(file_path)):
+            if os.path.exists(path):
+                os.remove(path)
+
+# ------------------------------------------------------------------------------
+# Download a file over multiple connections using HTTP range requests
+# In resume mode, the finished ranges are recorded next to the file, and a rerun only fetches the missing ones
+# `refresh_url()` returns a fresh URL for the same stream, it's called if the URL expires during the download
+# `bandwidth` is the share of the bandwidth of the job the file belongs to, `stream_metrics` records the download's performance
+# `on_progress(n_bytes)` is called from the connections' threads, so it must be thread-safe (e.g. ProgressTask.update)
+def segmented_download(url: str, file_size: int, file_path: str, on_progress=None, max_connections: int = connections, resume: bool = False, refresh_url=None,
+                       bandwidth: BandwidthJob | None = None, stream_metrics: StreamMetrics | None = None) -> str:
+    def report(n_bytes):
+        if on_progress is not None:
+            on_progress(n_bytes)
+
+    done_ranges = load_done_ranges(file_path, file_size) if resume else set()
+    if done_ranges:
+        # Continue the partial file and report what is already there
+        report(sum(end - start + 1 for (start, end) in done_ranges))
+    else:
+        # Preallocate the file so every segment can be written in place
+        with open(file_path, "wb") as file:
+            preallocate(file, file_size)
+        if resume:
+            save_done_ranges(file_path, file_size, done_ranges)
+
+    # The connections share the URL, so an expired URL is only refreshed once
+    stream_url = StreamUrl(url, refresh_url)
+
+    # Record each segment as soon as it's finished
+    state_lock = threading.Lock()
+    def fetch(start, end):
+        download_segment(session, stream_url, start, end, file_path, report, bandwidth, stream_metrics)
+        if resume:
+            with state_lock:
+                done_ranges.add((start, end))
+                save_done_ranges(file_path, file_size, done_ranges)
+
+    # The connections come from the shared pool, so the next file reuses them (no new TLS handshakes)
+    session = get_session()
+    pending_ranges = [r for r in split_ranges(file_size) if r not in done_ranges]
+    executor = ThreadPoolExecutor(max_workers=max_connections)
+    try:
+        futures = [executor.submit(fetch, start, end) for (start, end) in pending_ranges]
+        # Stop at the first segment that failed all of its retries
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in done:
+            future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        if stream_metrics is not None:
+            stream_metrics.finish()
+
+    return file_path
+
+# ------------------------------------------------------------------------------
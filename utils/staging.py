@@ -0,0 +1,216 @@
+import os
+import zlib
+import errno
+import shutil
+import socket
+import itertools
+import threading
+
+from .file import slugify
+
+# ------------------------------------------------------------------------------
+# Where the partial files of a video are written before it's published under its final name
+# - With a scratch directory (e.g. a local SSD or a tmpfs, see --scratch-dir), the streams are downloaded and
+#   merged there, so a slow target volume (e.g. a NAS mount) only gets one sequential write per finished file
+# - Without one, the partial files are in the target directory itself
+# - Merges write to a hidden ".partial" file, which is then published in one step: a rename on the same
+#   filesystem, otherwise a copy to a hidden file next to the target and a rename. A crash never leaves a
+#   half-written file under a final name, where it would be taken for a finished download
+# - The partial files are named after their writer (host, pid and a counter), so two writers of the same file
+#   never share one, and the partial files a crashed writer of this host left behind are removed by the next
+#   writer of the same file
+# - Stream files are preallocated to their full size, so a full disk fails the download before it starts
+scratch_dir: str | None = None
+
+write_buffer_size = 1024 * 1024     # Buffer of each segment's file handle (Python's default is 8KB)
+
+# The partial files this process is writing (the others of this process are left over from failed writes)
+active_partials: set[str] = set()
+active_partials_lock = threading.Lock()
+partial_counter = itertools.count()
+host_name = socket.gethostname()
+
+# ------------------------------------------------------------------------------
+# Set the scratch directory (None writes the partial files next to the targets)
+def configure(directory: str | None):
+    global scratch_dir
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    scratch_dir = directory
+
+# ------------------------------------------------------------------------------
+# Directory of the partial files of the videos of `file_dir`
+# Each target directory has its own directory in the scratch area (named after it, so resumed downloads find
+# their partial files again), since two playlists can download the same video at the same time
+def get_work_dir(file_dir: str) -> str:
+    if scratch_dir is None:
+        return file_dir
+    file_dir = os.path.abspath(file_dir)
+    digest = zlib.crc32(file_dir.encode("utf-8"))
+    return os.path.join(scratch_dir, f"{slugify(os.path.basename(file_dir)) or 'root'}-{digest:08x}")
+
+# The file a video is merged into before it's published to `file_path` (keeps the extension for ffmpeg)
+# Each call returns a new name, so two writers of the same file (e.g. two jobs adding the same video to the
+# object store) never merge into the same partial file
+def get_partial_path(file_path: str) -> str:
+    (name, ext) = os.path.splitext(os.path.basename(file_path))
+    return new_partial_path(get_work_dir(os.path.dirname(file_path)), f".{name}.partial-", ext)
+
+# A new partial file "<prefix><host>-<pid>-<n><suffix>" in `directory`, after removing the stale ones of the same file
+def new_partial_path(directory: str, prefix: str, suffix: str) -> str:
+    remove_stale_partials(directory, prefix, suffix)
+    partial_path = os.path.join(directory, f"{prefix}{host_name}-{os.getpid()}-{next(partial_counter)}{suffix}")
+    with active_partials_lock:
+        active_partials.add(partial_path)
+    return partial_path
+
+# Remove the partial files of a file that were left by writers of this host that are gone (or by this process)
+# The partial files of other hosts are left alone, their writers can't be checked from here
+def remove_stale_partials(directory: str, prefix: str, suffix: str):
+    prefix = f"{prefix}{host_name}-"
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        if not (name.startswith(prefix) and name.endswith(suffix)):
+            continue
+        (pid, _, n) = name[len(prefix):len(name) - len(suffix)].partition("-")
+        if not (pid.isdigit() and n.isdigit()):
+            continue
+        partial_path = os.path.join(directory, name)
+        with active_partials_lock:
+            if partial_path in active_partials:
+                continue
+        if int(pid) == os.getpid() or not is_process_alive(int(pid)):
+            try:
+                os.remove(partial_path)
+            except OSError:
+                pass
+
+# Check if a process of this host is running
+# Windows has no signal 0 (os.kill would terminate the process), so its processes are taken as running
+def is_process_alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# The partial file is published or discarded, its name can be taken as stale from now on
+def release_partial(partial_path: str):
+    with active_partials_lock:
+        active_partials.discard(partial_path)
+
+# Remove the partial file of a failed merge (it's never taken for a finished video, but it can be as big as one)
+def discard(partial_path: str):
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+    release_partial(partial_path)
+
+# ------------------------------------------------------------------------------
+# Exclusive lock on a file that several writers could write to, held on "<path>.lock"
+# It's a flock (POSIX) or a msvcrt lock (Windows), so it holds between the processes that share a directory (e.g.
+# the workers of a work queue, on one host or over NFS) as well as between threads, and a crashed holder releases it
+# The lock file is removed on release; a writer that locked a removed lock file locks the new one instead
+class FileLock:
+    def __init__(self, path: str):
+        self.path = f"{path}.lock"
+        self.file = None
+
+    # Returns False if the lock is held by another writer (and `blocking` is False)
+    def acquire(self, blocking: bool = True) -> bool:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        while True:
+            file = open(self.path, "a+b")
+            try:
+                if not lock_file(file, blocking):
+                    file.close()
+                    return False
+                # The holder removed the lock file when it released it, it must be locked again
+                if os.name != "nt" and os.fstat(file.fileno()).st_ino != os.stat(self.path).st_ino:
+                    file.close()
+                    continue
+            except FileNotFoundError:
+                file.close()
+                continue
+            except BaseException:
+                file.close()
+                raise
+            self.file = file
+            return True
+
+    def release(self):
+        (file, self.file) = (self.file, None)
+        if os.name != "nt":
+            # Removed while it's still locked, so nobody can lock it after it's gone
+            os.remove(self.path)
+        else:
+            import msvcrt
+            file.seek(0)
+            msvcrt.locking(file.fileno(), msvcrt.LK_UNLCK, 1)
+        file.close()
+
+def lock_file(file, blocking: bool) -> bool:
+    if os.name == "nt":
+        import msvcrt
+        file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(file.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                # LK_LOCK gives up after 10 attempts, one second apart
+                if not blocking:
+                    return False
+    import fcntl
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+# ------------------------------------------------------------------------------
+# Reserve the space of a file that is written in place (the file must be empty)
+# posix_fallocate allocates the blocks up front (and fails right away if they don't fit), where it isn't
+# supported the file is only extended (sparse)
+def preallocate(file, size: int):
+    if size > 0 and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(file.fileno(), 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                raise
+    file.truncate(size)
+
+# ------------------------------------------------------------------------------
+# Move a finished file to its final path, so it appears there complete or not at all
+def publish(partial_path: str, file_path: str):
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    try:
+        os.replace(partial_path, file_path)
+        release_partial(partial_path)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    # The scratch directory is on another filesystem: one sequential copy (sendfile where possible) to a hidden
+    # file next to the target, flushed to disk before it's renamed
+    temp_path = new_partial_path(os.path.dirname(file_path) or ".", f".{os.path.basename(file_path)}.partial-", "")
+    try:
+        shutil.copyfile(partial_path, temp_path)
+        with open(temp_path, "r+b") as file:
+            os.fsync(file.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        discard(temp_path)
+        raise
+    release_partial(temp_path)
+    discard(partial_path)
+
+# ------------------------------------------------------------------------------
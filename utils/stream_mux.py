@@ -0,0 +1,134 @@
+import os
+import time
+import errno
+import shutil
+import tempfile
+import threading
+import subprocess
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from .ffmpeg import MergeError, get_merge_command
+from .bandwidth import BandwidthJob
+from .segmented_dl import StreamUrl, split_ranges, read_segment
+from .transport import get_session
+from .metrics import StreamMetrics
+
+# ------------------------------------------------------------------------------
+# Containers ffmpeg can demux from a non-seekable input
+# (DASH mp4 files may need to seek to their index, so they use the temp file path instead)
+pipe_safe_subtypes = ["webm"]
+
+# Number of segments fetched ahead of the one being written to ffmpeg (bounds the memory used per stream)
+window = 4
+
+# ------------------------------------------------------------------------------
+# Check if two streams can be muxed while they are downloaded
+def can_stream_mux(video_subtype: str, audio_subtype: str) -> bool:
+    # Named pipes (FIFOs) are only available on POSIX systems
+    if not hasattr(os, "mkfifo"):
+        return False
+    return video_subtype in pipe_safe_subtypes and audio_subtype in pipe_safe_subtypes
+
+# ------------------------------------------------------------------------------
+# Yield the bytes of a file in order, while fetching the next few segments in parallel
+def iter_segments(session: requests.Session, url: str | StreamUrl, file_size: int, on_progress, bandwidth: BandwidthJob | None = None, stream_metrics: StreamMetrics | None = None):
+    with ThreadPoolExecutor(max_workers=window) as executor:
+        ranges = iter(split_ranges(file_size))
+        pending = []
+        # Fill the window, then keep it full while the oldest segment is consumed
+        for (start, end) in ranges:
+            pending.append(executor.submit(read_segment, session, url, start, end, on_progress, bandwidth, stream_metrics))
+            if len(pending) == window:
+                break
+        while pending:
+            data = pending.pop(0).result()
+            next_range = next(ranges, None)
+            if next_range is not None:
+                pending.append(executor.submit(read_segment, session, url, *next_range, on_progress, bandwidth, stream_metrics))
+            yield data
+
+# ------------------------------------------------------------------------------
+# Open a FIFO for writing once ffmpeg has opened it for reading (fails if ffmpeg exits before that)
+def open_fifo(fifo_path: str, process: subprocess.Popen):
+    while True:
+        try:
+            fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            # ENXIO: ffmpeg has not opened the FIFO yet
+            if e.errno != errno.ENXIO:
+                raise
+            if process.poll() is not None:
+                # Like a write to a FIFO that ffmpeg closed, its exit code and log tell why
+                raise BrokenPipeError("ffmpeg exited before reading the stream")
+            time.sleep(0.05)
+            continue
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, "wb")
+
+# ------------------------------------------------------------------------------
+# Download a video and an audio stream straight into ffmpeg (no temp files)
+# Each stream is written to ffmpeg through its own FIFO as the bytes arrive
+# `on_progress(n_bytes)` is called from the connections' threads (see segmented_download)
+def mux_streams(video_url: str | StreamUrl, video_size: int, audio_url: str | StreamUrl, audio_size: int, output_path: str, on_progress=None, bandwidth: BandwidthJob | None = None,
+                video_metrics: StreamMetrics | None = None, audio_metrics: StreamMetrics | None = None):
+    def report(n_bytes):
+        if on_progress is not None:
+            on_progress(n_bytes)
+
+    fifo_dir = tempfile.mkdtemp(prefix="yt-dl-")
+    video_fifo = os.path.join(fifo_dir, "video")
+    audio_fifo = os.path.join(fifo_dir, "audio")
+    os.mkfifo(video_fifo)
+    os.mkfifo(audio_fifo)
+
+    command = get_merge_command(video_fifo, audio_fifo, output_path)
+    # ffmpeg's log goes to a file, a pipe that nobody reads could block it
+    stderr_path = os.path.join(fifo_dir, "ffmpeg.log")
+
+    errors = []
+    def feed(fifo_path, url, file_size, stream_metrics):
+        try:
+            with open_fifo(fifo_path, process) as fifo:
+                for data in iter_segments(get_session(), url, file_size, report, bandwidth, stream_metrics):
+                    fifo.write(data)
+        except BrokenPipeError as e:
+            # ffmpeg stopped reading the stream itself (it's exiting, its exit code tells if it failed)
+            errors.append(e)
+        except Exception as e:
+            errors.append(e)
+            # Stop ffmpeg, otherwise it would wait forever for the rest of the stream
+            process.kill()
+        finally:
+            if stream_metrics is not None:
+                stream_metrics.finish()
+
+    try:
+        with open(stderr_path, "wb") as stderr_file:
+            process = subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=stderr_file)
+        threads = [
+            threading.Thread(target=feed, args=(video_fifo, video_url, video_size, video_metrics)),
+            threading.Thread(target=feed, args=(audio_fifo, audio_url, audio_size, audio_metrics)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return_code = process.wait()
+        with open(stderr_path, "r", encoding="utf-8", errors="replace") as stderr_file:
+            stderr = stderr_file.read()
+    finally:
+        shutil.rmtree(fifo_dir, ignore_errors=True)
+
+    # A feeder that failed on its own (e.g. a segment failed all of its retries) stopped ffmpeg, its error is the cause
+    # A broken pipe only means that ffmpeg stopped reading, if ffmpeg failed its log has the cause (e.g. a codec error)
+    feeder_errors = [e for e in errors if not isinstance(e, BrokenPipeError)]
+    if feeder_errors:
+        raise feeder_errors[0]
+    if return_code != 0:
+        raise MergeError(return_code, stderr)
+    if errors:
+        raise errors[0]
+    return output_path
+
+# ------------------------------------------------------------------------------
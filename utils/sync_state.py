@@ -0,0 +1,113 @@
+import os
+import time
+import sqlite3
+import threading
+
+from .file import get_cache_dir
+
+# ------------------------------------------------------------------------------
+# State of the channel/playlist syncs, in a SQLite database (__cache__/sync.db)
+# - A source is a channel or playlist synced into a directory (the same channel in
+#   another directory is another source)
+# - Each video seen in a source is recorded once it's downloaded (or skipped because
+#   it already exists) with the time it was first seen, failed videos are recorded too
+#   so the next sync can retry them
+# - A channel lists its uploads newest first, so a re-sync stops listing at the first
+#   video it already has, but only if the last sync listed all of its new videos (a sync
+#   that was interrupted or failed to list could have missed older uploads)
+sync_db_file_name = "sync.db"
+
+schema = """
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT NOT NULL,
+    file_dir TEXT NOT NULL,
+    url TEXT,
+    title TEXT,
+    last_video_id TEXT,
+    last_synced_at REAL,
+    complete INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (source, file_dir)
+);
+CREATE TABLE IF NOT EXISTS videos (
+    source TEXT NOT NULL,
+    file_dir TEXT NOT NULL,
+    video_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    first_seen_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (source, file_dir, video_id)
+);
+"""
+
+# ------------------------------------------------------------------------------
+# Open the sync state of a source ("channel:<id>" or "playlist:<id>") in a directory and start a sync
+def open_sync_source(source: str, file_dir: str, url: str, title: str) -> "SyncSource":
+    return SyncSource(os.path.join(get_cache_dir(), sync_db_file_name), source, os.path.abspath(file_dir), url, title)
+
+# ------------------------------------------------------------------------------
+class SyncSource:
+    def __init__(self, db_path: str, source: str, file_dir: str, url: str, title: str):
+        self.source = source
+        self.file_dir = file_dir
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        # The download workers record their videos from their own threads
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.connection.executescript(schema)
+        # State of each known video ("done" or "failed"), loaded once
+        rows = self.connection.execute(
+            "SELECT video_id, state FROM videos WHERE source = ? AND file_dir = ?", (source, file_dir)
+        )
+        self.states: dict[str, str] = dict(rows.fetchall())
+        # Whether the last sync listed all of its new videos
+        row = self.connection.execute(
+            "SELECT complete FROM sources WHERE source = ? AND file_dir = ?", (source, file_dir)
+        ).fetchone()
+        self.was_complete = bool(row and row[0])
+        # The sync is incomplete until finish() is called
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO sources (source, file_dir, url, title) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (source, file_dir) DO UPDATE SET url = excluded.url, title = excluded.title, complete = 0",
+                (source, file_dir, url, title),
+            )
+
+    # --------------------------------------------------------------------------
+    # Check if a video has been downloaded by an earlier sync
+    def is_done(self, video_id: str) -> bool:
+        return self.states.get(video_id) == "done"
+
+    # Videos that failed in an earlier sync
+    def failed_ids(self) -> list[str]:
+        return [video_id for (video_id, state) in self.states.items() if state == "failed"]
+
+    # --------------------------------------------------------------------------
+    # Record the status of a video ("Downloaded", "Skipped" or "Failed")
+    def record(self, video_id: str, status: str):
+        state = "failed" if status == "Failed" else "done"
+        now = time.time()
+        with self.lock:
+            self.states[video_id] = state
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO videos (source, file_dir, video_id, state, first_seen_at, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (source, file_dir, video_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+                    (self.source, self.file_dir, video_id, state, now, now),
+                )
+
+    # --------------------------------------------------------------------------
+    # Record that the sync has listed all of its new videos
+    # `last_video_id` is the first video listed (i.e. the newest upload of a channel)
+    def finish(self, last_video_id: str | None):
+        with self.lock:
+            with self.connection:
+                self.connection.execute(
+                    "UPDATE sources SET last_video_id = COALESCE(?, last_video_id), last_synced_at = ?, complete = 1 WHERE source = ? AND file_dir = ?",
+                    (last_video_id, time.time(), self.source, self.file_dir),
+                )
+
+    # --------------------------------------------------------------------------
+    def close(self):
+        self.connection.close()
+
+# ------------------------------------------------------------------------------
@@ -0,0 +1,81 @@
+import io
+import json
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib.error import HTTPError, URLError
+
+# ------------------------------------------------------------------------------
+# One pooled HTTP transport for the whole process
+# - Metadata (pytubefix's innertube and page requests), file sizes, media segments and the VPN check
+#   all go through the same requests.Session, so they reuse keep-alive connections and TLS sessions
+#   instead of paying a TCP and TLS handshake per request
+# - Each host has its own pool of at most `max_connections_per_host` connections; when all of them
+#   are busy, a request waits for a free one instead of opening another
+max_hosts = 16                      # Number of hosts whose pools are kept
+max_connections_per_host = 32       # Same as the most connections the ConnectionController allows
+default_timeout = 30                # Seconds, for the pytubefix requests that don't set a timeout
+
+default_headers = {"User-Agent": "Mozilla/5.0", "accept-language": "en-US,en"}
+
+session: requests.Session | None = None
+session_lock = threading.Lock()
+
+# ------------------------------------------------------------------------------
+# Get the shared session (created on first use)
+def get_session() -> requests.Session:
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=max_hosts, pool_maxsize=max_connections_per_host, pool_block=True)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        return session
+
+# ------------------------------------------------------------------------------
+# The part of urllib's response that pytubefix uses
+class TransportResponse:
+    def __init__(self, response: requests.Response):
+        self.response = response
+        self.status = response.status_code
+        self.headers = response.headers
+        self.body = io.BytesIO(response.content)
+
+    def read(self, amt: int | None = None) -> bytes:
+        return self.body.read(amt)
+
+    def info(self):
+        return self.headers
+
+    def getcode(self) -> int:
+        return self.status
+
+# ------------------------------------------------------------------------------
+# Replacement for pytubefix.request._execute_request (which opens a new connection with urlopen for every request)
+# It raises the same urllib errors, since pytubefix handles those
+def execute_request(url, method=None, headers=None, data=None, timeout=None):
+    request_headers = {**default_headers, **(headers or {})}
+    if data and not isinstance(data, bytes):
+        data = bytes(json.dumps(data), encoding="utf-8")
+    if not url.lower().startswith("http"):
+        raise ValueError("Invalid URL")
+    # pytubefix passes socket's default timeout sentinel when it doesn't set one
+    if not isinstance(timeout, (int, float)):
+        timeout = default_timeout
+    try:
+        # urlopen follows redirects for every method (requests doesn't for HEAD by default)
+        response = get_session().request(method or ("POST" if data else "GET"), url, headers=request_headers, data=data, timeout=timeout, allow_redirects=True)
+    except requests.RequestException as e:
+        raise URLError(e) from e
+    if response.status_code >= 400:
+        raise HTTPError(url, response.status_code, response.reason, response.headers, io.BytesIO(response.content))
+    return TransportResponse(response)
+
+# ------------------------------------------------------------------------------
+# Route pytubefix's requests through the shared session
+def install_pytubefix_transport():
+    from pytubefix import request
+    request._execute_request = execute_request
+
+# ------------------------------------------------------------------------------
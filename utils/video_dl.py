@@ -1,123 +1,244 @@
-from pytubefix import YouTube, Stream
+from __future__ import annotations
 import os
 from uuid import uuid4 as UUID
-from tqdm import tqdm
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
-from .file import get_project_root
+from .ffmpeg import run_merge, print_merged
+from .segmented_dl import StreamUrl, segmented_download, remove_partial_files
+from .bandwidth import BandwidthJob, scheduler
+from .stream_mux import can_stream_mux, mux_streams
+from .metadata_cache import CachedStream, get_video_info
+from .metrics import ItemMetrics, StreamMetrics, recorder
+from .progress import ProgressTask, progress
+from .staging import get_work_dir, get_partial_path, publish, discard
 
 from .console import print_separator, print_error, print_success, print_info
-from .ask import choose_format, choose_stream, get_filename
 
+if TYPE_CHECKING:
+    from pytubefix import YouTube
 
-def download_video(url):
+
+# Returns "Downloaded" or "Failed" (a failed download is reported, it doesn't exit the app)
+# The user is waiting for it, so it has the interactive priority for the bandwidth (see bandwidth.py)
+def download_video(url, resume: bool = True, stream_mux: bool = False) -> str:
+    # The time of each phase is recorded once the status is known (see metrics.py)
+    metrics = recorder.start_item(url)
+    status = "Failed"
+    try:
+        status = download_selected_video(url, resume, stream_mux, metrics)
+        return status
+    finally:
+        metrics.finish(status)
+
+# ------------------------------------------------------------------------------
+# Ask for the streams and the file name of a video, then download it
+def download_selected_video(url, resume: bool, stream_mux: bool, metrics: ItemMetrics) -> str:
+    # The prompts and pytubefix are only imported on this (interactive) path
+    from pytubefix import YouTube
+    from .ask import choose_format, choose_stream, get_filename
     # --------------------------------------------------------------------------
     # Initialize PyTube object with OAuth
-    yt = YouTube(url, use_oauth=True, allow_oauth_cache=True)
+    with metrics.phase("metadata"):
+        yt = YouTube(url, use_oauth=True, allow_oauth_cache=True)
     # --------------------------------------------------------------------------
     # Let user choose format (used to filter both with video and audio)
-    format = choose_format() # "webm" or "mp4"
+    with metrics.phase("stream_selection"):
+        format = choose_format() # "webm" or "mp4"
     print_separator()
+    # Get the streams of the video (from the metadata cache if possible)
+    with metrics.phase("metadata"):
+        info = get_video_info(yt)
     # --------------------------------------------------------------------------
-    # Let user choose video stream
-    video_stream_options: list[Stream]  = [stream for stream in yt.streams.filter(is_dash=True).order_by("resolution").desc() if stream.includes_video_track and not stream.includes_audio_track]
-    
-    # Filter streams that match the selected format
-    video_stream_options = [stream for stream in video_stream_options if format in stream.mime_type]
+    # Let user choose video stream (only streams that match the selected format)
+    video_stream_options = get_video_streams(info.streams, format)
     
-    video_stream = choose_stream(video_stream_options, is_video=True)
+    with metrics.phase("stream_selection"):
+        video_stream = choose_stream(video_stream_options, is_video=True, metrics=metrics)
     print_separator()
     # --------------------------------------------------------------------------
-    # Let user choose audio stream
-    audio_stream_options: list[Stream]  = [stream for stream in yt.streams.filter(is_dash=True).order_by("abr").desc() if stream.includes_audio_track and not stream.includes_video_track]
+    # Let user choose audio stream (only streams that match the selected format)
+    audio_stream_options = get_audio_streams(info.streams, format)
     
-    # Filter streams that match the selected format
-    audio_stream_options = [stream for stream in audio_stream_options if format in stream.mime_type]
-    
-    audio_stream = choose_stream(audio_stream_options, is_video=False)
+    with metrics.phase("stream_selection"):
+        audio_stream = choose_stream(audio_stream_options, is_video=False, metrics=metrics)
     print_separator()
     # --------------------------------------------------------------------------
     # Let user choose the file and directory names
-    (file_dir, file_name) = get_filename(yt, video_stream)
+    (file_dir, file_name) = get_filename(yt, video_stream, metrics)
     file_path = os.path.join(file_dir, file_name)
+    # The merged file only gets its name once it's complete (see staging.py)
+    output_path = get_partial_path(file_path)
     
-    # Select temp file names for video and audio streams
-    random_id = str(UUID())[:8]
-    video_file_name = f"temp_vid_{random_id}"
+    # Mux the streams while they are downloaded (if possible for the selected format)
+    if stream_mux and can_stream_mux(video_stream.subtype, audio_stream.subtype):
+        print_separator()
+        try:
+            with scheduler.add(f"video:{yt.video_id}", "interactive") as bandwidth, metrics.phase("mux"):
+                mux_audio_video(yt, video_stream, audio_stream, output_path, bandwidth, metrics)
+            publish(output_path, file_path)
+            print_merged(file_path)
+        except Exception as e:
+            print_separator()
+            print_error(f"Error during download or merge: {e}")
+            discard(output_path)
+            return "Failed"
+        print_separator()
+        print_success("Done")
+        return "Downloaded"
     
-    audio_file_name = f"temp_aud_{random_id}"
+    # Select temp file names for video and audio streams
+    (video_file_name, audio_file_name) = get_temp_file_names(yt, video_stream, audio_stream, resume)
+
+    # Temp file paths are known upfront so they can be cleaned up even if a download fails
+    work_dir = get_work_dir(file_dir)
+    downloaded_video_path = os.path.join(work_dir, video_file_name)
+    downloaded_audio_path = os.path.join(work_dir, audio_file_name)
     print_separator()
     # --------------------------------------------------------------------------
     # Start download process and merge audio and video
+    succeeded = False
     try:
         # ----------------------------------------------------------------------
-        # Download video and audio streams
-        downloaded_video_path = download(yt, video_stream, file_dir, video_file_name)
-        downloaded_audio_path = download(yt, audio_stream, file_dir, audio_file_name)
+        # Download video and audio streams at the same time
+        with scheduler.add(f"video:{yt.video_id}", "interactive") as bandwidth, metrics.phase("download"):
+            (downloaded_video_path, downloaded_audio_path) = download_audio_video(yt, video_stream, audio_stream, work_dir, video_file_name, audio_file_name, resume, bandwidth, metrics)
         # ----------------------------------------------------------------------
         print_separator()
         print_info("Download complete. Merging audio and video...")
         # ----------------------------------------------------------------------
         # Merge video and audio using ffmpeg-python
-        merge_audio_video(downloaded_video_path, downloaded_audio_path, file_path)
+        with metrics.phase("merge"):
+            merge_stats = merge_audio_video(downloaded_video_path, downloaded_audio_path, output_path)
+        metrics.merge_duration = merge_stats[0]
+        publish(output_path, file_path)
+        print_merged(file_path, merge_stats)
+        succeeded = True
         # ----------------------------------------------------------------------
     except Exception as e:
         print_separator()
         print_error(f"Error during download or merge: {e}")
-        exit(1)
+        discard(output_path)
     finally:
-        # Clean up temporary files
-        if os.path.exists(downloaded_video_path):
-            os.remove(downloaded_video_path)
-        if os.path.exists(downloaded_audio_path):
-            os.remove(downloaded_audio_path)
+        # Clean up temporary files (in resume mode, they are kept after a failure so a rerun can continue them)
+        if succeeded or not resume:
+            remove_partial_files(downloaded_video_path, downloaded_audio_path)
+        else:
+            print_info("Partial files were kept. Run the download again to resume it.")
         print_separator()
-        print_success("Done")
     # --------------------------------------------------------------------------
+    if not succeeded:
+        return "Failed"
+    print_success("Done")
+    return "Downloaded"
     
 
 # ------------------------------------------------------------------------------
-# Helper function to download a stream and show progress
-def download(yt: YouTube, stream: Stream, file_dir: str, file_name: str):
-    # Define progress bar
-    progress_bar = tqdm(total=stream.filesize, unit="B", unit_scale=True, desc="Downloading Stream")
+# Sort key of a resolution or bitrate ("1080p" -> 1080, "128kbps" -> 128)
+def get_quality(value: str) -> int:
+    return int("".join(filter(str.isdigit, value)))
+
+# ------------------------------------------------------------------------------
+# Get the DASH video-only streams of a format, highest resolution first
+def get_video_streams(streams: list[CachedStream], format: str) -> list[CachedStream]:
+    video_streams = [
+        stream for stream in streams
+        if stream.is_dash and stream.includes_video_track and not stream.includes_audio_track and stream.resolution is not None and format in stream.mime_type
+    ]
+    return sorted(video_streams, key=lambda stream: get_quality(stream.resolution), reverse=True)
+
+# ------------------------------------------------------------------------------
+# Get the DASH audio-only streams of a format, highest bitrate first
+def get_audio_streams(streams: list[CachedStream], format: str) -> list[CachedStream]:
+    audio_streams = [
+        stream for stream in streams
+        if stream.is_dash and stream.includes_audio_track and not stream.includes_video_track and stream.abr is not None and format in stream.mime_type
+    ]
+    return sorted(audio_streams, key=lambda stream: get_quality(stream.abr), reverse=True)
+
+# ------------------------------------------------------------------------------
+# Select temp file names for the video and audio streams
+# In resume mode, the names only depend on the video id and itag, so a rerun finds the same partial files
+def get_temp_file_names(yt: YouTube, video_stream: CachedStream, audio_stream: CachedStream, resume: bool):
+    if resume:
+        return (f"temp_vid_{yt.video_id}_{video_stream.itag}", f"temp_aud_{yt.video_id}_{audio_stream.itag}")
     
-    # Define progress callback functions
-    def progress_cb(stream, chunk, bytes_remaining):
-        bytes_downloaded = stream.filesize - bytes_remaining
-        progress_bar.n = bytes_downloaded
-        progress_bar.refresh()
+    random_id = str(UUID())[:8]
+    return (f"temp_vid_{random_id}", f"temp_aud_{random_id}")
+
+# ------------------------------------------------------------------------------
+# Helper function to download a stream and show progress
+def download(yt: YouTube, stream: CachedStream, file_dir: str, file_name: str, progress_task: ProgressTask | None = None, resume: bool = False, bandwidth: BandwidthJob | None = None,
+             metrics: ItemMetrics | None = None):
+    # Show the progress of the stream (unless the caller shares a task between multiple streams)
+    own_progress_task = progress_task is None
+    if own_progress_task:
+        progress_task = progress.add(yt.video_id, stream.filesize)
     
-    # Register progress callbacks
-    yt.register_on_progress_callback(progress_cb)
-        
-    # Download the stream
-    downloaded_path = stream.download(output_path=file_dir, filename=file_name)
+    # Create the directory if needed (e.g. a new playlist directory)
+    os.makedirs(file_dir, exist_ok=True)
     
-    # Close progress bar
-    progress_bar.close()
+    try:
+        # Download the stream over multiple connections
+        # An expired stream URL is replaced during the download, without losing the finished segments
+        downloaded_path = segmented_download(stream.url, stream.filesize, os.path.join(file_dir, file_name), on_progress=progress_task.update, resume=resume, refresh_url=stream.refresh_url, bandwidth=bandwidth,
+                                             stream_metrics=get_stream_metrics(metrics, stream))
+    finally:
+        if own_progress_task:
+            progress_task.close()
     
     # Return downloaded file's path
     return downloaded_path
 
 # ------------------------------------------------------------------------------
-# Merge audio and video
-def merge_audio_video(video_path, audio_path, output_path):
-    # Path to ffmpeg executable
-    ffmpeg_path = os.path.join(get_project_root(), "data", "ffmpeg.exe")
+# Helper function to download the video and audio streams of one item at the same time and show a combined progress
+def download_audio_video(yt: YouTube, video_stream: CachedStream, audio_stream: CachedStream, file_dir: str, video_file_name: str, audio_file_name: str, resume: bool = False,
+                         bandwidth: BandwidthJob | None = None, metrics: ItemMetrics | None = None):
+    # Show a single progress line for both streams
+    progress_task = progress.add(yt.video_id, video_stream.filesize + audio_stream.filesize)
     
-    # Command to merge video and audio while keeping original quality
-    command = [
-        ffmpeg_path,
-        '-i', video_path,
-        '-i', audio_path,
-        '-c:v', 'copy',    # Copy video codec to retain quality
-        '-c:a', 'copy',    # Copy audio codec to retain quality
-        output_path
-    ]
+    try:
+        # Download both streams at the same time
+        # If one of them fails, the executor still waits for the other one before the error is raised,
+        # so the caller can safely remove both temp files afterwards
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            video_future = executor.submit(download, yt, video_stream, file_dir, video_file_name, progress_task, resume, bandwidth, metrics)
+            audio_future = executor.submit(download, yt, audio_stream, file_dir, audio_file_name, progress_task, resume, bandwidth, metrics)
+            downloaded_paths = (video_future.result(), audio_future.result())
+    finally:
+        progress_task.close()
     
-    # Run the command
-    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    print_success(f"Merged file saved to: {output_path}")
+    # Return downloaded files' paths
+    return downloaded_paths
+
+# ------------------------------------------------------------------------------
+# Helper function to download the video and audio streams straight into ffmpeg and show a combined progress
+def mux_audio_video(yt: YouTube, video_stream: CachedStream, audio_stream: CachedStream, file_path: str, bandwidth: BandwidthJob | None = None, metrics: ItemMetrics | None = None):
+    # Create the directory if needed (e.g. a new playlist directory)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    
+    # Show a single progress line for both streams
+    progress_task = progress.add(yt.video_id, video_stream.filesize + audio_stream.filesize)
+    
+    try:
+        mux_streams(StreamUrl(video_stream.url, video_stream.refresh_url), video_stream.filesize, StreamUrl(audio_stream.url, audio_stream.refresh_url), audio_stream.filesize, file_path, on_progress=progress_task.update, bandwidth=bandwidth,
+                    video_metrics=get_stream_metrics(metrics, video_stream), audio_metrics=get_stream_metrics(metrics, audio_stream))
+    finally:
+        progress_task.close()
+    
+    return file_path
+
+# ------------------------------------------------------------------------------
+# Start the metrics of a stream of an item (if the item has metrics)
+def get_stream_metrics(metrics: ItemMetrics | None, stream: CachedStream) -> StreamMetrics | None:
+    if metrics is None:
+        return None
+    return metrics.stream("video" if stream.includes_video_track else "audio", stream.itag, stream.filesize)
+
+# ------------------------------------------------------------------------------
+# Merge audio and video (raises a MergeError with the end of ffmpeg's log if it fails)
+# Returns the wall time and output size of the merge
+def merge_audio_video(video_path, audio_path, output_path) -> tuple[float, int]:
+    return run_merge(video_path, audio_path, output_path)
 
 # ------------------------------------------------------------------------------
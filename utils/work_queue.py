@@ -0,0 +1,354 @@
+from __future__ import annotations
+import os
+import time
+import socket
+import sqlite3
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator
+
+from .file import get_main_script_location, slugify
+from .console import print_error, print_info, print_separator
+from . import manifest
+from .metadata_cache import get_playlist_info
+from .object_store import ObjectStore, open_store
+from .merge_queue import MergeQueue
+from .bandwidth import scheduler
+from .metrics import ItemMetrics, recorder
+from .progress import progress
+from .playlist_dl import download_video
+
+# ------------------------------------------------------------------------------
+# Work queue shared by several worker processes, on one host or on several hosts, for large playlists and channels
+# - `--enqueue QUEUE` lists the videos of a playlist or channel into QUEUE, a SQLite database that all the workers
+#   can open (e.g. on a shared mount). The videos are downloaded into the job's directory, which the workers share too
+# - `--worker QUEUE` claims one queued video at a time (per download thread), downloads it and records its status
+# - A claimed video is leased to its worker for `lease_seconds`, and the lease is renewed while the video is
+#   downloading and merging. If the worker crashes, its lease expires and another worker claims the video
+#   (it continues the partial files, if the crashed worker left them in the shared directory)
+# - A video that failed `max_attempts` times is marked as failed; enqueueing its job again retries it
+# - Enqueueing a job again (same URL and directory) only adds its new videos, the finished ones stay finished
+# - A worker exits once nothing is left to claim and no other worker holds a lease (an expiring lease could
+#   still give it work)
+# SQLite locks the database with the filesystem's locks (NFS needs working fcntl locks), and uses its rollback
+# journal (WAL needs memory shared between the processes, which hosts don't have). The leases use the hosts'
+# clocks, which must be within a few seconds of each other
+lease_seconds = 120
+renew_interval = 30                 # Seconds between two renewals of a worker's leases
+poll_interval = 5                   # Seconds an idle worker waits before it looks for work again
+max_attempts = 3
+insert_batch_size = 100             # Videos inserted per transaction while a job is listed
+
+schema = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    url TEXT NOT NULL,
+    file_dir TEXT NOT NULL,
+    title TEXT,
+    format TEXT NOT NULL,
+    min_resolution TEXT NOT NULL,
+    min_bitrate TEXT NOT NULL,
+    store_dir TEXT,
+    indexed INTEGER NOT NULL,
+    UNIQUE (url, file_dir)
+);
+CREATE TABLE IF NOT EXISTS items (
+    job_id INTEGER NOT NULL,
+    video_url TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires_at REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    status TEXT,
+    updated_at REAL,
+    PRIMARY KEY (job_id, video_url)
+);
+CREATE INDEX IF NOT EXISTS items_by_state ON items (state, job_id, idx);
+"""
+
+# ------------------------------------------------------------------------------
+# A claimed video, with the options of its job
+class QueueItem:
+    def __init__(self, row: sqlite3.Row):
+        self.job_id: int = row["job_id"]
+        self.video_url: str = row["video_url"]
+        self.idx: int = row["idx"]
+        self.attempts: int = row["attempts"]
+        self.job_url: str = row["url"]
+        self.file_dir: str = row["file_dir"]
+        self.format: str = row["format"]
+        self.min_resolution: str = row["min_resolution"]
+        self.min_bitrate: str = row["min_bitrate"]
+        self.store_dir: str | None = row["store_dir"]
+        self.indexed = bool(row["indexed"])
+
+# ------------------------------------------------------------------------------
+class WorkQueue:
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        # The download threads claim and finish their videos from their own threads
+        self.lock = threading.Lock()
+        # Transactions are started explicitly (BEGIN IMMEDIATE), so two workers can't claim the same video
+        self.connection = sqlite3.connect(db_path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.connection.row_factory = sqlite3.Row
+        with self.lock:
+            self.connection.executescript(schema)
+
+    # --------------------------------------------------------------------------
+    # Run `fn(connection)` in a write transaction and return its result
+    def _transaction(self, fn):
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self.connection)
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+            return result
+
+    # --------------------------------------------------------------------------
+    # Add a job (or update the options of the same job) and return its id
+    def add_job(self, url: str, file_dir: str, title: str, format: str, min_resolution: str, min_bitrate: str, store_dir: str | None, indexed: bool) -> int:
+        def add(connection):
+            connection.execute(
+                "INSERT INTO jobs (url, file_dir, title, format, min_resolution, min_bitrate, store_dir, indexed) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (url, file_dir) DO UPDATE SET title = excluded.title, format = excluded.format, min_resolution = excluded.min_resolution, "
+                "min_bitrate = excluded.min_bitrate, store_dir = excluded.store_dir, indexed = excluded.indexed",
+                (url, file_dir, title, format, min_resolution, min_bitrate, store_dir, int(indexed)),
+            )
+            return connection.execute("SELECT id FROM jobs WHERE url = ? AND file_dir = ?", (url, file_dir)).fetchone()["id"]
+        return self._transaction(add)
+
+    # --------------------------------------------------------------------------
+    # Queue the videos of a job as they are listed (so the workers can start before the listing is done)
+    # A video that is already queued keeps its state, except that a failed one is queued again
+    # Returns the number of videos listed
+    def add_items(self, job_id: int, video_urls: Iterator[str]) -> int:
+        def add(connection, batch):
+            connection.executemany(
+                "INSERT INTO items (job_id, video_url, idx, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (job_id, video_url) DO UPDATE SET idx = excluded.idx, "
+                "attempts = CASE WHEN state = 'failed' THEN 0 ELSE attempts END, "
+                "state = CASE WHEN state = 'failed' THEN 'pending' ELSE state END",
+                batch,
+            )
+        batch = []
+        n_items = 0
+        for (idx, video_url) in enumerate(video_urls):
+            batch.append((job_id, video_url, idx, time.time()))
+            n_items += 1
+            if len(batch) >= insert_batch_size:
+                self._transaction(lambda connection: add(connection, batch))
+                batch = []
+        if batch:
+            self._transaction(lambda connection: add(connection, batch))
+        return n_items
+
+    # --------------------------------------------------------------------------
+    # Lease the next video to a worker (a queued one, or one whose lease has expired)
+    # Returns None if there is nothing to claim
+    def claim(self, worker: str, lease: float = lease_seconds) -> QueueItem | None:
+        def claim(connection):
+            now = time.time()
+            while True:
+                row = connection.execute(
+                    "SELECT items.*, jobs.* FROM items JOIN jobs ON jobs.id = items.job_id "
+                    "WHERE items.state = 'pending' OR (items.state = 'leased' AND items.lease_expires_at < ?) "
+                    "ORDER BY items.job_id, items.idx LIMIT 1",
+                    (now,),
+                ).fetchone()
+                if row is None:
+                    return None
+                # A video whose workers keep crashing is given up on like a failing one
+                if row["attempts"] >= max_attempts:
+                    connection.execute(
+                        "UPDATE items SET state = 'failed', status = 'Failed', worker = NULL, lease_expires_at = NULL, updated_at = ? "
+                        "WHERE job_id = ? AND video_url = ?",
+                        (now, row["job_id"], row["video_url"]),
+                    )
+                    continue
+                connection.execute(
+                    "UPDATE items SET state = 'leased', worker = ?, lease_expires_at = ?, attempts = attempts + 1, updated_at = ? "
+                    "WHERE job_id = ? AND video_url = ?",
+                    (worker, now + lease, now, row["job_id"], row["video_url"]),
+                )
+                item = QueueItem(row)
+                item.attempts += 1
+                return item
+        return self._transaction(claim)
+
+    # --------------------------------------------------------------------------
+    # Extend the leases of a worker's videos
+    def renew(self, items: list[QueueItem], worker: str, lease: float = lease_seconds):
+        if not items:
+            return
+        def renew(connection):
+            connection.executemany(
+                "UPDATE items SET lease_expires_at = ? WHERE job_id = ? AND video_url = ? AND worker = ? AND state = 'leased'",
+                [(time.time() + lease, item.job_id, item.video_url, worker) for item in items],
+            )
+        self._transaction(renew)
+
+    # --------------------------------------------------------------------------
+    # Record the status of a leased video ("Downloaded", "Skipped" or "Failed")
+    # A failed video is queued again until it has failed `max_attempts` times
+    # Returns False if the worker had lost its lease (the video was claimed by another worker)
+    def finish(self, item: QueueItem, worker: str, status: str) -> bool:
+        if status != "Failed":
+            state = "done"
+        else:
+            state = "failed" if item.attempts >= max_attempts else "pending"
+        def finish(connection):
+            cursor = connection.execute(
+                "UPDATE items SET state = ?, status = ?, worker = NULL, lease_expires_at = NULL, updated_at = ? "
+                "WHERE job_id = ? AND video_url = ? AND worker = ? AND state = 'leased'",
+                (state, status, time.time(), item.job_id, item.video_url, worker),
+            )
+            return cursor.rowcount == 1
+        return self._transaction(finish)
+
+    # --------------------------------------------------------------------------
+    # Number of videos in each state ("pending", "leased", "done", "failed")
+    def get_counts(self) -> dict[str, int]:
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) AS n FROM items GROUP BY state").fetchall()
+        return {row["state"]: row["n"] for row in rows}
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# ------------------------------------------------------------------------------
+# Print how many videos of the queue are in each state
+def print_counts(queue: WorkQueue):
+    counts = queue.get_counts()
+    print_info(", ".join(f"{state}: {counts.get(state, 0)}" for state in ("pending", "leased", "done", "failed")))
+
+# ------------------------------------------------------------------------------
+# List a playlist or channel into a queue (type is "Playlist" or "Channel")
+# Without a directory, the videos go to videos/<playlist-title>/ or videos/<channel-name>/ like a regular download,
+# so the workers only share it if they run from the same (shared) location
+# Returns the number of videos listed
+def enqueue(db_path: str, url: str, type: str, file_dir: str | None, format: str, min_resolution: str, min_bitrate: str, store: bool | str | None = None) -> int:
+    from pytubefix import Channel, Playlist
+    if type == "Channel":
+        # Channel uploads get no index prefix, since the index of an upload changes with each new upload
+        channel = Channel(url, use_oauth=True, allow_oauth_cache=True)
+        (title, video_urls, indexed) = (channel.channel_name, channel.url_generator(), False)
+    else:
+        (title, _, video_urls) = get_playlist_info(Playlist(url, use_oauth=True, allow_oauth_cache=True))
+        indexed = True
+    file_dir = os.path.abspath(file_dir or os.path.join(get_main_script_location(), "videos", slugify(title)))
+    object_store = open_store(store)
+    store_dir = os.path.abspath(object_store.store_dir) if object_store is not None else None
+
+    queue = WorkQueue(db_path)
+    try:
+        job_id = queue.add_job(url, file_dir, title, format, min_resolution, min_bitrate, store_dir, indexed)
+        n_items = queue.add_items(job_id, video_urls)
+        print_info(f"Queued {n_items} videos of \"{title}\" into {file_dir}")
+        print_counts(queue)
+    finally:
+        queue.close()
+    return n_items
+
+# ------------------------------------------------------------------------------
+# Download the videos of a queue until there is nothing left to claim
+# Each of the `workers` threads downloads one video at a time, the merges run in the background (see merge_queue.py)
+# Returns the number of videos of each status downloaded by this worker
+def run_worker(db_path: str, workers: int = 1, merge_workers: int | None = None, stream_mux: bool = False, lease: float | None = None,
+               priority: str = "bulk", max_rate: int | None = None) -> dict[str, int]:
+    from pytubefix import YouTube
+    lease = lease or lease_seconds
+    # Several processes append to the same manifests, a rewrite by one of them could drop the others' lines
+    manifest.compact_on_load = False
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    queue = WorkQueue(db_path)
+    print_info(f"Worker {worker} started on {db_path}")
+    print_counts(queue)
+
+    # The videos this worker holds a lease on (until their merge is done)
+    held: dict[tuple[int, str], QueueItem] = {}
+    counts: Counter = Counter()
+    held_lock = threading.Lock()
+    stopped = threading.Event()
+    stores: dict[str, ObjectStore] = {}
+
+    # Renew the leases while the videos are downloading and merging
+    def renew_leases():
+        while not stopped.wait(min(renew_interval, lease / 3)):
+            with held_lock:
+                items = list(held.values())
+            try:
+                queue.renew(items, worker, lease)
+            except sqlite3.Error as e:
+                # The next renewal can still make it before the leases expire
+                print_error(f"Error while renewing the leases: {e}")
+
+    items_task = progress.add(os.path.basename(db_path), None, "items")
+    def item_done(item: QueueItem, status: str, metrics: ItemMetrics):
+        metrics.finish(status)
+        items_task.update()
+        with held_lock:
+            held.pop((item.job_id, item.video_url), None)
+            counts[status] += 1
+        if not queue.finish(item, worker, status):
+            print_error(f"The lease of \"{item.video_url}\" expired before it was finished, another worker has it now")
+
+    def download_item(item: QueueItem, merge_queue: MergeQueue, bandwidth) -> str | Future:
+        metrics = recorder.start_item(item.video_url, item.job_url)
+        try:
+            if item.store_dir is not None and item.store_dir not in stores:
+                stores[item.store_dir] = ObjectStore(item.store_dir)
+            with metrics.phase("metadata"):
+                video = YouTube(item.video_url, use_oauth=True, allow_oauth_cache=True)
+            print_info(f"Downloading video {item.idx + 1} of {item.job_url} (attempt {item.attempts})")
+            # Resume mode, so a video reclaimed from a crashed worker continues its partial files
+            result = download_video(video, item.file_dir, item.format, item.min_resolution, item.min_bitrate, item.idx + 1 if item.indexed else None, True,
+                                    merge_queue, stream_mux, stores.get(item.store_dir), bandwidth, metrics)
+        except Exception as e:
+            # A failing item must not stop the worker
+            print_error(f"Error while downloading video {item.idx + 1} of {item.job_url}: {e}")
+            result = "Failed"
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: item_done(item, "Failed" if future.exception() else future.result(), metrics))
+        else:
+            item_done(item, result, metrics)
+        return result
+
+    # Claim and download videos until there is nothing left, waiting while other workers hold leases
+    def work(merge_queue: MergeQueue, bandwidth):
+        while True:
+            item = queue.claim(worker, lease)
+            if item is None:
+                if queue.get_counts().get("leased", 0) == 0:
+                    return
+                time.sleep(poll_interval)
+                continue
+            with held_lock:
+                held[(item.job_id, item.video_url)] = item
+            download_item(item, merge_queue, bandwidth)
+
+    renewer = threading.Thread(target=renew_leases, name="lease-renewer", daemon=True)
+    renewer.start()
+    try:
+        with items_task, scheduler.add(f"queue:{db_path}", priority, max_rate) as bandwidth, MergeQueue(workers=merge_workers, max_pending=workers) as merge_queue:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for future in [executor.submit(work, merge_queue, bandwidth) for _ in range(workers)]:
+                    future.result()
+    finally:
+        stopped.set()
+        renewer.join()
+    # --------------------------------------------------------------------------
+    print_separator()
+    for status in ("Downloaded", "Skipped", "Failed"):
+        print_info(f"{status}: {counts[status]}")
+    print_counts(queue)
+    queue.close()
+    return dict(counts)
+
+# ------------------------------------------------------------------------------